@@ -0,0 +1,337 @@
+import argparse
+import json
+import time
+
+import numpy
+
+from image_wrapper import ImageWrapper, MEAN_KERNEL
+from ga_image_applier import GAImageApplier, BATCHED_ENGINE, ENGINES, MAX_GENERATIONS, TIME_BUDGET, MAX_PASSES
+from random_source import RandomSource
+from noise_corpus import SALT_PEPPER_NOISE, CHROMA_NOISE, GAUSSIAN_NOISE, PERIODIC_NOISE
+from noise_classifier import UNKNOWN_NOISE, noise_classify, impulses_get, spectrum_peaks_get
+
+# Strategies to repair an image:
+GA_STRATEGY = "ga" # The GA over the noisy pixels, see GAImageApplier
+IMPULSE_MEDIAN_STRATEGY = "impulse_median" # The median over the impulses, the GA over the ambiguous ones
+MEAN_STRATEGY = "mean" # The mean kernel of the deterministic denoiser
+NOTCH_STRATEGY = "notch" # The peaks of the spectrum are removed
+
+"""
+The cheapest strategy that repairs each type of noise. The GA is kept
+for the chroma noise, that it was made for, and for what the
+classifier can not name.
+"""
+NOISE_STRATEGIES = {
+    SALT_PEPPER_NOISE: IMPULSE_MEDIAN_STRATEGY,
+    CHROMA_NOISE: GA_STRATEGY,
+    GAUSSIAN_NOISE: MEAN_STRATEGY,
+    PERIODIC_NOISE: NOTCH_STRATEGY,
+    UNKNOWN_NOISE: GA_STRATEGY
+}
+
+"""
+The time the GA would take is estimated by repairing a few noisy pixels
+(taken at random) of a copy of the image, and scaling it to all the
+noisy pixels. The quick estimate, reported by default, detects the
+noisy pixels of a crop of ESTIMATE_CROP_SIZE x ESTIMATE_CROP_SIZE at the
+center of the image only, and scales their share to the whole image.
+The full estimate detects the noisy pixels of the whole image, as the
+GA would, which takes most of its time, and samples more of them.
+"""
+ESTIMATE_CROP_SIZE = 128
+QUICK_ESTIMATE_SAMPLE_PIXELS = 64
+ESTIMATE_SAMPLE_PIXELS = 256
+
+# Frequencies around each peak of the spectrum that the notch removes too:
+NOTCH_REACH = 1
+
+def notch_filter_apply(image, reach=NOTCH_REACH):
+    """
+    Removes the periodic noise of an image: the peaks of its spectrum
+    (see spectrum_peaks_get) and the frequencies around them are set to
+    zero in every channel.
+
+    :param image: numpy array (height, width) or (height, width, channels),
+    not modified
+    :return: the filtered image, with the type of the input, and the
+    number of peaks removed
+    :rtype: tuple (numpy array, int)
+    """
+    channels = image if image.ndim == 3 else image[:, :, numpy.newaxis]
+    peaks, _ = spectrum_peaks_get(channels.mean(axis=2))
+
+    # Growing the peaks, the spectrum wraps around:
+    notch = numpy.zeros(peaks.shape, dtype=bool)
+    for offset_y in range(-reach, reach + 1):
+        for offset_x in range(-reach, reach + 1):
+            notch |= numpy.roll(peaks, (offset_y, offset_x), axis=(0, 1))
+
+    spectrum = numpy.fft.fft2(channels, axes=(0, 1))
+    spectrum[notch] = 0
+    filtered = numpy.fft.ifft2(spectrum, axes=(0, 1)).real
+
+    max_value = numpy.iinfo(image.dtype).max if numpy.issubdtype(image.dtype, numpy.integer) else None
+    filtered = numpy.clip(numpy.round(filtered), 0, max_value).astype(image.dtype)
+    return filtered.reshape(image.shape), int(peaks.sum())
+
+class AutoDenoiser:
+    """
+    This class estimates the type of noise of an image (see
+    noise_classify), and repairs it with the cheapest strategy for that
+    noise (see NOISE_STRATEGIES), instead of applying the GA to every
+    image:
+
+    - IMPULSE_MEDIAN_STRATEGY: each impulse is replaced by the median of
+    its neighbors that are not impulses. Only the ambiguous impulses,
+    without enough of those neighbors, go through the GA, once the rest
+    are repaired.
+    - MEAN_STRATEGY: the gaussian noise hits every pixel, so the GA
+    flags a large part of the image and evolves each of them against a
+    noisy neighborhood. The mean kernel averages the noise out for a
+    fraction of the time.
+    - NOTCH_STRATEGY: the periodic noise is a few frequencies, removed
+    from the spectrum.
+    - GA_STRATEGY: the GA, as GAImageApplier.start_ga_over_image.
+
+    The report of each image tells the noise found, the strategy chosen,
+    and how much faster it was than the GA: a quick estimate by default
+    (see ga_seconds_quick_estimate), a full one on demand (see
+    full_estimate_set and ga_seconds_estimate).
+
+    :param engine: engine of the GA, one of ENGINES
+    """
+    def __init__(self, engine=BATCHED_ENGINE):
+        self.engine = engine
+        self.max_generations = MAX_GENERATIONS
+        self.time_budget = TIME_BUDGET
+        self.max_passes = MAX_PASSES
+        self.random_source = RandomSource()
+        self.full_estimate = False # True to estimate the time of the GA from a detection over the whole image
+        self.metrics = None # MetricsCollector, None to not collect metrics
+        self.verbose = True
+
+    # -- Setters & getters --
+    def max_generations_set(self, max_generations):
+        self.max_generations = max_generations
+    def time_budget_set(self, time_budget):
+        self.time_budget = time_budget
+    def max_passes_set(self, max_passes):
+        self.max_passes = max_passes
+    def random_source_set(self, random_source):
+        self.random_source = random_source
+    def full_estimate_set(self, full_estimate):
+        self.full_estimate = full_estimate
+    def metrics_set(self, metrics):
+        self.metrics = metrics
+    def verbose_set(self, verbose):
+        self.verbose = verbose
+    # -- End of Setters & getters --
+
+    def ga_applier_create(self, image_obj):
+        """
+        :return: a GAImageApplier over the image, with the settings of
+        this instance
+        :rtype: GAImageApplier
+        """
+        ga_applier = GAImageApplier()
+        ga_applier.image_obj_set(image_obj)
+        ga_applier.engine_set(self.engine)
+        ga_applier.max_generations_set(self.max_generations)
+        ga_applier.time_budget_set(self.time_budget)
+        ga_applier.max_passes_set(self.max_passes)
+        ga_applier.random_source_set(self.random_source)
+        ga_applier.keep_resulting_images_set(False)
+        ga_applier.verbose_set(False)
+        if self.metrics is not None:
+            ga_applier.metrics_set(self.metrics)
+        return ga_applier
+
+    def ga_seconds_quick_estimate(self, image_obj):
+        """
+        Estimates the seconds the GA would take over the image from a
+        crop at its center (see ESTIMATE_CROP_SIZE): the noisy pixels
+        detected in the crop are scaled to the whole image, and timed by
+        the GA over QUICK_ESTIMATE_SAMPLE_PIXELS of them (at most the
+        time budget). The detection over the whole image is not
+        included, see ga_seconds_estimate.
+
+        :param image_obj: ImageWrapper with the image loaded, not modified
+        :return: the estimated seconds, and the noisy pixels the GA would
+        repair
+        :rtype: tuple (float, int)
+        """
+        image = image_obj.get_np_image_format()
+        top = max((image.shape[0] - ESTIMATE_CROP_SIZE)//2, 0)
+        left = max((image.shape[1] - ESTIMATE_CROP_SIZE)//2, 0)
+        crop_obj = ImageWrapper("")
+        crop_obj.np_image_format_set(numpy.array(image[top:top + ESTIMATE_CROP_SIZE, left:left + ESTIMATE_CROP_SIZE]))
+        ga_applier = self.ga_applier_create(crop_obj)
+        # The estimate is not part of the metrics of the run:
+        ga_applier.metrics_set(None)
+
+        noise_mask, _ = ga_applier.noise_mask_calculate()
+        noisy_pixels_num = int(round(noise_mask.mean()*image.shape[0]*image.shape[1]))
+        noisy_pixels_y, noisy_pixels_x = numpy.nonzero(noise_mask)
+        if len(noisy_pixels_y) == 0:
+            return 0.0, 0
+
+        sample = numpy.sort(self.random_source.generator_get().choice(
+            len(noisy_pixels_y), min(QUICK_ESTIMATE_SAMPLE_PIXELS, len(noisy_pixels_y)), replace=False))
+        ga_applier.deadline = time.monotonic() + self.time_budget if self.time_budget is not None else None
+
+        start_time = time.perf_counter()
+        ga_applier.pixels_repair(noisy_pixels_y[sample], noisy_pixels_x[sample])
+        ga_seconds = (time.perf_counter() - start_time)*noisy_pixels_num/len(sample)
+
+        if self.time_budget is not None:
+            ga_seconds = min(ga_seconds, self.time_budget)
+        return ga_seconds, noisy_pixels_num
+
+    def ga_seconds_estimate(self, image_obj):
+        """
+        Estimates the seconds the GA would take over the image: the
+        detection of the noisy pixels, plus the GA over a sample of
+        ESTIMATE_SAMPLE_PIXELS of them scaled to all of them (at most
+        the time budget).
+
+        :param image_obj: ImageWrapper with the image loaded, not modified
+        :return: the estimated seconds, and the noisy pixels the GA would
+        repair
+        :rtype: tuple (float, int)
+        """
+        image_copy = ImageWrapper("")
+        image_copy.np_image_format_set(numpy.array(image_obj.get_np_image_format()))
+        ga_applier = self.ga_applier_create(image_copy)
+        # The estimate is not part of the metrics of the run:
+        ga_applier.metrics_set(None)
+
+        start_time = time.perf_counter()
+        noise_mask, _ = ga_applier.noise_mask_calculate()
+        detection_seconds = time.perf_counter() - start_time
+
+        noisy_pixels_y, noisy_pixels_x = numpy.nonzero(noise_mask)
+        if len(noisy_pixels_y) == 0:
+            return detection_seconds, 0
+
+        sample = numpy.sort(self.random_source.generator_get().choice(
+            len(noisy_pixels_y), min(ESTIMATE_SAMPLE_PIXELS, len(noisy_pixels_y)), replace=False))
+        ga_applier.deadline = time.monotonic() + self.time_budget if self.time_budget is not None else None
+
+        start_time = time.perf_counter()
+        ga_applier.pixels_repair(noisy_pixels_y[sample], noisy_pixels_x[sample])
+        sample_seconds = time.perf_counter() - start_time
+
+        ga_seconds = sample_seconds*len(noisy_pixels_y)/len(sample)
+        if self.time_budget is not None:
+            ga_seconds = min(ga_seconds, self.time_budget)
+        return detection_seconds + ga_seconds, len(noisy_pixels_y)
+
+    def impulses_repair(self, image_obj):
+        """
+        Repairs the impulses of the image, in place, see
+        IMPULSE_MEDIAN_STRATEGY.
+
+        :return: the impulses repaired with the median, and with the GA
+        :rtype: tuple of 2 ints
+        """
+        impulses_y, impulses_x, medians, ambiguous = impulses_get(image_obj)
+
+        image = image_obj.get_np_image_format()
+        image_obj.pixels_set(impulses_y[~ambiguous], impulses_x[~ambiguous], numpy.round(medians[~ambiguous]).astype(
+            image.dtype).reshape(image[impulses_y[~ambiguous], impulses_x[~ambiguous]].shape))
+
+        if ambiguous.any():
+            ga_applier = self.ga_applier_create(image_obj)
+            ga_applier.deadline = time.monotonic() + self.time_budget if self.time_budget is not None else None
+            ga_applier.pixels_repair(impulses_y[ambiguous], impulses_x[ambiguous])
+
+        return int((~ambiguous).sum()), int(ambiguous.sum())
+
+    def denoise(self, image_obj):
+        """
+        Classifies the noise of the image and repairs it, in place, with
+        the strategy for that noise.
+
+        :param image_obj: ImageWrapper with the image loaded
+        :return: the report of the image: the classification (see
+        noise_classify), the strategy, the seconds it took (classifying
+        included), and, if the strategy is not the GA, the estimated
+        seconds of the GA and the noisy pixels it would repair (quick or
+        full, see full_estimate), the estimated speedup over it and the
+        seconds the estimate took (not included in the seconds of the
+        image)
+        :rtype: dict
+        """
+        start_time = time.perf_counter()
+        report = noise_classify(image_obj)
+        report["strategy"] = NOISE_STRATEGIES[report["noise_type"]]
+        report["classify_seconds"] = time.perf_counter() - start_time
+
+        if report["strategy"] != GA_STRATEGY:
+            estimate_start_time = time.perf_counter()
+            estimate = self.ga_seconds_estimate if self.full_estimate else self.ga_seconds_quick_estimate
+            report["estimated_ga_seconds"], report["estimated_ga_pixels"] = estimate(image_obj)
+            report["estimate_seconds"] = time.perf_counter() - estimate_start_time
+
+        repair_start_time = time.perf_counter()
+        if report["strategy"] == IMPULSE_MEDIAN_STRATEGY:
+            report["median_pixels"], report["ga_pixels"] = self.impulses_repair(image_obj)
+        elif report["strategy"] == MEAN_STRATEGY:
+            image_obj.denoise_salt_pepper_deterministically(kernel=MEAN_KERNEL)
+        elif report["strategy"] == NOTCH_STRATEGY:
+            filtered_image, report["notched_peaks"] = notch_filter_apply(image_obj.get_np_image_format())
+            image_obj.np_image_format_set(filtered_image)
+        else:
+            ga_applier = self.ga_applier_create(image_obj)
+            noise_mask, _ = ga_applier.noise_mask_calculate()
+            report["ga_pixels"] = int(noise_mask.sum())
+            ga_applier.start_ga_over_image()
+            report["capped_pixels"] = ga_applier.capped_pixels_get()
+        report["seconds"] = report["classify_seconds"] + time.perf_counter() - repair_start_time
+
+        if "estimated_ga_seconds" in report:
+            report["estimated_speedup"] = report["estimated_ga_seconds"]/max(report["seconds"], 1e-9)
+        elif report["strategy"] == GA_STRATEGY:
+            report["estimated_speedup"] = 1.0
+
+        if self.metrics is not None:
+            self.metrics.count("strategy_" + report["strategy"])
+            self.metrics.time_add("classification", report["classify_seconds"])
+
+        if self.verbose:
+            print("Noise: {} (density {:.4f}, sigma {:.2f})  strategy: {}  {:.3f} s".format(
+                report["noise_type"], report["density"], report["sigma"], report["strategy"], report["seconds"]), end="")
+            if "estimated_speedup" in report:
+                print("  estimated speedup over the GA: {:.1f}x".format(report["estimated_speedup"]), end="")
+            print()
+
+        return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Denoise an image with the strategy for its type of noise")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--engine", choices=ENGINES, default=BATCHED_ENGINE)
+    parser.add_argument("--max-generations", type=int, default=MAX_GENERATIONS)
+    parser.add_argument("--time-budget", type=float, default=TIME_BUDGET)
+    parser.add_argument("--full-estimate", action="store_true",
+                        help="estimate the time of the GA from a detection over the whole image, instead of a crop")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--report", default=None, help="json file to write the report to")
+    args = parser.parse_args()
+
+    image = ImageWrapper(args.input)
+    image.image_opener()
+
+    auto_denoiser = AutoDenoiser(args.engine)
+    auto_denoiser.max_generations_set(args.max_generations)
+    auto_denoiser.time_budget_set(args.time_budget)
+    auto_denoiser.full_estimate_set(args.full_estimate)
+    auto_denoiser.random_source_set(RandomSource(args.seed))
+    report = auto_denoiser.denoise(image)
+
+    image.set_result_image_name(args.output)
+    image.save()
+    if args.report is not None:
+        with open(args.report, "w") as report_file:
+            json.dump(report, report_file, indent=4)
@@ -0,0 +1,505 @@
+import os
+import struct
+import zlib
+
+from PIL import Image
+import numpy
+
+# Rows read, processed and written at once by the band-streamed mode:
+BAND_HEIGHT = 256
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_COMPRESS_LEVEL = 6
+
+"""
+PNG color type of each number of channels (2 dimensional images have 1
+channel): grayscale, grayscale with alpha, RGB and RGBA.
+"""
+PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+
+"""
+PNG color types with 16 bits channels that PIL reads reduced to 8 bits
+(grayscale with alpha, RGB and RGBA), so they are read by PNGBandReader.
+"""
+PNG_WIDE_COLOR_TYPES = (4, 2, 6)
+
+# PNG filter types of a scanline:
+PNG_FILTER_NONE = 0
+PNG_FILTER_SUB = 1
+PNG_FILTER_UP = 2
+PNG_FILTER_AVERAGE = 3
+PNG_FILTER_PAETH = 4
+
+"""
+PIL modes read as they are: grayscale and RGB, with or without alpha,
+with 8 bits channels, and 16 bits grayscale (PIL can read it in the I
+mode, as 32 bits integers). Any other mode is converted to one of them
+by pil_image_normalize.
+"""
+NATIVE_MODES = ("L", "LA", "RGB", "RGBA", "I;16", "I;16L", "I;16B", "I")
+
+# Modes whose last channel is alpha:
+ALPHA_MODES = ("LA", "RGBA")
+
+def pil_image_normalize(pil_image):
+    """
+    :return: the image in one of NATIVE_MODES (palette images keep their
+    transparency as alpha)
+    :rtype: PIL Image
+    """
+    if pil_image.mode in NATIVE_MODES:
+        return pil_image
+    if pil_image.mode == "1":
+        return pil_image.convert("L")
+    if pil_image.mode in ("PA", "RGBa", "La") or (pil_image.mode == "P" and "transparency" in pil_image.info):
+        return pil_image.convert("RGBA" if pil_image.mode != "La" else "LA")
+    return pil_image.convert("RGB")
+
+def pil_image_has_alpha(pil_image):
+    """
+    :return: True if the image, once normalized, has an alpha channel.
+    It does not load nor convert the image.
+    :rtype: bool
+    """
+    return pil_image.mode in ALPHA_MODES + ("PA", "RGBa", "La") or\
+        (pil_image.mode == "P" and "transparency" in pil_image.info)
+
+def pil_array_get(pil_image):
+    """
+    :param pil_image: image in one of NATIVE_MODES
+    :return: the image as a numpy array of 8 or 16 bits unsigned
+    integers, in the byte order of the machine
+    :rtype: numpy array
+    """
+    array = numpy.array(pil_image)
+    if array.dtype == numpy.int32:
+        array = numpy.clip(array, 0, numpy.iinfo(numpy.uint16).max).astype(numpy.uint16)
+    elif not array.dtype.isnative:
+        array = array.astype(array.dtype.newbyteorder("="))
+    return array
+
+def binary_file_open(image, mode):
+    """
+    :param image: a path, or a binary file object (e.g. io.BytesIO for an
+    image in memory), used from its current position
+    :param mode: "rb" or "wb"
+    :return: the file, and True if it was opened here (then it is closed
+    with the reader or the writer, a file object is left open)
+    :rtype: tuple (file, bool)
+    """
+    if hasattr(image, "read" if "r" in mode else "write"):
+        return image, False
+    return open(image, mode), True
+
+def image_8_bits_get(image):
+    """
+    :return: the image with 8 bits channels, for the formats that only
+    have 8 bits (e.g. the frames of a gif): 16 bits channels keep their
+    high byte
+    :rtype: numpy array of uint8
+    """
+    if image.dtype.itemsize > 1:
+        return (image >> 8).astype(numpy.uint8)
+    return image
+
+def png_wide_color_check(image):
+    """
+    :param image: a path or a binary file object, see binary_file_open
+    :return: True if the image is a PNG with 16 bits color channels, see
+    PNG_WIDE_COLOR_TYPES. Only the header is read.
+    :rtype: bool
+    """
+    png_header = png_header_get(image)
+    return png_header is not None and png_header[0] == 16 and png_header[1] in PNG_WIDE_COLOR_TYPES
+
+def png_band_read_check(image):
+    """
+    :param image: a path or a binary file object, see binary_file_open
+    :return: True if the image is a PNG that PNGBandReader reads: non
+    interlaced, with 8 or 16 bits channels and no palette. Only the
+    header is read.
+    :rtype: bool
+    """
+    png_header = png_header_get(image)
+    return png_header is not None and png_header[0] in (8, 16) and png_header[1] in PNG_COLOR_TYPES.values() and\
+        png_header[2] == 0
+
+def png_header_get(image):
+    """
+    :param image: a path or a binary file object, see binary_file_open
+    :return: the bit depth, the color type and the interlace method of
+    a PNG, None if the image is not a PNG. Only the header is read.
+    :rtype: tuple of 3 ints or None
+    """
+    png_file, file_owned = binary_file_open(image, "rb")
+    header = png_file.read(len(PNG_SIGNATURE) + 8 + 13)
+    if file_owned:
+        png_file.close()
+    if len(header) < len(PNG_SIGNATURE) + 8 + 13 or not header.startswith(PNG_SIGNATURE) or header[12:16] != b"IHDR":
+        return None
+    return header[24], header[25], header[28]
+
+def png_read(image):
+    """
+    Reads a whole PNG with PNGBandReader, keeping its bit depth.
+
+    :param image: a path or a binary file object, see binary_file_open
+    :return: the image, in the byte order of the machine
+    :rtype: numpy array
+    """
+    reader = PNGBandReader(image)
+    try:
+        return reader.band_read(reader.shape[0])
+    finally:
+        reader.close()
+
+def image_to_memmap(image_path, scratch_path, band_height=BAND_HEIGHT):
+    """
+    Copies an image into a .npy file, opened as a numpy memmap, band by
+    band.
+
+    A .npy input is itself read as a memmap, so it is never fully
+    loaded, and a non interlaced PNG with 8 or 16 bits channels and no
+    palette (see png_band_read_check) is decoded band by band by
+    PNGBandReader, so neither needs the whole image in RAM. Any other
+    format (an interlaced or palette PNG, a JPEG, a TIFF...) is decoded
+    by PIL, which needs the whole decoded image once; it is released as
+    soon as it is copied, so the rest of the processing only keeps bands
+    in RAM.
+
+    :param image_path: the path of the image
+    :param scratch_path: the path of the .npy file to create
+    :return: the image, backed by scratch_path
+    :rtype: numpy.memmap
+    """
+    if image_path.lower().endswith(".npy"):
+        source = numpy.load(image_path, mmap_mode="r")
+    elif png_band_read_check(image_path):
+        source = PNGBandReader(image_path)
+    else:
+        source = pil_image_normalize(Image.open(image_path))
+        source.load()
+
+    if isinstance(source, numpy.ndarray):
+        shape, dtype = source.shape, source.dtype
+    elif isinstance(source, PNGBandReader):
+        shape, dtype = source.shape, source.dtype.newbyteorder("=")
+    else:
+        # Taking the shape and type PIL gives, from a single row:
+        first_row = pil_array_get(source.crop((0, 0, source.width, 1)))
+        shape, dtype = (source.height,) + first_row.shape[1:], first_row.dtype
+
+    image = numpy.lib.format.open_memmap(scratch_path, mode="w+", dtype=dtype, shape=shape)
+    for top in range(0, shape[0], band_height):
+        bottom = min(top + band_height, shape[0])
+        if isinstance(source, numpy.ndarray):
+            image[top:bottom] = source[top:bottom]
+        elif isinstance(source, PNGBandReader):
+            image[top:bottom] = source.band_read(bottom - top)
+        else:
+            image[top:bottom] = pil_array_get(source.crop((0, top, source.width, bottom)))
+    image.flush()
+
+    if isinstance(source, PNGBandReader):
+        source.close()
+
+    del source
+    return image
+
+class PNGBandWriter:
+    """
+    Writes a PNG file band by band: each band of rows is compressed and
+    written as IDAT chunks right away, so the image is never needed
+    whole in RAM, as PIL would need it.
+
+    :param path: the path of the PNG to write, or a binary file object
+    (see binary_file_open)
+    :param shape: (height, width) or (height, width, channels), with 1
+    to 4 channels
+    :param dtype: numpy.uint8 or numpy.uint16
+    """
+    def __init__(self, path, shape, dtype, compress_level=PNG_COMPRESS_LEVEL):
+        channels_num = shape[2] if len(shape) == 3 else 1
+        if channels_num not in PNG_COLOR_TYPES:
+            raise ValueError("PNG images have 1 to 4 channels, not " + str(channels_num))
+        dtype = numpy.dtype(dtype)
+        if dtype not in (numpy.dtype(numpy.uint8), numpy.dtype(numpy.uint16)):
+            raise ValueError("PNG images have 8 or 16 bits channels, not " + str(dtype))
+
+        self.height = shape[0]
+        self.width = shape[1]
+        self.row_values = self.width*channels_num
+        self.rows_written = 0
+        # PNG stores 16 bits channels as big endian:
+        self.dtype = dtype.newbyteorder(">") if dtype.itemsize > 1 else dtype
+        self.compressor = zlib.compressobj(compress_level)
+
+        self.png_file, self.file_owned = binary_file_open(path, "wb")
+        self.png_file.write(PNG_SIGNATURE)
+        self.chunk_write(b"IHDR", struct.pack(">IIBBBBB", self.width, self.height, 8*dtype.itemsize,
+                                              PNG_COLOR_TYPES[channels_num], 0, 0, 0))
+
+    def chunk_write(self, chunk_type, data):
+        self.png_file.write(struct.pack(">I", len(data)))
+        self.png_file.write(chunk_type)
+        self.png_file.write(data)
+        self.png_file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+    def band_write(self, rows):
+        """
+        Writes the next rows of the image.
+
+        :param rows: numpy array (rows, width) or (rows, width, channels)
+        """
+        rows = numpy.ascontiguousarray(rows, dtype=self.dtype).reshape((len(rows), self.row_values))
+
+        # Each row starts with its filter type, 0 (no filter):
+        scanlines = numpy.zeros((len(rows), 1 + self.row_values*self.dtype.itemsize), dtype=numpy.uint8)
+        scanlines[:, 1:] = rows.view(numpy.uint8).reshape((len(rows), self.row_values*self.dtype.itemsize))
+
+        compressed = self.compressor.compress(scanlines.tobytes())
+        if compressed:
+            self.chunk_write(b"IDAT", compressed)
+        self.rows_written += len(rows)
+
+    def close(self):
+        """
+        Writes the remaining compressed data and the end of the PNG.
+        """
+        if self.rows_written != self.height:
+            raise ValueError("{} rows were written, the image has {}".format(self.rows_written, self.height))
+        self.chunk_write(b"IDAT", self.compressor.flush())
+        self.chunk_write(b"IEND", b"")
+        if self.file_owned:
+            self.png_file.close()
+
+class PNGBandReader:
+    """
+    Reads a PNG file band by band, the counterpart of PNGBandWriter:
+    the IDAT chunks are decompressed as the rows are needed, so the
+    image is never needed whole in RAM. Unlike PIL, it keeps the 16
+    bits of the color channels.
+
+    Only non interlaced grayscale, RGB, grayscale with alpha and RGBA
+    images, with 8 or 16 bits channels, are supported.
+
+    :param path: the path of the PNG to read, or a binary file object
+    (see binary_file_open)
+    """
+    def __init__(self, path):
+        self.png_file, self.file_owned = binary_file_open(path, "rb")
+        if self.png_file.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+            self.close()
+            raise ValueError(str(path) + " is not a PNG image")
+
+        chunk_type, data = self.chunk_read()
+        width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", data)
+        channels_nums = {png_color_type: channels_num for channels_num, png_color_type in PNG_COLOR_TYPES.items()}
+        if chunk_type != b"IHDR" or interlace or bit_depth not in (8, 16) or color_type not in channels_nums:
+            self.close()
+            raise ValueError("Only non interlaced PNG images with 8 or 16 bits channels are supported")
+
+        channels_num = channels_nums[color_type]
+        self.shape = (height, width) if channels_num == 1 else (height, width, channels_num)
+        # PNG stores 16 bits channels as big endian:
+        self.dtype = numpy.dtype(">u2") if bit_depth == 16 else numpy.dtype(numpy.uint8)
+        self.pixel_bytes = channels_num*self.dtype.itemsize
+        self.row_bytes = width*self.pixel_bytes
+        self.rows_read = 0
+        self.decompressor = zlib.decompressobj()
+        self.decompressed = bytearray()
+        self.previous_row = numpy.zeros(self.row_bytes, dtype=numpy.uint8)
+
+    def chunk_read(self):
+        """
+        :return: the type and the data of the next chunk
+        :rtype: tuple (bytes, bytes)
+        """
+        header = self.png_file.read(8)
+        if len(header) < 8:
+            raise ValueError("The PNG image ends before its IEND chunk")
+        length, chunk_type = struct.unpack(">I4s", header)
+        data = self.png_file.read(length)
+        if len(data) < length or len(self.png_file.read(4)) < 4: # CRC
+            raise ValueError("The PNG image ends in the middle of a chunk")
+        return chunk_type, data
+
+    def row_unfilter(self, filter_type, row):
+        """
+        Reverses the filter of a scanline, against the previous row.
+
+        :param row: the filtered bytes of the row, numpy array of uint8
+        :return: the bytes of the row
+        :rtype: numpy array of uint8
+        """
+        if filter_type == PNG_FILTER_NONE:
+            return row.copy()
+        if filter_type == PNG_FILTER_UP:
+            return row + self.previous_row
+        if filter_type == PNG_FILTER_SUB:
+            # Each byte adds the byte of the pixel on its left, a running
+            # sum over the pixels (uint8 wraps around as the filter does):
+            return numpy.cumsum(row.reshape(-1, self.pixel_bytes), axis=0, dtype=numpy.uint8).reshape(-1)
+
+        # The Average and Paeth filters depend on the bytes just
+        # reconstructed on the left:
+        if filter_type == PNG_FILTER_AVERAGE:
+            return self.average_unfilter(row)
+        if filter_type == PNG_FILTER_PAETH:
+            return self.paeth_unfilter(row)
+        raise ValueError("Unknown PNG filter type " + str(filter_type))
+
+    def average_unfilter(self, row):
+        """
+        Reverses the Average filter: each byte adds the mean (rounded
+        down) of the byte on its left and the byte above.
+
+        A byte needs the byte on its left reconstructed first, so the
+        whole row is reconstructed with numpy from the bytes on the left
+        of the previous pass, until it does not change. A pass gets at
+        least one more pixel right, and as the mean halves the left
+        byte, a wrong left byte is forgotten after a few pixels: a row
+        takes a few tens of passes whatever its width.
+
+        :param row: the filtered bytes of the row, numpy array of uint8
+        :return: the bytes of the row
+        :rtype: numpy array of uint8
+        """
+        filtered = row.astype(numpy.int16)
+        above = self.previous_row.astype(numpy.int16)
+        # The bytes of the row after pixel_bytes zeros, the left of the
+        # first pixel:
+        result = numpy.zeros(self.pixel_bytes + len(row), dtype=numpy.int16)
+        while True:
+            reconstructed = (filtered + ((result[:-self.pixel_bytes] + above) >> 1)) & 0xFF
+            if numpy.array_equal(reconstructed, result[self.pixel_bytes:]):
+                return reconstructed.astype(numpy.uint8)
+            result[self.pixel_bytes:] = reconstructed
+
+    def paeth_unfilter(self, row):
+        """
+        Reverses the Paeth filter: each byte adds the byte on its left,
+        above or above on the left, the closest one to
+        left + above - upper left.
+
+        The whole row is reconstructed with numpy from the choices of the
+        previous pass: the bytes adding the byte above or upper left are
+        known at once, and a run of bytes adding the byte on their left
+        is a running sum from the byte before the run. The choices are
+        then made again from the new bytes on the left, until they do
+        not change. The choices up to the first wrong one were right, so
+        a pass gets at least one more pixel right; a row takes 10 to 20
+        passes in practice.
+
+        :param row: the filtered bytes of the row, numpy array of uint8
+        :return: the bytes of the row
+        :rtype: numpy array of uint8
+        """
+        # One line per pixel, one column per byte of the pixel:
+        filtered = row.astype(numpy.int16).reshape(-1, self.pixel_bytes)
+        above = self.previous_row.astype(numpy.int16).reshape(-1, self.pixel_bytes)
+        upper_left = numpy.zeros_like(above)
+        upper_left[1:] = above[:-1]
+        gradient = above - upper_left
+        distances_left = numpy.abs(gradient)
+        running_sums = numpy.cumsum(row.reshape(-1, self.pixel_bytes), axis=0, dtype=numpy.uint8).astype(numpy.int16)
+        positions = numpy.arange(len(row)).reshape(-1, self.pixel_bytes)
+        # What a byte starting a run adds to the running sum, and 0 at
+        # the end, for the runs from the left of the first pixel:
+        run_offsets = numpy.zeros(len(row) + 1, dtype=numpy.int16)
+
+        result = above
+        left = numpy.zeros_like(filtered)
+        while True:
+            left[1:] = result[:-1]
+            to_upper_left = left - upper_left
+            distances_above = numpy.abs(to_upper_left)
+            distances_upper_left = numpy.abs(to_upper_left + gradient)
+            adds_left = (distances_left <= distances_above) & (distances_left <= distances_upper_left)
+            run_offsets[:-1] = (filtered - running_sums +
+                                numpy.where(distances_above <= distances_upper_left, above, upper_left)).reshape(-1)
+            # The position of the byte starting the run of each byte, -1
+            # for the run from the left of the first pixel:
+            run_starts = numpy.maximum.accumulate(numpy.where(adds_left, -1, positions), axis=0)
+            reconstructed = (run_offsets[run_starts] + running_sums) & 0xFF
+            if numpy.array_equal(reconstructed, result):
+                return reconstructed.reshape(-1).astype(numpy.uint8)
+            result = reconstructed
+
+    def band_read(self, rows_num):
+        """
+        Reads the next rows of the image.
+
+        :param rows_num: rows to read, fewer are read at the end of the image
+        :return: numpy array (rows, width) or (rows, width, channels), in
+        the byte order of the machine
+        :rtype: numpy array
+        """
+        rows_num = min(rows_num, self.shape[0] - self.rows_read)
+        scanline_bytes = 1 + self.row_bytes
+        while len(self.decompressed) < rows_num*scanline_bytes:
+            chunk_type, data = self.chunk_read()
+            if chunk_type == b"IDAT":
+                self.decompressed += self.decompressor.decompress(data)
+            elif chunk_type == b"IEND":
+                raise ValueError("The PNG image ends before its last row")
+
+        scanlines = numpy.frombuffer(bytes(self.decompressed[:rows_num*scanline_bytes]),
+                                     dtype=numpy.uint8).reshape(rows_num, scanline_bytes)
+        rows = numpy.empty((rows_num, self.row_bytes), dtype=numpy.uint8)
+        for row_index, scanline in enumerate(scanlines):
+            self.previous_row = self.row_unfilter(scanline[0], scanline[1:])
+            rows[row_index] = self.previous_row
+        del self.decompressed[:rows_num*scanline_bytes]
+        self.rows_read += rows_num
+
+        return rows.view(self.dtype).reshape((rows_num,) + self.shape[1:]).astype(self.dtype.newbyteorder("="))
+
+    def close(self):
+        if self.file_owned:
+            self.png_file.close()
+
+class NpyBandWriter:
+    """
+    Writes a .npy file band by band, through a memmap.
+
+    :param path: the path of the .npy to write
+    :param shape: shape of the image
+    :param dtype: type of the channels
+    """
+    def __init__(self, path, shape, dtype):
+        self.image = numpy.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+        self.rows_written = 0
+
+    def band_write(self, rows):
+        self.image[self.rows_written:self.rows_written + len(rows)] = rows
+        self.rows_written += len(rows)
+
+    def close(self):
+        self.image.flush()
+        del self.image
+
+def band_writer_create(path, shape, dtype):
+    """
+    :return: the band writer for the format of the path, .png or .npy
+    :rtype: PNGBandWriter or NpyBandWriter
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".png":
+        return PNGBandWriter(path, shape, dtype)
+    if extension == ".npy":
+        return NpyBandWriter(path, shape, dtype)
+    raise ValueError("Band-streamed output supports .png and .npy files, not " + path)
+
+def image_band_save(image, path, band_height=BAND_HEIGHT):
+    """
+    Writes an image (usually a memmap) band by band, so only one band
+    is in RAM at a time.
+
+    :param image: numpy array or memmap
+    :param path: the path of the .png or .npy to write
+    """
+    writer = band_writer_create(path, image.shape, image.dtype)
+    for top in range(0, image.shape[0], band_height):
+        writer.band_write(image[top:top + band_height])
+    writer.close()
@@ -0,0 +1,321 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy
+
+from image_wrapper import ImageWrapper, MEAN_KERNEL, MEDIAN_KERNEL, ADAPTIVE_MEDIAN_KERNEL
+from ga_image_applier import GAImageApplier, PIXEL_ENGINE, BATCHED_ENGINE, DIRECT_ENGINE, MAX_GENERATIONS, TIME_BUDGET,\
+    MAX_PASSES
+from frame_recorder import FrameRecorder
+from random_source import RandomSource
+from checkpoint import Checkpointer
+from detection_cache import DetectionCache
+from auto_denoiser import AutoDenoiser
+from ga_tuner import profile_load
+
+# Files taken from the input directories:
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+
+# Methods: the GA with each engine, the deterministic denoiser with
+# each kernel, and the strategy for the noise found in each image (see
+# AutoDenoiser)
+GA_PIXEL_METHOD = "ga_" + PIXEL_ENGINE
+GA_BATCHED_METHOD = "ga_" + BATCHED_ENGINE
+GA_DIRECT_METHOD = "ga_" + DIRECT_ENGINE
+GA_METHODS = {GA_PIXEL_METHOD: PIXEL_ENGINE, GA_BATCHED_METHOD: BATCHED_ENGINE, GA_DIRECT_METHOD: DIRECT_ENGINE}
+DETERMINISTIC_METHODS = [MEAN_KERNEL, MEDIAN_KERNEL, ADAPTIVE_MEDIAN_KERNEL]
+AUTO_METHOD = "auto"
+METHODS = list(GA_METHODS) + DETERMINISTIC_METHODS + [AUTO_METHOD]
+DEFAULT_METHOD = GA_BATCHED_METHOD
+
+SUMMARY_NAME = "summary.json"
+
+def inputs_collect(patterns):
+    """
+    Expands the inputs: a directory gives all its images (not the ones
+    of its subdirectories), anything else is taken as a glob pattern
+    ("**" matches subdirectories).
+
+    :param patterns: list of directories and glob patterns
+    :return: the paths of the images, sorted and without duplicates
+    :rtype: list
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern, recursive=True)
+
+        for candidate in candidates:
+            if os.path.isfile(candidate) and candidate.lower().endswith(IMAGE_EXTENSIONS):
+                paths.add(os.path.normpath(candidate))
+    return sorted(paths)
+
+def output_names_get(paths):
+    """
+    Gives each input a name for its outputs. The name is the file name
+    without extension, and if several inputs have the same one (images
+    with the same name in different directories, or a.png and a.jpg)
+    a counter is added, so no output overwrites another one.
+
+    :param paths: the sorted paths of the inputs
+    :return: one name for each path
+    :rtype: list
+    """
+    names = list()
+    used_names = set()
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        name = stem
+        counter = 1
+        while name in used_names:
+            name = "{}_{}".format(stem, counter)
+            counter += 1
+        used_names.add(name)
+        names.append(name)
+    return names
+
+def image_obj_denoise(image, method, max_generations=MAX_GENERATIONS, time_budget=TIME_BUDGET,
+                      max_passes=MAX_PASSES, gif_path=None, seed=None, checkpointer=None, profile=None,
+                      detection_cache=None):
+    """
+    Denoises an opened image, in place, with one of METHODS.
+
+    :param image: ImageWrapper with the image loaded
+    :param gif_path: where to write a gif with the progress of the GA,
+    None for no gif
+    :param seed: seed of the GA (int or numpy SeedSequence), None for a
+    different run each time
+    :param checkpointer: Checkpointer of the GA methods, to resume an
+    interrupted run, None for no checkpoints
+    :param profile: settings of the GA methods (see ga_tuner), None for
+    the defaults
+    :param detection_cache: DetectionCache of the GA methods, None to
+    always detect the noise
+    :return: the statistics of the GA, or the report of the AutoDenoiser
+    (empty for the deterministic methods)
+    :rtype: dict
+    """
+    statistics = dict()
+    if method in GA_METHODS:
+        ga_applier = GAImageApplier()
+        if profile is not None:
+            ga_applier.profile_apply(profile)
+        ga_applier.image_obj_set(image)
+        ga_applier.engine_set(GA_METHODS[method])
+        ga_applier.max_generations_set(max_generations)
+        ga_applier.time_budget_set(time_budget)
+        ga_applier.max_passes_set(max_passes)
+        ga_applier.random_source_set(RandomSource(seed))
+        ga_applier.keep_resulting_images_set(False)
+        ga_applier.verbose_set(False)
+        if gif_path is not None:
+            ga_applier.frame_recorder_set(FrameRecorder(gif_path))
+        if checkpointer is not None:
+            ga_applier.checkpointer_set(checkpointer)
+        if detection_cache is not None:
+            ga_applier.detection_cache_set(detection_cache)
+
+        noise_mask, _ = ga_applier.noise_mask_calculate()
+        noisy_pixels_num = int(noise_mask.sum())
+        ga_applier.start_ga_over_image()
+
+        statistics["noisy_pixels"] = noisy_pixels_num
+        statistics["capped_pixels"] = ga_applier.capped_pixels_get()
+    elif method in DETERMINISTIC_METHODS:
+        image.denoise_salt_pepper_deterministically(kernel=method)
+    elif method == AUTO_METHOD:
+        auto_denoiser = AutoDenoiser(BATCHED_ENGINE)
+        auto_denoiser.max_generations_set(max_generations)
+        auto_denoiser.time_budget_set(time_budget)
+        auto_denoiser.max_passes_set(max_passes)
+        auto_denoiser.random_source_set(RandomSource(seed))
+        auto_denoiser.verbose_set(False)
+        statistics.update(auto_denoiser.denoise(image))
+    else:
+        raise ValueError("Unknown method: " + str(method))
+    return statistics
+
+def image_denoise(job):
+    """
+    Denoises a single image and writes its outputs. It runs in a worker
+    process, and it never raises: an image that fails is reported in
+    the result, so it does not stop the rest of the batch.
+
+    :param job: dict with the input path, the output path, the method,
+    the gif path (None for no gif), max_generations, time_budget,
+    max_passes, seed, the checkpoint directory (None for no
+    checkpoints, it is removed once the output is written), the
+    profile of the GA (None for the defaults) and the directory of the
+    detection cache (None for no cache)
+    :return: the job, with its status, time and pixels
+    :rtype: dict
+    """
+    result = dict(job)
+    start_time = time.perf_counter()
+    try:
+        image = ImageWrapper(job["path"])
+        image.image_opener()
+        image_height, image_width = image.shape_get()[:2]
+
+        checkpointer = Checkpointer(job["checkpoint_dir"]) if job["checkpoint_dir"] is not None else None
+        detection_cache = DetectionCache(job["detection_cache_dir"]) if job["detection_cache_dir"] is not None else None
+        result.update(image_obj_denoise(image, job["method"], job["max_generations"], job["time_budget"],
+                                        job["max_passes"], job["gif_path"], job["seed"], checkpointer,
+                                        job["profile"], detection_cache))
+
+        image.set_result_image_name(job["output_path"])
+        image.save()
+        if checkpointer is not None:
+            checkpointer.remove()
+
+        result["pixels"] = image_height*image_width
+        result["status"] = "ok"
+    except Exception as error:
+        result["status"] = "failed"
+        result["error"] = "{}: {}".format(type(error).__name__, error)
+        result["traceback"] = traceback.format_exc()
+    result["seconds"] = time.perf_counter() - start_time
+    return result
+
+def batch_denoise(patterns, output_dir, method=DEFAULT_METHOD, workers=None, gif=False,
+                  max_generations=MAX_GENERATIONS, time_budget=TIME_BUDGET, max_passes=MAX_PASSES,
+                  seed=None, verbose=True, checkpoint_dir=None, profile=None, detection_cache_dir=None):
+    """
+    Denoises all the images of the inputs in a process pool, one image
+    per task. Each image is written to output_dir as <name>.png (and
+    <name>.gif with the progress of the GA if gif is True), see
+    output_names_get.
+
+    :param patterns: list of directories and glob patterns
+    :param method: one of METHODS
+    :param workers: number of worker processes, os.cpu_count() if None
+    :param time_budget: seconds the GA can spend on each image, None for
+    no budget
+    :param seed: seed of the batch, each image gets its own stream
+    spawned from it in the order of the inputs, so the outputs do not
+    depend on the number of workers. None for a different run each time.
+    :param checkpoint_dir: directory for the checkpoints of the GA, one
+    subdirectory per image. Running the same batch again resumes the
+    images that were interrupted. None for no checkpoints.
+    :param profile: settings of the GA methods, as ga_tuner writes them,
+    None for the defaults
+    :param detection_cache_dir: directory of a DetectionCache shared by
+    the workers, so running the same images again skips the detection.
+    None for no cache.
+    :return: the summary of the batch, also written as
+    output_dir/summary.json
+    :rtype: dict
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown method: " + str(method))
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    paths = inputs_collect(patterns)
+    image_seeds = numpy.random.SeedSequence(seed).spawn(len(paths))
+    jobs = list()
+    for path, name, image_seed in zip(paths, output_names_get(paths), image_seeds):
+        jobs.append({
+            "path": path,
+            "output_path": os.path.join(output_dir, name + ".png"),
+            "gif_path": os.path.join(output_dir, name + ".gif") if gif and method in GA_METHODS else None,
+            "method": method,
+            "max_generations": max_generations,
+            "time_budget": time_budget,
+            "max_passes": max_passes,
+            "checkpoint_dir": os.path.join(checkpoint_dir, name)
+            if checkpoint_dir is not None and method in GA_METHODS else None,
+            "profile": profile,
+            "detection_cache_dir": detection_cache_dir if method in GA_METHODS else None,
+            # An int, so the summary records it and the image can be
+            # repeated alone:
+            "seed": int(image_seed.generate_state(1)[0])
+        })
+
+    results = list()
+    start_time = time.perf_counter()
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(image_denoise, job): job for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as error:
+                    # The worker itself died (e.g. killed for using too much memory):
+                    result = dict(futures[future])
+                    result["status"] = "failed"
+                    result["error"] = "{}: {}".format(type(error).__name__, error)
+                results.append(result)
+
+                if verbose:
+                    if result["status"] == "ok" and "strategy" in result:
+                        print("{:<45} {:8.3f} s  {} -> {}".format(result["path"], result["seconds"],
+                                                                 result["noise_type"], result["strategy"]))
+                    elif result["status"] == "ok":
+                        print("{:<45} {:8.3f} s".format(result["path"], result["seconds"]))
+                    else:
+                        print("{:<45} FAILED: {}".format(result["path"], result["error"]))
+    total_time = time.perf_counter() - start_time
+
+    # Same order as the inputs, whatever order the workers finished in:
+    results.sort(key=lambda result: result["path"])
+    succeeded = [result for result in results if result["status"] == "ok"]
+    pixels = sum(result["pixels"] for result in succeeded)
+
+    summary = {
+        "method": method,
+        "workers": workers if workers is not None else os.cpu_count(),
+        "images": len(results),
+        "succeeded": len(succeeded),
+        "failed": [{"path": result["path"], "error": result["error"]}
+                   for result in results if result["status"] != "ok"],
+        "seconds": total_time,
+        "images_per_second": len(succeeded)/total_time if total_time > 0 else None,
+        "pixels_per_second": pixels/total_time if total_time > 0 else None,
+        "results": results
+    }
+
+    with open(os.path.join(output_dir, SUMMARY_NAME), "w") as summary_file:
+        json.dump(summary, summary_file, indent=2)
+
+    if verbose:
+        print("Images: {}  Succeeded: {}  Failed: {}  Time: {:.3f} s".format(
+            summary["images"], summary["succeeded"], len(summary["failed"]), total_time))
+
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Denoise whole directories of images")
+    parser.add_argument("inputs", nargs="+", help="directories and glob patterns of the images")
+    parser.add_argument("--output-dir", required=True, help="directory where the denoised images are written")
+    parser.add_argument("--method", choices=METHODS, default=DEFAULT_METHOD)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, one per CPU by default")
+    parser.add_argument("--gif", action="store_true", help="also write a gif with the progress of the GA")
+    parser.add_argument("--max-generations", type=int, default=MAX_GENERATIONS)
+    parser.add_argument("--time-budget", type=float, default=TIME_BUDGET, help="seconds of GA per image")
+    parser.add_argument("--max-passes", type=int, default=MAX_PASSES, help="GA passes over each image")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--checkpoint-dir", default=None,
+                        help="directory for the checkpoints of the GA, to resume an interrupted batch")
+    parser.add_argument("--profile", default=None, help="profile of the GA written by ga_tuner")
+    parser.add_argument("--detection-cache", default=None,
+                        help="directory of the detection cache, to skip the detection of the images seen before")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    summary = batch_denoise(args.inputs, args.output_dir, args.method, args.workers, args.gif,
+                            args.max_generations, args.time_budget, args.max_passes,
+                            args.seed, not args.quiet, args.checkpoint_dir,
+                            profile_load(args.profile) if args.profile is not None else None,
+                            args.detection_cache)
+
+    # A non zero exit code, so the pipeline notices the failures:
+    sys.exit(1 if summary["failed"] or not summary["images"] else 0)
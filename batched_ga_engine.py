@@ -0,0 +1,330 @@
+import time
+import numpy
+
+from random_source import RandomSource
+from population import GENERATION_SPLIT, generation_sizes_get, deviation_coefficients_get
+
+# Fallbacks for the pixels that reach a limit, as in GAImageApplier
+FALLBACK_BEST = "best"
+FALLBACK_MEDIAN = "median"
+
+class BatchedGAEngine:
+    """
+    This class applies the same GA as GAImageApplier, but instead of
+    evolving a list of Pixel instances for a single noisy pixel, it
+    evolves the populations of all the noisy pixels at once, stored
+    in a single numpy array of shape (noisy pixels, population, channels).
+    The populations and their fitness are float32, for any number of
+    channels and any bit depth.
+
+    Elitism, parent selection, crossover and mutation are done as
+    array operations over the whole batch. Once the fittest individual
+    of a noisy pixel is in the range [min_deviation_coefficient,
+    max_deviation_coefficient], that pixel is retired from the batch.
+
+    :param population_size: the size of the population of each pixel
+    :param min_deviation_coefficient: lower bound of the fitness of
+    the fittest individual
+    :param max_deviation_coefficient: upper bound of the fitness of
+    the fittest individual
+    :param max_pixel_value: mutants have channels in [0, max_pixel_value[
+    :param rng: RandomSource or numpy Generator, a new RandomSource is
+    created if not given
+    :param max_generations: the pixels still in the batch after this
+    number of generations are retired with the fallback, None for no limit
+    :param deadline: time.monotonic() value after which the pixels
+    still in the batch are retired with the fallback, None for no limit
+    :param fallback_strategy: FALLBACK_BEST or FALLBACK_MEDIAN
+    :param metrics: MetricsCollector, None to not collect metrics
+    :param split: the ratios of each generation, see population.GENERATION_SPLIT
+    :param max_population_size: size the populations grow to once they
+    reach growth_generation without a fit individual, None to not grow
+    :param growth_generation: see max_population_size
+    """
+    def __init__(self, population_size, min_deviation_coefficient,
+                 max_deviation_coefficient, max_pixel_value, rng=None,
+                 max_generations=None, deadline=None, fallback_strategy=FALLBACK_BEST,
+                 metrics=None, split=GENERATION_SPLIT, max_population_size=None, growth_generation=None):
+        self.min_deviation_coefficient = min_deviation_coefficient
+        self.max_deviation_coefficient = max_deviation_coefficient
+        self.max_pixel_value = max_pixel_value
+        self.rng = rng if rng is not None else RandomSource()
+        self.max_generations = max_generations
+        self.deadline = deadline
+        self.fallback_strategy = fallback_strategy
+        self.metrics = metrics
+        self.split = split
+        self.max_population_size = max_population_size
+        self.growth_generation = growth_generation
+        self.capped_pixels = {"generations": 0, "time_budget": 0}
+        self.base_population_size = population_size # The size before any growth
+        self.population_size_set(population_size)
+
+    def population_size_set(self, population_size):
+        """
+        Sets the size of the populations, and of each part of the next
+        generations.
+        """
+        self.population_size = population_size
+        self.elite_num, self.crossover_num, self.parents_num, self.mutant_num = generation_sizes_get(
+            population_size, self.split)
+
+    def reference_statistics_get(self, neighborhoods, neighborhoods_valid):
+        """
+        Calculates the mean and the standard deviation of each channel
+        of the valid neighbors of each noisy pixel. They are the
+        reference of the fitness of every generation, so they are
+        calculated only once.
+
+        :return: the mean and the standard deviation, with shape
+        (pixels, 1, channels)
+        :rtype: tuple of 2 numpy arrays
+        """
+        weights = neighborhoods_valid[:, :, numpy.newaxis]
+        valid_num = weights.sum(axis=1, keepdims=True)
+
+        reference_mean = numpy.where(weights, neighborhoods, 0).sum(axis=1, keepdims=True)/valid_num
+        reference_deviation = numpy.where(weights, neighborhoods - reference_mean, 0)
+        reference_std = numpy.sqrt((reference_deviation*reference_deviation).sum(axis=1, keepdims=True)/valid_num)
+
+        return reference_mean, reference_std
+
+    def population_pad(self, population, population_valid):
+        """
+        Completes the initial population of each pixel with mutants, up
+        to population_size valid individuals, as
+        GAImageApplier.create_population does for the edge pixels.
+
+        :param population: numpy array (pixels, window size, channels)
+        :param population_valid: boolean numpy array (pixels, window size)
+        :return: the population and its valid mask, with at least
+        population_size individuals
+        :rtype: tuple of 2 numpy arrays
+        """
+        pixels_num, individuals_num, channels_num = population.shape
+        if individuals_num < self.population_size:
+            extra_num = self.population_size - individuals_num
+            population = numpy.concatenate(
+                (population, numpy.zeros((pixels_num, extra_num, channels_num), dtype=population.dtype)), axis=1)
+            population_valid = numpy.concatenate(
+                (population_valid, numpy.zeros((pixels_num, extra_num), dtype=bool)), axis=1)
+
+        # The first invalid individuals of each pixel become the mutants
+        # it is missing:
+        missing = self.population_size - population_valid.sum(axis=1)
+        invalid_rank = numpy.cumsum(~population_valid, axis=1)
+        mutants_mask = ~population_valid & (invalid_rank <= missing[:, numpy.newaxis])
+        mutants_num = int(mutants_mask.sum())
+        if mutants_num > 0:
+            population = population.copy()
+            population[mutants_mask] = numpy.floor(
+                self.rng.random((mutants_num, channels_num))*self.max_pixel_value).astype(population.dtype)
+            population_valid = population_valid | mutants_mask
+
+        return population, population_valid
+
+    def population_fitness_calculate(self, population, population_valid, reference_mean, reference_std):
+        """
+        Calculates the fitness of every individual of every population,
+        the same way GAImageApplier.population_fitness_calculate does:
+        the absolute value of the sum of the deviation coefficients of
+        each channel, against the neighborhood of the noisy pixel.
+
+        The individuals that are not valid get an infinite fitness, so
+        they are sorted last.
+
+        :param population: numpy array (pixels, individuals, channels)
+        :param population_valid: boolean numpy array (pixels, individuals)
+        :param reference_mean: see reference_statistics_get
+        :param reference_std: see reference_statistics_get
+        :return: the fitness of each individual (pixels, individuals)
+        :rtype: numpy array
+        """
+        deviation_coeff = deviation_coefficients_get(population, reference_mean, reference_std)
+        fitness = numpy.abs(deviation_coeff.sum(axis=2))
+
+        fitness[~population_valid] = numpy.inf
+        return fitness
+
+    def population_sort(self, population, population_valid, reference_mean, reference_std):
+        """
+        Sorts each population based on the fitness of its individuals.
+
+        :return: the sorted population, its valid mask and its fitness
+        :rtype: tuple of 3 numpy arrays
+        """
+        fitness = self.population_fitness_calculate(population, population_valid, reference_mean, reference_std)
+        order = numpy.argsort(fitness, axis=1, kind="stable")
+
+        population = numpy.take_along_axis(population, order[:, :, numpy.newaxis], axis=1)
+        population_valid = numpy.take_along_axis(population_valid, order, axis=1)
+        fitness = numpy.take_along_axis(fitness, order, axis=1)
+
+        return population, population_valid, fitness
+
+    def next_generation_create(self, population, population_valid):
+        """
+        Creates the next generation of every (sorted) population: the
+        elite is bypassed, the children are created by choosing each
+        channel from one of two parents taken from the best individuals,
+        and some mutants are added to preserve diversity.
+
+        All the random numbers of the generation are drawn at once, as
+        slices of a single block.
+
+        :return: the new population and its valid mask
+        :rtype: tuple of 2 numpy arrays
+        """
+        pixels_num, _, channels_num = population.shape
+
+        parents_size = self.crossover_num*2
+        crossover_size = self.crossover_num*channels_num
+        mutants_size = self.mutant_num*channels_num
+        uniform = self.rng.random((pixels_num, parents_size + crossover_size + mutants_size))
+        parents_uniform, crossover_uniform, mutants_uniform = numpy.split(
+            uniform, (parents_size, parents_size + crossover_size), axis=1)
+
+        elite = population[:, :self.elite_num]
+        elite_valid = population_valid[:, :self.elite_num]
+
+        # Parents are chosen from the best individuals that are valid,
+        # as in the per-pixel GA, where the population of an edge pixel
+        # can be smaller than the population size:
+        parents_pool = numpy.minimum(population_valid.sum(axis=1), self.parents_num)
+        parents_index = (parents_uniform.reshape(pixels_num, self.crossover_num, 2) *
+                         parents_pool[:, numpy.newaxis, numpy.newaxis]).astype(numpy.intp)
+        parents_1 = numpy.take_along_axis(population, parents_index[:, :, 0, numpy.newaxis], axis=1)
+        parents_2 = numpy.take_along_axis(population, parents_index[:, :, 1, numpy.newaxis], axis=1)
+
+        # Channel-wise crossover between the 2 parents:
+        is_parent_1 = crossover_uniform.reshape(pixels_num, self.crossover_num, channels_num) < 0.5
+        children = numpy.where(is_parent_1, parents_1, parents_2)
+
+        mutants = numpy.floor(mutants_uniform*self.max_pixel_value).astype(population.dtype).reshape(
+            pixels_num, self.mutant_num, channels_num)
+
+        new_population = numpy.concatenate((elite, children, mutants), axis=1)
+        new_population_valid = numpy.concatenate(
+            (elite_valid, numpy.ones((pixels_num, self.crossover_num + self.mutant_num), dtype=bool)), axis=1)
+
+        return new_population, new_population_valid
+
+    def fallback_chromosomes_get(self, best_chromosomes, neighborhoods, neighborhoods_valid):
+        """
+        Gets the chromosomes that replace the noisy pixels that reached
+        a limit, based on the fallback_strategy.
+
+        :return: the best chromosomes with FALLBACK_BEST, or the median
+        of each channel of the valid neighbors with FALLBACK_MEDIAN
+        :rtype: numpy array (pixels, channels)
+        """
+        if self.fallback_strategy == FALLBACK_MEDIAN:
+            valid_neighbors = numpy.where(neighborhoods_valid[:, :, numpy.newaxis], neighborhoods, numpy.nan)
+            return numpy.nanmedian(valid_neighbors, axis=1).round()
+        return best_chromosomes
+
+    def evolve(self, neighborhoods, neighborhoods_valid, seed_chromosomes=None, seeds_valid=None):
+        """
+        Evolves the populations of all the noisy pixels, until the
+        fittest individual of each one is found, or until one of the
+        limits is reached.
+
+        :param neighborhoods: numpy array (pixels, window size, channels),
+        the initial population of each noisy pixel.
+        :param neighborhoods_valid: boolean numpy array (pixels, window size),
+        False for the neighbors out of the image.
+        :param seed_chromosomes: numpy array (pixels, channels), an extra
+        individual for the initial population of each pixel (a warm
+        start, e.g. the chromosome found for the same pixel in the
+        previous frame of a video). None for no seeds.
+        :param seeds_valid: boolean numpy array (pixels), False for the
+        pixels without seed. All the seeds are valid if None.
+        :return: the fittest chromosome of each noisy pixel
+        :rtype: numpy array (pixels, channels)
+        """
+        pixels_num, _, channels_num = neighborhoods.shape
+        fittest_chromosomes = numpy.zeros((pixels_num, channels_num), dtype=neighborhoods.dtype)
+        self.population_size_set(self.base_population_size)
+
+        population = neighborhoods.astype(numpy.float32)
+        population_valid = neighborhoods_valid
+        reference_mean, reference_std = self.reference_statistics_get(population, population_valid)
+
+        # The mutants that complete the populations are not part of the
+        # reference either:
+        population, population_valid = self.population_pad(population, population_valid)
+
+        # The seeds are not part of the reference, only of the population:
+        if seed_chromosomes is not None:
+            if seeds_valid is None:
+                seeds_valid = numpy.ones(pixels_num, dtype=bool)
+            population = numpy.concatenate((population, seed_chromosomes[:, numpy.newaxis].astype(population.dtype)), axis=1)
+            population_valid = numpy.concatenate((population_valid, seeds_valid[:, numpy.newaxis]), axis=1)
+        # Index of each pixel still in the batch:
+        active_pixels = numpy.arange(pixels_num)
+
+        # Best individual found so far for each pixel, for the fallback:
+        best_fitness = numpy.full(pixels_num, numpy.inf)
+        best_chromosomes = population[:, 0].copy()
+
+        generation = 1
+        while len(active_pixels) > 0:
+            if self.metrics is not None:
+                start_time = time.perf_counter()
+
+            population, population_valid, fitness = self.population_sort(population, population_valid,
+                                                                         reference_mean, reference_std)
+
+            if self.metrics is not None:
+                self.metrics.time_add("fitness", time.perf_counter() - start_time)
+
+            # Retire the pixels whose fittest individual is in range:
+            found = (self.min_deviation_coefficient <= fitness[:, 0]) &\
+                (fitness[:, 0] <= self.max_deviation_coefficient)
+            fittest_chromosomes[active_pixels[found]] = population[found, 0]
+
+            if self.metrics is not None and found.any():
+                self.metrics.histogram_add("generations_per_pixel", generation, int(found.sum()))
+
+            active_pixels = active_pixels[~found]
+            population = population[~found]
+            population_valid = population_valid[~found]
+            fitness = fitness[~found]
+            reference_mean = reference_mean[~found]
+            reference_std = reference_std[~found]
+
+            if len(active_pixels) == 0:
+                break
+
+            improved = fitness[:, 0] < best_fitness[active_pixels]
+            best_fitness[active_pixels[improved]] = fitness[improved, 0]
+            best_chromosomes[active_pixels[improved]] = population[improved, 0]
+
+            # Retire all the pixels left if a limit was reached:
+            if self.max_generations is not None and generation >= self.max_generations:
+                self.capped_pixels["generations"] += len(active_pixels)
+                break
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                self.capped_pixels["time_budget"] += len(active_pixels)
+                break
+
+            # The pixels still in the batch are struggling, their
+            # populations grow:
+            if self.max_population_size is not None and generation == self.growth_generation:
+                self.population_size_set(self.max_population_size)
+
+            if self.metrics is not None:
+                start_time = time.perf_counter()
+
+            population, population_valid = self.next_generation_create(population, population_valid)
+
+            if self.metrics is not None:
+                self.metrics.time_add("crossover", time.perf_counter() - start_time)
+
+            generation += 1
+
+        if len(active_pixels) > 0:
+            fittest_chromosomes[active_pixels] = self.fallback_chromosomes_get(
+                best_chromosomes[active_pixels], neighborhoods[active_pixels], neighborhoods_valid[active_pixels])
+
+        return fittest_chromosomes
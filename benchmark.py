@@ -0,0 +1,289 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+import numpy
+
+from image_wrapper import ImageWrapper, MEAN_KERNEL, MEDIAN_KERNEL, ADAPTIVE_MEDIAN_KERNEL
+from ga_image_applier import GAImageApplier, PIXEL_ENGINE, BATCHED_ENGINE, DIRECT_ENGINE, BATCH_ENGINES
+from direct_solver import DirectSolver
+from frame_recorder import FrameRecorder
+from metrics_collector import MetricsCollector
+from auto_denoiser import AutoDenoiser
+from noise_corpus import corpus_generate, SALT_PEPPER_NOISE, CHROMA_NOISE, GAUSSIAN_NOISE, PERIODIC_NOISE
+from quality_metrics import psnr_calculate, ssim_calculate
+
+"""
+The noisy Lenas bundled in images/, and the clean Lena they come from.
+"""
+BUNDLED_NOISY_IMAGES = {
+    CHROMA_NOISE: "./images/lena_chroma_noised.png",
+    GAUSSIAN_NOISE: "./images/lena_gaussian_noised.png",
+    PERIODIC_NOISE: "./images/lena_periodic_noise.png",
+    SALT_PEPPER_NOISE: "./images/lena_salt_pepper_noised.png"
+}
+BUNDLED_REFERENCE_IMAGE = "./images/lena.jpg"
+
+# Sizes of the synthetic images, generated from the clean Lena:
+SYNTHETIC_SIZES = [512, 1024]
+
+# Methods to benchmark: the GA with each engine (and the direct solver
+# of the GAImageApplier), the deterministic denoiser with each kernel,
+# and the strategy for the noise found in each image
+GA_PIXEL_METHOD = "ga_" + PIXEL_ENGINE
+GA_BATCHED_METHOD = "ga_" + BATCHED_ENGINE
+GA_DIRECT_METHOD = "ga_" + DIRECT_ENGINE
+GA_METHODS = {GA_PIXEL_METHOD: PIXEL_ENGINE, GA_BATCHED_METHOD: BATCHED_ENGINE, GA_DIRECT_METHOD: DIRECT_ENGINE}
+DETERMINISTIC_METHODS = [MEAN_KERNEL, MEDIAN_KERNEL, ADAPTIVE_MEDIAN_KERNEL]
+AUTO_METHOD = "auto"
+METHODS = list(GA_METHODS) + DETERMINISTIC_METHODS + [AUTO_METHOD]
+DEFAULT_METHODS = [GA_BATCHED_METHOD, GA_DIRECT_METHOD, GA_PIXEL_METHOD, MEAN_KERNEL, ADAPTIVE_MEDIAN_KERNEL, AUTO_METHOD]
+
+# The gif of the GA captures a frame every N repaired pixels:
+GIF_EVERY_N_PIXELS = 100
+
+def cases_get(work_dir, sizes=SYNTHETIC_SIZES, methods=DEFAULT_METHODS, seed=0):
+    """
+    Builds the list of cases to benchmark: each bundled noisy image and
+    each synthetic image (written to work_dir), with each method.
+
+    :return: list of dicts with the input, the reference and the method
+    :rtype: list
+    """
+    inputs = list()
+    for noise_type, path in BUNDLED_NOISY_IMAGES.items():
+        inputs.append({"path": path, "reference": BUNDLED_REFERENCE_IMAGE, "noise_type": noise_type, "synthetic": False})
+
+    if sizes:
+        manifest = corpus_generate(os.path.join(work_dir, "corpus"), sizes=sizes, seed=seed)
+        for item in manifest["noisy"]:
+            inputs.append({"path": item["path"], "reference": item["clean"], "noise_type": item["noise_type"], "synthetic": True})
+
+    cases = list()
+    for case_input in inputs:
+        for method in methods:
+            case = dict(case_input)
+            case["method"] = method
+            case["output_dir"] = work_dir
+            cases.append(case)
+    return cases
+
+def fit_pixels_count(ga_applier, pixels_y, pixels_x, neighborhoods, neighborhoods_valid):
+    """
+    Counts the repaired pixels that meet the fitness range of the GA
+    against their neighborhood in the input image, the acceptance of
+    the BATCH_ENGINES.
+
+    :return: the number of pixels in range
+    :rtype: int
+    """
+    min_deviation_coefficient, max_deviation_coefficient = ga_applier.deviation_coefficients_get()
+    solver = DirectSolver(min_deviation_coefficient, max_deviation_coefficient, ga_applier.max_pixel_value)
+    neighbors = neighborhoods.astype(numpy.float32)
+    reference_mean, reference_std = solver.reference_statistics_get(neighbors, neighborhoods_valid)
+
+    image = ga_applier.image_obj.get_np_image_format()
+    chromosomes = image[pixels_y, pixels_x].reshape((len(pixels_y), 1, -1)).astype(numpy.float32)
+    fitness = solver.population_fitness_calculate(chromosomes, numpy.ones(chromosomes.shape[:2], dtype=bool),
+                                                  reference_mean, reference_std)[:, 0]
+    return int(((min_deviation_coefficient <= fitness) & (fitness <= max_deviation_coefficient)).sum())
+
+def case_run(case):
+    """
+    Runs a single case, timing each stage. It is meant to run in its own
+    process, so the peak RSS belongs only to this case.
+
+    :return: the case, with its timings, throughput, peak RSS and quality
+    :rtype: dict
+    """
+    result = dict(case)
+    timings = dict()
+    name = "{}_{}".format(os.path.splitext(os.path.basename(case["path"]))[0], case["method"])
+
+    start_time = time.perf_counter()
+    image = ImageWrapper(case["path"])
+    image.image_opener()
+    timings["open"] = time.perf_counter() - start_time
+
+    image_height, image_width = image.shape_get()[:2]
+
+    if case["method"] in GA_METHODS:
+        ga_applier = GAImageApplier()
+        ga_applier.image_obj_set(image)
+        ga_applier.engine_set(GA_METHODS[case["method"]])
+        ga_applier.verbose_set(False)
+        frame_recorder = FrameRecorder(os.path.join(case["output_dir"], name + ".gif"), every_n_pixels=GIF_EVERY_N_PIXELS)
+        ga_applier.frame_recorder_set(frame_recorder)
+        metrics = MetricsCollector()
+        ga_applier.metrics_set(metrics)
+
+        start_time = time.perf_counter()
+        noise_mask, _ = ga_applier.noise_mask_calculate()
+        timings["detect"] = time.perf_counter() - start_time
+
+        if GA_METHODS[case["method"]] in BATCH_ENGINES:
+            # The neighborhoods of the input image, to check the
+            # acceptance of the repaired pixels:
+            noisy_y, noisy_x = numpy.nonzero(noise_mask)
+            neighborhoods, neighborhoods_valid = image.neighborhoods_get(noisy_y, noisy_x)
+
+        start_time = time.perf_counter()
+        ga_applier.start_ga_over_image()
+        repair_and_gif_time = time.perf_counter() - start_time
+
+        # The frames are encoded while the GA runs:
+        timings["gif"] = frame_recorder.capture_time_get()
+        timings["repair"] = repair_and_gif_time - timings["gif"]
+
+        result["noisy_pixels"] = int(noise_mask.sum())
+        result["capped_pixels"] = ga_applier.capped_pixels_get()
+        if GA_METHODS[case["method"]] in BATCH_ENGINES:
+            result["fit_pixels"] = fit_pixels_count(ga_applier, noisy_y, noisy_x, neighborhoods, neighborhoods_valid)
+        result["metrics"] = metrics.as_dict()
+    elif case["method"] == AUTO_METHOD:
+        auto_denoiser = AutoDenoiser(BATCHED_ENGINE)
+        auto_denoiser.verbose_set(False)
+        metrics = MetricsCollector()
+        auto_denoiser.metrics_set(metrics)
+
+        result["auto_report"] = auto_denoiser.denoise(image)
+        # Without the time spent estimating the GA:
+        timings["repair"] = result["auto_report"]["seconds"]
+        result["metrics"] = metrics.as_dict()
+    else:
+        start_time = time.perf_counter()
+        image.denoise_salt_pepper_deterministically(kernel=case["method"])
+        timings["repair"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    image.set_result_image_name(os.path.join(case["output_dir"], name + ".png"))
+    image.save()
+    timings["save"] = time.perf_counter() - start_time
+
+    processing_time = timings.get("detect", 0) + timings["repair"]
+    result["timings"] = timings
+    result["pixels"] = image_height*image_width
+    result["pixels_per_second"] = result["pixels"]/processing_time if processing_time > 0 else None
+    if "noisy_pixels" in result:
+        result["noisy_pixels_per_second"] = result["noisy_pixels"]/timings["repair"] if timings["repair"] > 0 else None
+
+    # ru_maxrss is in kilobytes on Linux:
+    result["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    reference = numpy.array(Image.open(case["reference"]).convert("RGB"))
+    denoised = image.get_np_image_format()
+    result["psnr"] = psnr_calculate(denoised, reference)
+    result["ssim"] = ssim_calculate(denoised, reference)
+
+    return result
+
+def git_commit_get():
+    """
+    :return: the commit of the repository being benchmarked, None if
+    it is not known
+    :rtype: str
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def direct_comparison_get(cases):
+    """
+    Compares the direct solver with the GA, for each input benchmarked
+    with both.
+
+    :param cases: the results of case_run
+    :return: for each input, the speedup of the repair of the direct
+    solver over each GA engine, and the difference of PSNR (direct
+    minus GA)
+    :rtype: list of dicts
+    """
+    cases_by_input = dict()
+    for case in cases:
+        cases_by_input.setdefault(case["path"], dict())[case["method"]] = case
+
+    comparison = list()
+    for path, methods in cases_by_input.items():
+        if GA_DIRECT_METHOD not in methods:
+            continue
+        direct = methods[GA_DIRECT_METHOD]
+        for method in (GA_BATCHED_METHOD, GA_PIXEL_METHOD):
+            if method not in methods:
+                continue
+            ga = methods[method]
+            comparison.append({
+                "path": path,
+                "method": method,
+                "speedup": ga["timings"]["repair"]/direct["timings"]["repair"]
+                if direct["timings"]["repair"] > 0 else None,
+                "psnr_difference": direct["psnr"] - ga["psnr"],
+                "ssim_difference": direct["ssim"] - ga["ssim"]
+            })
+    return comparison
+
+def benchmark_run(output_path, work_dir=None, sizes=SYNTHETIC_SIZES, methods=DEFAULT_METHODS, seed=0):
+    """
+    Runs all the cases, one fresh process each, and writes the results
+    as JSON to output_path.
+
+    :return: the results
+    :rtype: dict
+    """
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix="ga_denoiser_benchmark_")
+    os.makedirs(work_dir, exist_ok=True)
+
+    results = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_commit": git_commit_get(),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "seed": seed,
+        "cases": list()
+    }
+
+    cases = cases_get(work_dir, sizes, methods, seed)
+
+    # A new process per case, so the peak RSS is not shared among cases:
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                             max_tasks_per_child=1) as pool:
+        for result in pool.map(case_run, cases):
+            print("{:<45} {:<16} repair: {:8.3f} s  PSNR: {:6.2f} dB  SSIM: {:.4f}".format(
+                os.path.basename(result["path"]), result["method"], result["timings"]["repair"],
+                result["psnr"], result["ssim"]))
+            results["cases"].append(result)
+
+    results["direct_comparison"] = direct_comparison_get(results["cases"])
+    for comparison in results["direct_comparison"]:
+        print("{:<45} direct vs {:<9} speedup: {:8.2f}x  PSNR: {:+6.2f} dB  SSIM: {:+.4f}".format(
+            os.path.basename(comparison["path"]), comparison["method"], comparison["speedup"] or 0,
+            comparison["psnr_difference"], comparison["ssim_difference"]))
+
+    with open(output_path, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the GA and the deterministic denoisers")
+    parser.add_argument("--output", default="./benchmark.json", help="JSON file with the results")
+    parser.add_argument("--work-dir", default=None, help="directory for the synthetic images and the outputs")
+    parser.add_argument("--sizes", type=int, nargs="*", default=SYNTHETIC_SIZES, help="sizes of the synthetic images")
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=DEFAULT_METHODS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    benchmark_run(args.output, args.work_dir, args.sizes, args.methods, args.seed)
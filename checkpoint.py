@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+# Minimum seconds between two checkpoints of a run:
+CHECKPOINT_INTERVAL = 60.0
+
+MANIFEST_NAME = "checkpoint.json"
+SEGMENT_NAME = "segment_{:06d}.npy"
+
+def file_atomic_write(path, write):
+    """
+    Writes a file through a temporary file next to it, that is renamed
+    over path once it is complete and on disk. So path always has either
+    its previous content or the new one, never a part of it.
+
+    :param path: the path of the file to write
+    :param write: function that writes the content to an open binary file
+    """
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as temporary_file:
+        write(temporary_file)
+        temporary_file.flush()
+        os.fsync(temporary_file.fileno())
+    os.replace(temporary_path, path)
+
+def noise_mask_fingerprint_get(noise_mask):
+    """
+    :return: a hash of the noise mask, to tell if a checkpoint belongs to
+    the same image and detection
+    :rtype: str
+    """
+    packed = numpy.packbits(numpy.ascontiguousarray(noise_mask, dtype=bool))
+    return hashlib.sha1(packed.tobytes() + str(noise_mask.shape).encode()).hexdigest()
+
+class Checkpointer:
+    """
+    This class writes the checkpoints of a GA run, and loads the last one
+    to resume the run (see GAImageApplier.start_ga_over_image).
+
+    A checkpoint is made of:
+    - A segment (.npy): the chromosomes of the noisy pixels repaired
+    since the previous checkpoint, in the order of
+    numpy.nonzero(noise_mask). Each checkpoint only writes what is new,
+    so a checkpoint costs the same at the start and at the end of the
+    run.
+    - The manifest (JSON): the cursor of the run, list_of_rows, the
+    capped pixels, the state of the RandomSource, the fingerprint of the
+    run and the segments written so far.
+
+    Each file is written atomically (see file_atomic_write), the segment
+    before the manifest that lists it, so a run killed at any moment
+    leaves its last complete checkpoint. The files are written by a
+    background thread: the GA only hands over a copy of the new
+    chromosomes, and a checkpoint is not due while the previous one is
+    still being written.
+
+    :param directory: where the checkpoint is written, created if needed
+    :param interval: minimum seconds between checkpoints
+    """
+    def __init__(self, directory, interval=CHECKPOINT_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.segments = list() # Segments of the last checkpoint
+        self.writer = None # ThreadPoolExecutor with the writing thread
+        self.pending_write = None # Future of the checkpoint being written
+        self.last_write_time = time.monotonic()
+        self.checkpoints_num = 0 # Checkpoints written by this instance
+
+    # -- Setters & getters --
+    def directory_get(self):
+        return self.directory
+    def checkpoints_num_get(self):
+        return self.checkpoints_num
+    # -- End of Setters & getters --
+
+    def load(self, fingerprint):
+        """
+        Loads the last checkpoint of the run, if there is one.
+
+        :param fingerprint: dict that identifies the run (image, detection
+        and engine). A checkpoint of a different run raises ValueError.
+        :return: the manifest and the chromosomes of the noisy pixels
+        already repaired, with shape (pixels, channels), or None if there
+        is no checkpoint
+        :rtype: tuple (dict, numpy array) or None
+        """
+        manifest_path = os.path.join(self.directory, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return None
+
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest["fingerprint"] != fingerprint:
+            raise ValueError("The checkpoint in " + self.directory + " belongs to a different run")
+
+        self.segments = list(manifest["segments"])
+        chromosomes = [numpy.load(os.path.join(self.directory, segment)) for segment in self.segments]
+        return manifest, numpy.concatenate(chromosomes)
+
+    def due_check(self):
+        """
+        :return: True if a new checkpoint should be written: the interval
+        passed since the last one, and it was already written
+        :rtype: bool
+        """
+        if self.pending_write is not None and not self.pending_write.done():
+            return False
+        return time.monotonic() - self.last_write_time >= self.interval
+
+    def write(self, manifest, chromosomes):
+        """
+        Queues a new checkpoint, written in the background. An error of
+        the previous write is raised here.
+
+        :param manifest: dict that can be written as JSON, with the state
+        of the run and its fingerprint
+        :param chromosomes: numpy array (pixels, channels) with the
+        chromosomes of the noisy pixels repaired since the previous
+        checkpoint, copied before this function returns
+        """
+        if self.writer is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.writer = ThreadPoolExecutor(max_workers=1)
+        if self.pending_write is not None:
+            self.pending_write.result()
+
+        segment = SEGMENT_NAME.format(len(self.segments))
+        self.segments.append(segment)
+        manifest = dict(manifest, segments=list(self.segments))
+
+        self.pending_write = self.writer.submit(self.files_write, manifest, segment, numpy.array(chromosomes))
+        self.last_write_time = time.monotonic()
+        self.checkpoints_num += 1
+
+    def files_write(self, manifest, segment, chromosomes):
+        file_atomic_write(os.path.join(self.directory, segment),
+                          lambda segment_file: numpy.save(segment_file, chromosomes))
+        file_atomic_write(os.path.join(self.directory, MANIFEST_NAME),
+                          lambda manifest_file: manifest_file.write(json.dumps(manifest).encode()))
+
+    def close(self):
+        """
+        Waits for the checkpoint being written, and stops the writing
+        thread.
+        """
+        if self.writer is not None:
+            try:
+                if self.pending_write is not None:
+                    self.pending_write.result()
+            finally:
+                self.writer.shutdown()
+                self.writer = None
+                self.pending_write = None
+
+    def remove(self):
+        """
+        Removes the checkpoint, once the output of the run is safely
+        written.
+        """
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.segments = list()
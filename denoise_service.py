@@ -0,0 +1,529 @@
+import argparse
+import asyncio
+import collections
+import http.client
+import io
+import json
+import os
+import socket
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+from PIL import Image
+
+from image_wrapper import ImageWrapper
+from band_io import PNGBandWriter, png_wide_color_check, png_read, pil_image_has_alpha
+from ga_image_applier import MAX_GENERATIONS, TIME_BUDGET, MAX_PASSES
+from batch_denoise import image_obj_denoise, METHODS, DEFAULT_METHOD
+
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+
+# Jobs waiting for a worker; once the queue is full, new jobs are refused
+# (HTTP 503) until some job starts:
+QUEUE_SIZE = 16
+# Finished jobs whose result is kept, the oldest ones are dropped:
+MAX_FINISHED_JOBS = 64
+MAX_REQUEST_SIZE = 256*1024*1024 # Bytes
+
+# Status of the jobs:
+QUEUED_STATUS = "queued"
+RUNNING_STATUS = "running"
+DONE_STATUS = "done"
+FAILED_STATUS = "failed"
+FINISHED_STATUSES = (DONE_STATUS, FAILED_STATUS)
+
+HTTP_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                409: "Conflict", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+def worker_warm_up():
+    """
+    Runs once in each worker process when the service starts, so the
+    modules are imported and the process exists before the first job.
+    """
+    return os.getpid()
+
+def job_run(image_bytes, method, max_generations, time_budget, max_passes, seed=None):
+    """
+    Denoises an image in a worker process.
+
+    :param image_bytes: the encoded image, in any format PIL reads. A PNG
+    with 16 bits color channels keeps them, see ImageWrapper.image_opener.
+    :return: the denoised image encoded as PNG, and the statistics
+    :rtype: tuple (bytes, dict)
+    """
+    start_time = time.perf_counter()
+
+    image = ImageWrapper("")
+    with Image.open(io.BytesIO(image_bytes)) as pil_image:
+        if png_wide_color_check(io.BytesIO(image_bytes)):
+            image.np_image_with_alpha_set(png_read(io.BytesIO(image_bytes)), pil_image_has_alpha(pil_image))
+        else:
+            image.pil_image_load(pil_image)
+
+    statistics = image_obj_denoise(image, method, max_generations, time_budget, max_passes, seed=seed)
+
+    output = io.BytesIO()
+    result = image.np_image_with_alpha_get()
+    if result.ndim == 3 and result.dtype.itemsize > 1:
+        # PIL has no mode for 16 bits color images, as in ImageWrapper.save:
+        writer = PNGBandWriter(output, result.shape, result.dtype)
+        writer.band_write(result)
+        writer.close()
+    else:
+        Image.fromarray(result).save(output, format="PNG")
+
+    statistics["pixels"] = image.shape_get()[0]*image.shape_get()[1]
+    statistics["seconds"] = time.perf_counter() - start_time
+    return output.getvalue(), statistics
+
+class DenoiseService:
+    """
+    This class is a local denoising service: it accepts images over
+    HTTP (on localhost or on a Unix socket), queues them, and denoises
+    them in a process pool that is started once, with the service.
+
+    Endpoints:
+    - POST /jobs?method=...&max_generations=...&time_budget=...&max_passes=...&seed=...
+    with the image as body: queues a job, 202 with its id, or 503 if the
+    queue is full (the client should retry later).
+    - GET /jobs/<id>: the status of the job.
+    - GET /jobs/<id>/events: the status of the job, streamed as one JSON
+    line per change, until the job finishes.
+    - GET /jobs/<id>/result: the denoised image as PNG, 409 if the job
+    did not finish yet.
+    - GET /health: the state of the queue and the workers.
+
+    :param workers: number of worker processes, os.cpu_count() if None
+    :param queue_size: jobs that can wait for a worker
+    """
+    def __init__(self, workers=None, queue_size=QUEUE_SIZE):
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.queue_size = queue_size
+        self.pool = None
+        self.queue = None
+        self.jobs = dict() # Job id -> job
+        self.finished_jobs = collections.deque() # Ids of the finished jobs, oldest first
+        self.jobs_changed = None # asyncio.Condition, notified when a job changes its status
+        self.worker_tasks = list()
+        self.server = None
+
+    async def start(self, host=SERVICE_HOST, port=SERVICE_PORT, unix_socket=None):
+        """
+        Starts the process pool, the tasks that feed it and the server.
+        """
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.jobs_changed = asyncio.Condition()
+
+        loop = asyncio.get_running_loop()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        # Starting every worker process now, instead of on the first jobs:
+        await asyncio.gather(*[loop.run_in_executor(self.pool, worker_warm_up) for _ in range(self.workers)])
+
+        self.worker_tasks = [asyncio.create_task(self.jobs_consume()) for _ in range(self.workers)]
+
+        if unix_socket is not None:
+            self.server = await asyncio.start_unix_server(self.connection_handle, path=unix_socket)
+        else:
+            self.server = await asyncio.start_server(self.connection_handle, host, port)
+        return self.server
+
+    async def stop(self):
+        """
+        Stops the server, the tasks and the process pool. The jobs not
+        finished are lost.
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+    def job_public_get(self, job):
+        """
+        :return: the job as it is shown to the clients, without the images
+        :rtype: dict
+        """
+        return {key: value for key, value in job.items() if key not in ("image", "result")}
+
+    async def job_status_set(self, job, status, **changes):
+        job["status"] = status
+        job.update(changes)
+
+        if status in FINISHED_STATUSES:
+            job.pop("image", None)
+            self.finished_jobs.append(job["id"])
+            while len(self.finished_jobs) > MAX_FINISHED_JOBS:
+                self.jobs.pop(self.finished_jobs.popleft(), None)
+
+        async with self.jobs_changed:
+            self.jobs_changed.notify_all()
+
+    def job_submit(self, image_bytes, options):
+        """
+        Queues a new job.
+
+        :return: the job, or None if the queue is full
+        :rtype: dict
+        """
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": QUEUED_STATUS,
+            "created": time.time(),
+            "image": image_bytes
+        }
+        job.update(options)
+
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            return None
+        self.jobs[job["id"]] = job
+        return job
+
+    async def jobs_consume(self):
+        """
+        Takes the jobs of the queue and runs them in the process pool,
+        one at a time. There is one of these tasks per worker process.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.job_status_set(job, RUNNING_STATUS, started=time.time())
+                result, statistics = await loop.run_in_executor(
+                    self.pool, job_run, job["image"], job["method"], job["max_generations"],
+                    job["time_budget"], job["max_passes"], job["seed"])
+                await self.job_status_set(job, DONE_STATUS, finished=time.time(), result=result,
+                                          statistics=statistics)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                await self.job_status_set(job, FAILED_STATUS, finished=time.time(),
+                                          error="{}: {}".format(type(error).__name__, error))
+            finally:
+                self.queue.task_done()
+
+    async def connection_handle(self, reader, writer):
+        """
+        Serves a single HTTP request, and closes the connection.
+        """
+        try:
+            try:
+                method, target, body = await self.request_read(reader)
+            except ValueError as error:
+                await self.response_write(writer, 400, {"error": str(error)})
+                return
+
+            if body is None:
+                await self.response_write(writer, 413, {"error": "The request is too large"})
+                return
+
+            await self.request_route(writer, method, target, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def request_read(self, reader):
+        """
+        :return: the method, the target and the body of the request
+        (None if it is larger than MAX_REQUEST_SIZE)
+        :rtype: tuple
+        """
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            raise ValueError("Malformed request line")
+        method, target, _ = request_line
+
+        headers = dict()
+        while True:
+            line = (await reader.readline()).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        content_length = int(headers.get("content-length", 0))
+        if content_length > MAX_REQUEST_SIZE:
+            return method, target, None
+        body = await reader.readexactly(content_length) if content_length else b""
+        return method, target, body
+
+    async def request_route(self, writer, method, target, body):
+        url = urlsplit(target)
+        path = [part for part in url.path.split("/") if part]
+
+        if path == ["health"] and method == "GET":
+            await self.response_write(writer, 200, {
+                "workers": self.workers,
+                "queued": self.queue.qsize(),
+                "queue_size": self.queue_size,
+                "jobs": len(self.jobs)
+            })
+        elif path == ["jobs"] and method == "POST":
+            await self.job_post(writer, parse_qs(url.query), body)
+        elif len(path) >= 2 and path[0] == "jobs" and method == "GET":
+            job = self.jobs.get(path[1])
+            if job is None:
+                await self.response_write(writer, 404, {"error": "Unknown job"})
+            elif len(path) == 2:
+                await self.response_write(writer, 200, self.job_public_get(job))
+            elif path[2:] == ["result"]:
+                if job["status"] != DONE_STATUS:
+                    await self.response_write(writer, 409, self.job_public_get(job))
+                else:
+                    await self.response_write(writer, 200, job["result"], "image/png")
+            elif path[2:] == ["events"]:
+                await self.job_events_stream(writer, job)
+            else:
+                await self.response_write(writer, 404, {"error": "Unknown path"})
+        elif path and path[0] in ("jobs", "health"):
+            await self.response_write(writer, 405, {"error": "Method not allowed"})
+        else:
+            await self.response_write(writer, 404, {"error": "Unknown path"})
+
+    async def job_post(self, writer, query, body):
+        try:
+            options = {
+                "method": query.get("method", [DEFAULT_METHOD])[0],
+                "max_generations": int(query["max_generations"][0]) if "max_generations" in query else MAX_GENERATIONS,
+                "time_budget": float(query["time_budget"][0]) if "time_budget" in query else TIME_BUDGET,
+                "max_passes": int(query["max_passes"][0]) if "max_passes" in query else MAX_PASSES,
+                "seed": int(query["seed"][0]) if "seed" in query else None
+            }
+        except ValueError as error:
+            await self.response_write(writer, 400, {"error": str(error)})
+            return
+        if options["method"] not in METHODS:
+            await self.response_write(writer, 400, {"error": "Unknown method", "methods": METHODS})
+            return
+        if not body:
+            await self.response_write(writer, 400, {"error": "The body must be the image"})
+            return
+
+        job = self.job_submit(body, options)
+        if job is None:
+            # Backpressure: the client has to wait until the queue drains
+            await self.response_write(writer, 503, {"error": "The queue is full"}, headers={"Retry-After": "1"})
+        else:
+            await self.response_write(writer, 202, self.job_public_get(job))
+
+    async def job_events_stream(self, writer, job):
+        """
+        Streams the status of a job, one JSON line each time it changes,
+        until the job finishes.
+        """
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n")
+        last_status = None
+        while True:
+            if job["status"] != last_status:
+                last_status = job["status"]
+                writer.write(json.dumps(self.job_public_get(job)).encode() + b"\n")
+                await writer.drain()
+            if last_status in FINISHED_STATUSES:
+                return
+            async with self.jobs_changed:
+                await self.jobs_changed.wait_for(lambda: job["status"] != last_status)
+
+    async def response_write(self, writer, status, body, content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        head = ["HTTP/1.1 {} {}".format(status, HTTP_REASONS.get(status, "")),
+                "Content-Type: " + content_type,
+                "Content-Length: " + str(len(body)),
+                "Connection: close"]
+        for name, value in (headers or dict()).items():
+            head.append("{}: {}".format(name, value))
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+class ServiceBusyError(Exception):
+    """
+    The queue of the service is full, the job should be submitted again later.
+    """
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    An HTTPConnection over a Unix socket.
+    """
+    def __init__(self, unix_socket, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_socket = unix_socket
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_socket)
+
+class DenoiseClient:
+    """
+    A client of the DenoiseService, using only the standard library.
+
+    :param host: host of the service
+    :param port: port of the service
+    :param unix_socket: path of the Unix socket of the service, used
+    instead of host and port if given
+    """
+    def __init__(self, host=SERVICE_HOST, port=SERVICE_PORT, unix_socket=None, timeout=None):
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.timeout = timeout
+
+    def connection_get(self):
+        if self.unix_socket is not None:
+            return UnixHTTPConnection(self.unix_socket, self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, target, body=None):
+        """
+        :return: the status and the body of the response
+        :rtype: tuple (int, bytes)
+        """
+        connection = self.connection_get()
+        try:
+            connection.request(method, target, body=body)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def health_get(self):
+        return json.loads(self.request("GET", "/health")[1])
+
+    def submit(self, image, method=DEFAULT_METHOD, max_generations=None, time_budget=None, max_passes=None,
+               seed=None):
+        """
+        Submits an image to be denoised.
+
+        :param image: the path of the image, or the encoded image
+        :return: the job id
+        :rtype: str
+        :raises ServiceBusyError: if the queue of the service is full
+        """
+        if isinstance(image, str):
+            with open(image, "rb") as image_file:
+                image = image_file.read()
+
+        query = "method=" + method
+        for name, value in (("max_generations", max_generations), ("time_budget", time_budget),
+                            ("max_passes", max_passes), ("seed", seed)):
+            if value is not None:
+                query += "&{}={}".format(name, value)
+
+        status, body = self.request("POST", "/jobs?" + query, image)
+        if status == 503:
+            raise ServiceBusyError(json.loads(body)["error"])
+        if status != 202:
+            raise RuntimeError("The service refused the job: " + body.decode())
+        return json.loads(body)["id"]
+
+    def status_get(self, job_id):
+        status, body = self.request("GET", "/jobs/" + job_id)
+        if status != 200:
+            raise KeyError(job_id)
+        return json.loads(body)
+
+    def events_get(self, job_id):
+        """
+        :return: an iterator over the status of the job, each time it
+        changes, until the job finishes
+        :rtype: generator
+        """
+        connection = self.connection_get()
+        try:
+            connection.request("GET", "/jobs/{}/events".format(job_id))
+            response = connection.getresponse()
+            if response.status != 200:
+                raise KeyError(job_id)
+            for line in response:
+                yield json.loads(line)
+        finally:
+            connection.close()
+
+    def result_get(self, job_id):
+        """
+        :return: the denoised image encoded as PNG
+        :rtype: bytes
+        """
+        status, body = self.request("GET", "/jobs/{}/result".format(job_id))
+        if status != 200:
+            raise RuntimeError("The job has no result: " + body.decode())
+        return body
+
+    def denoise(self, image, method=DEFAULT_METHOD, retry_interval=1.0, **options):
+        """
+        Submits an image, retrying while the service is busy, waits for
+        the job and returns its result.
+
+        :return: the denoised image encoded as PNG
+        :rtype: bytes
+        """
+        while True:
+            try:
+                job_id = self.submit(image, method, **options)
+                break
+            except ServiceBusyError:
+                time.sleep(retry_interval)
+
+        for job in self.events_get(job_id):
+            if job["status"] == FAILED_STATUS:
+                raise RuntimeError("The job failed: " + job["error"])
+        return self.result_get(job_id)
+
+async def service_run(workers, queue_size, host, port, unix_socket):
+    service = DenoiseService(workers, queue_size)
+    server = await service.start(host, port, unix_socket)
+    print("Serving on", unix_socket if unix_socket is not None else "{}:{}".format(host, port))
+    try:
+        await server.serve_forever()
+    finally:
+        await service.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local denoising service, and its client")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="run the service")
+    serve_parser.add_argument("--host", default=SERVICE_HOST)
+    serve_parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    serve_parser.add_argument("--unix-socket", default=None)
+    serve_parser.add_argument("--workers", type=int, default=None)
+    serve_parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+
+    denoise_parser = subparsers.add_parser("denoise", help="denoise an image with a running service")
+    denoise_parser.add_argument("input")
+    denoise_parser.add_argument("output", help="PNG to write")
+    denoise_parser.add_argument("--host", default=SERVICE_HOST)
+    denoise_parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    denoise_parser.add_argument("--unix-socket", default=None)
+    denoise_parser.add_argument("--method", choices=METHODS, default=DEFAULT_METHOD)
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            asyncio.run(service_run(args.workers, args.queue_size, args.host, args.port, args.unix_socket))
+        except KeyboardInterrupt:
+            pass
+    else:
+        client = DenoiseClient(args.host, args.port, args.unix_socket)
+        try:
+            png = client.denoise(args.input, args.method)
+        except RuntimeError as error:
+            print(error)
+            sys.exit(1)
+        with open(args.output, "wb") as output_file:
+            output_file.write(png)
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+import numpy
+
+from checkpoint import file_atomic_write
+
+# Bytes the cache can take on disk, the least recently used entries are
+# removed beyond it:
+DETECTION_CACHE_MAX_BYTES = 1 << 30
+
+ENTRY_MANIFEST_NAME = "entry.json"
+MASK_NAME = "noise_mask.npy"
+MEAN_NAME = "mean.npy"
+STD_NAME = "std.npy"
+
+# Rows of the image hashed at once, so a memmap is never read whole:
+HASH_BAND_HEIGHT = 256
+
+def image_content_hash_get(image):
+    """
+    :return: a hash of the values, the shape and the type of an image,
+    the same for the same content whatever file it comes from
+    :rtype: str
+    """
+    content_hash = hashlib.sha1((str(image.shape) + str(image.dtype)).encode())
+    for top in range(0, image.shape[0], HASH_BAND_HEIGHT):
+        content_hash.update(numpy.ascontiguousarray(image[top:top + HASH_BAND_HEIGHT]).tobytes())
+    return content_hash.hexdigest()
+
+class DetectionCache:
+    """
+    This class keeps the detection of the images on disk (see
+    GAImageApplier.noise_mask_calculate), so running the GA again over
+    the same image, with different settings of the GA or different
+    outputs, skips straight to the repair.
+
+    Each entry is a directory named after its key (the hash of the
+    content of the image and the parameters of the detection, see
+    key_get) with:
+    - The noise mask, bit-packed (numpy.packbits).
+    - The mean and the standard deviation planes of the neighborhoods,
+    float32 with shape (height, width, channels).
+    - The manifest (JSON) with the shape of the image and the parameters.
+
+    The arrays are .npy files opened as memmaps, so a hit only reads the
+    mask (one bit per pixel), and the planes are read if and when they
+    are used. An entry is written in a temporary directory renamed to its
+    key, so the processes of a batch can share the cache and never see a
+    half written entry.
+
+    The entries used the least recently (their manifest is touched on
+    each hit) are removed when the cache takes more than max_bytes.
+
+    :param directory: where the entries are written, created if needed
+    :param max_bytes: bytes the cache can take on disk
+    """
+    def __init__(self, directory, max_bytes=DETECTION_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    # -- Setters & getters --
+    def directory_get(self):
+        return self.directory
+    def hits_get(self):
+        return self.hits
+    def misses_get(self):
+        return self.misses
+    # -- End of Setters & getters --
+
+    def key_get(self, image, parameters):
+        """
+        :param image: numpy array of the image
+        :param parameters: dict with the parameters of the detection that
+        can be written as JSON (e.g. the radius of the window and the
+        threshold)
+        :return: the key of the detection of the image
+        :rtype: str
+        """
+        parameters_text = json.dumps(parameters, sort_keys=True)
+        return hashlib.sha1((image_content_hash_get(image) + parameters_text).encode()).hexdigest()
+
+    def load(self, key):
+        """
+        :return: the noise mask, and the mean and the standard deviation
+        planes as read-only memmaps, or None if the key is not cached
+        :rtype: tuple of 3 numpy arrays or None
+        """
+        entry_path = os.path.join(self.directory, key)
+        manifest_path = os.path.join(entry_path, ENTRY_MANIFEST_NAME)
+        try:
+            with open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+            packed_mask = numpy.load(os.path.join(entry_path, MASK_NAME), mmap_mode="r")
+            nbh_mean = numpy.load(os.path.join(entry_path, MEAN_NAME), mmap_mode="r")
+            nbh_std = numpy.load(os.path.join(entry_path, STD_NAME), mmap_mode="r")
+            os.utime(manifest_path)
+        except (OSError, ValueError):
+            # Not cached, or evicted by another process while reading it:
+            self.misses += 1
+            return None
+
+        image_height, image_width = manifest["shape"][:2]
+        noise_mask = numpy.unpackbits(packed_mask, count=image_height*image_width).astype(bool)
+        self.hits += 1
+        return noise_mask.reshape((image_height, image_width)), nbh_mean, nbh_std
+
+    def store(self, key, noise_mask, nbh_mean, nbh_std, parameters=None):
+        """
+        Writes the detection of an image, and removes the least recently
+        used entries beyond max_bytes.
+
+        :param noise_mask: boolean numpy array (height, width)
+        :param nbh_mean: numpy array (height, width, channels)
+        :param nbh_std: numpy array (height, width, channels)
+        :param parameters: the parameters of key_get, only recorded
+        """
+        entry_path = os.path.join(self.directory, key)
+        if os.path.exists(entry_path):
+            return
+        temporary_path = os.path.join(self.directory, key + "." + uuid.uuid4().hex + ".tmp")
+        os.makedirs(temporary_path)
+
+        arrays = {
+            MASK_NAME: numpy.packbits(numpy.ascontiguousarray(noise_mask, dtype=bool)),
+            MEAN_NAME: nbh_mean.astype(numpy.float32, copy=False),
+            STD_NAME: nbh_std.astype(numpy.float32, copy=False)
+        }
+        for name, array in arrays.items():
+            file_atomic_write(os.path.join(temporary_path, name), lambda array_file: numpy.save(array_file, array))
+        manifest = {"shape": list(noise_mask.shape), "parameters": parameters, "created": time.time()}
+        file_atomic_write(os.path.join(temporary_path, ENTRY_MANIFEST_NAME),
+                          lambda manifest_file: manifest_file.write(json.dumps(manifest).encode()))
+
+        try:
+            os.rename(temporary_path, entry_path)
+        except OSError:
+            # Another process stored the same entry first:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+        self.evict()
+
+    def entries_get(self):
+        """
+        :return: the complete entries, the least recently used first
+        :rtype: list of tuples (last use time, bytes, path)
+        """
+        entries = list()
+        if not os.path.isdir(self.directory):
+            return entries
+        for name in os.listdir(self.directory):
+            entry_path = os.path.join(self.directory, name)
+            if name.endswith(".tmp") or not os.path.isdir(entry_path):
+                continue
+            try:
+                last_use = os.path.getmtime(os.path.join(entry_path, ENTRY_MANIFEST_NAME))
+                entry_bytes = sum(entry.stat().st_size for entry in os.scandir(entry_path))
+            except OSError:
+                continue
+            entries.append((last_use, entry_bytes, entry_path))
+        return sorted(entries)
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache takes at
+        most max_bytes.
+        """
+        entries = self.entries_get()
+        total_bytes = sum(entry_bytes for _, entry_bytes, _ in entries)
+        for _, entry_bytes, entry_path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_bytes -= entry_bytes
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,181 @@
+import itertools
+import time
+
+import numpy
+
+from batched_ga_engine import BatchedGAEngine, FALLBACK_BEST
+from population import deviation_coefficients_get
+
+# Offsets of each channel around the rounded mean of the neighborhood,
+# see DirectSolver:
+MEAN_OFFSETS = (-1, 0, 1)
+
+class DirectSolver(BatchedGAEngine):
+    """
+    This class replaces the noisy pixels without evolving anything. The
+    fitness of the GA is |z_1 + ... + z_C|, the deviation coefficients of
+    the channels against the mean and the standard deviation of the
+    neighborhood, and the GA stops once it is in the range
+    [min_deviation_coefficient, max_deviation_coefficient]. For this
+    objective, the chromosomes that meet the range can be listed
+    directly, for all the noisy pixels at once:
+
+    - The rounded mean of the neighborhood, and the values around it
+    (each channel moved by MEAN_OFFSETS): every channel of the rounded
+    mean is at most 0.5 away from the mean, and moving a channel by 1
+    moves the sum of the coefficients by 1/std of that channel, so one
+    of them usually lands in the range even for low deviations.
+    - Those values with the channel of the highest standard deviation
+    moved to cancel their sum of coefficients (see
+    compensated_candidates_get), for a neighborhood with a channel so
+    flat that moving it by 1 jumps over the range.
+    - The valid neighbors of the pixel, the initial population of the
+    GA (the nearest-neighbor-in-window candidates).
+    - The seed chromosome of the pixel, if any.
+
+    The values around the mean are tried first, and the rest only for
+    the pixels without any of them in range. The candidate in range
+    closest to the mean (the lowest sum of the squared deviation
+    coefficients) replaces the pixel, so a pixel gets the same fitness
+    the GA accepts, computed with the same float32 statistics (see
+    BatchedGAEngine.reference_statistics_get). A pixel without any
+    candidate in range (e.g. a channel with a standard deviation under
+    1, and the others flat or clipped) is counted as capped by the
+    generations, the limit the GA would reach, and gets the fallback:
+    the fittest candidate or the median of the neighbors.
+
+    It has the evolve method of the BatchedGAEngine, so it is used in
+    its place by GAImageApplier (see DIRECT_ENGINE).
+
+    :param min_deviation_coefficient: lower bound of the fitness
+    :param max_deviation_coefficient: upper bound of the fitness
+    :param max_pixel_value: the channels are in [0, max_pixel_value[
+    :param fallback_strategy: FALLBACK_BEST or FALLBACK_MEDIAN
+    :param metrics: MetricsCollector, None to not collect metrics
+    """
+    def __init__(self, min_deviation_coefficient, max_deviation_coefficient, max_pixel_value,
+                 fallback_strategy=FALLBACK_BEST, metrics=None):
+        super().__init__(population_size=1, min_deviation_coefficient=min_deviation_coefficient,
+                         max_deviation_coefficient=max_deviation_coefficient, max_pixel_value=max_pixel_value,
+                         fallback_strategy=fallback_strategy, metrics=metrics)
+
+    def mean_candidates_get(self, reference_mean):
+        """
+        :param reference_mean: numpy array (pixels, 1, channels)
+        :return: the rounded mean of each pixel moved by every
+        combination of MEAN_OFFSETS, within the range of the channels
+        :rtype: numpy array (pixels, offsets, channels)
+        """
+        channels_num = reference_mean.shape[2]
+        offsets = numpy.array(list(itertools.product(MEAN_OFFSETS, repeat=channels_num)), dtype=numpy.float32)
+        candidates = numpy.round(reference_mean) + offsets[numpy.newaxis]
+        return numpy.clip(candidates, 0, self.max_pixel_value - 1)
+
+    def compensated_candidates_get(self, candidates, reference_mean, reference_std):
+        """
+        Moves the channel with the highest standard deviation of each
+        candidate (the one whose values move the fitness the least) to
+        cancel the sum of the deviation coefficients of the candidate:
+        the sum is then at most 0.5/std of that channel away from 0.
+
+        :param candidates: numpy array (pixels, candidates, channels)
+        :return: the moved candidates, within the range of the channels
+        :rtype: numpy array (pixels, candidates, channels)
+        """
+        deviation_coeff = deviation_coefficients_get(candidates, reference_mean, reference_std)
+        residual = numpy.where(numpy.isfinite(deviation_coeff), deviation_coeff, 0).sum(axis=2)
+
+        widest_channel = numpy.argmax(reference_std[:, 0], axis=1)
+        widest_std = numpy.take_along_axis(reference_std[:, 0], widest_channel[:, numpy.newaxis], axis=1)
+
+        compensated = candidates.copy()
+        channel_values = numpy.take_along_axis(compensated, widest_channel[:, numpy.newaxis, numpy.newaxis], axis=2)[:, :, 0]
+        channel_values -= numpy.round(residual*widest_std)
+        numpy.put_along_axis(compensated, widest_channel[:, numpy.newaxis, numpy.newaxis],
+                             channel_values[:, :, numpy.newaxis], axis=2)
+        return numpy.clip(compensated, 0, self.max_pixel_value - 1)
+
+    def candidates_choose(self, candidates, candidates_valid, reference_mean, reference_std):
+        """
+        Chooses the valid candidate of each pixel whose fitness is in
+        range and that is the closest to the mean of the neighborhood.
+
+        :param candidates: numpy array (pixels, candidates, channels)
+        :param candidates_valid: boolean numpy array (pixels, candidates)
+        :param reference_mean: see BatchedGAEngine.reference_statistics_get
+        :param reference_std: see BatchedGAEngine.reference_statistics_get
+        :return: the chosen candidate of each pixel, True for the pixels
+        whose chosen candidate is in range, and the fittest candidate of
+        each pixel
+        :rtype: tuple of 3 numpy arrays
+        """
+        pixels = numpy.arange(len(candidates))
+
+        # The fitness of the GA (see BatchedGAEngine.population_fitness_calculate):
+        deviation_coeff = deviation_coefficients_get(candidates, reference_mean, reference_std)
+        fitness = numpy.where(candidates_valid, numpy.abs(deviation_coeff.sum(axis=2)), numpy.inf)
+        in_range = (self.min_deviation_coefficient <= fitness) & (fitness <= self.max_deviation_coefficient)
+
+        distance = numpy.where(in_range, (deviation_coeff*deviation_coeff).sum(axis=2), numpy.inf)
+        chosen = numpy.argmin(distance, axis=1)
+        fittest = candidates[pixels, numpy.argmin(fitness, axis=1)]
+        return candidates[pixels, chosen], in_range[pixels, chosen], fittest
+
+    def evolve(self, neighborhoods, neighborhoods_valid, seed_chromosomes=None, seeds_valid=None):
+        """
+        Finds the replacement of each noisy pixel, see the class.
+
+        :param neighborhoods: numpy array (pixels, window size, channels)
+        :param neighborhoods_valid: boolean numpy array (pixels, window size),
+        False for the neighbors out of the image.
+        :param seed_chromosomes: numpy array (pixels, channels), one more
+        candidate for each pixel, None for no seeds
+        :param seeds_valid: boolean numpy array (pixels), False for the
+        pixels without seed. All the seeds are valid if None.
+        :return: the chromosome of each noisy pixel
+        :rtype: numpy array (pixels, channels)
+        """
+        if self.metrics is not None:
+            start_time = time.perf_counter()
+
+        pixels_num = neighborhoods.shape[0]
+        neighbors = neighborhoods.astype(numpy.float32)
+        reference_mean, reference_std = self.reference_statistics_get(neighbors, neighborhoods_valid)
+
+        # The values around the mean first, they are the closest to it:
+        mean_candidates = self.mean_candidates_get(reference_mean)
+        chromosomes, found, fittest = self.candidates_choose(
+            mean_candidates, numpy.ones(mean_candidates.shape[:2], dtype=bool), reference_mean, reference_std)
+
+        # The values around the mean compensated, the neighbors and the
+        # seed, for the pixels without a value around the mean in range:
+        missing = numpy.flatnonzero(~found)
+        if len(missing) > 0:
+            compensated_candidates = self.compensated_candidates_get(
+                mean_candidates[missing], reference_mean[missing], reference_std[missing])
+            candidates = numpy.concatenate((compensated_candidates, neighbors[missing], fittest[missing, numpy.newaxis]), axis=1)
+            candidates_valid = numpy.concatenate(
+                (numpy.ones(compensated_candidates.shape[:2], dtype=bool), neighborhoods_valid[missing],
+                 numpy.ones((len(missing), 1), dtype=bool)), axis=1)
+            if seed_chromosomes is not None:
+                if seeds_valid is None:
+                    seeds_valid = numpy.ones(pixels_num, dtype=bool)
+                candidates = numpy.concatenate(
+                    (candidates, seed_chromosomes[missing, numpy.newaxis].astype(numpy.float32)), axis=1)
+                candidates_valid = numpy.concatenate((candidates_valid, seeds_valid[missing, numpy.newaxis]), axis=1)
+
+            chromosomes[missing], found[missing], fittest[missing] = self.candidates_choose(
+                candidates, candidates_valid, reference_mean[missing], reference_std[missing])
+
+        if not found.all():
+            self.capped_pixels["generations"] += int((~found).sum())
+            chromosomes[~found] = self.fallback_chromosomes_get(
+                fittest[~found], neighborhoods[~found], neighborhoods_valid[~found])
+
+        if self.metrics is not None:
+            self.metrics.time_add("fitness", time.perf_counter() - start_time)
+            if found.any():
+                # Solved without any generation:
+                self.metrics.histogram_add("generations_per_pixel", 0, int(found.sum()))
+
+        return chromosomes.astype(neighborhoods.dtype)
@@ -0,0 +1,154 @@
+import time
+
+from PIL import Image, ImageDraw, GifImagePlugin
+import numpy
+
+from band_io import image_8_bits_get
+
+FRAME_DURATION = 15 # Milliseconds per frame, as in ImageWrapper.create_gif_from_images
+GIF_TRAILER = b";"
+
+class FrameRecorder:
+    """
+    This class records the progress of the GA as an animated gif,
+    without keeping the images in RAM. Instead of storing a copy of
+    the image for each repaired pixel, a frame is captured only every
+    N repaired pixels, every N rows or every N seconds, and it is
+    written to the gif file right away.
+
+    All the frames share the palette of the first frame, and each
+    frame only stores the rectangle that changed since the previous
+    one, so the gif keeps sparse deltas and the memory needed is
+    about one image, no matter how many pixels are repaired.
+
+    :param gif_path: the path of the gif to write
+    :param every_n_pixels: capture a frame every N repaired pixels,
+    None to not capture based on pixels
+    :param every_n_rows: capture a frame every N processed rows, None
+    to not capture based on rows
+    :param every_n_seconds: capture a frame once N seconds passed since
+    the last one (checked when a pixel is repaired), None to not
+    capture based on time
+    :param duration: milliseconds of each frame in the gif
+    """
+    def __init__(self, gif_path, every_n_pixels=1, every_n_rows=None,
+                 every_n_seconds=None, duration=FRAME_DURATION):
+        self.gif_path = gif_path
+        self.every_n_pixels = every_n_pixels
+        self.every_n_rows = every_n_rows
+        self.every_n_seconds = every_n_seconds
+        self.duration = duration
+
+        self.gif_file = None
+        self.palette_image = None # First frame, its palette is used by all the frames
+        self.last_frame = None # Numpy array of the last frame written (palette indexes)
+        self.frames_count = 0
+        self.capture_time = 0 # Seconds spent capturing and encoding frames
+
+        self.pixels_since_capture = 0
+        self.rows_since_capture = 0
+        self.last_capture_time = time.monotonic()
+
+    # -- Setters & getters --
+    def frames_count_get(self):
+        return self.frames_count
+    def capture_time_get(self):
+        return self.capture_time
+    # -- End of Setters & getters --
+
+    def pixel_repaired(self, np_image, row):
+        """
+        Tells the recorder a pixel was repaired, so it can decide if a
+        new frame has to be captured.
+
+        :param np_image: the image being repaired, in numpy format
+        :param row: the row being processed
+        """
+        self.pixels_since_capture += 1
+
+        if self.every_n_pixels is not None and self.pixels_since_capture >= self.every_n_pixels:
+            self.frame_capture(np_image, row)
+        elif self.every_n_seconds is not None and\
+            time.monotonic() - self.last_capture_time >= self.every_n_seconds:
+            self.frame_capture(np_image, row)
+
+    def row_finished(self, np_image, row):
+        """
+        Tells the recorder a row was completed, so it can decide if a
+        new frame has to be captured.
+
+        :param np_image: the image being repaired, in numpy format
+        :param row: the row that was completed
+        """
+        self.rows_since_capture += 1
+
+        if self.every_n_rows is not None and self.rows_since_capture >= self.every_n_rows:
+            self.frame_capture(np_image, row)
+
+    def frame_capture(self, np_image, row):
+        """
+        Draws the green line over the current row, and writes the
+        frame to the gif. Only the area that changed since the last
+        frame is written.
+
+        :param np_image: the image being repaired, in numpy format, 8 or
+        16 bits (the gif has 8 bits)
+        :param row: the row where the green line is drawn
+        """
+        capture_start_time = time.monotonic()
+
+        frame = Image.fromarray(image_8_bits_get(np_image)).convert("RGB")
+        draw = ImageDraw.Draw(frame)
+        draw.line([(0, row), (frame.size[0], row)], fill="green")
+
+        if self.palette_image is None:
+            # The first frame sets the palette and the header of the gif:
+            frame = frame.quantize()
+            header, _ = GifImagePlugin.getheader(frame, info={"loop": 0})
+            self.palette_image = frame
+
+            self.gif_file = open(self.gif_path, "wb")
+            for block in header:
+                self.gif_file.write(block)
+            bounding_box = (0, 0) + frame.size
+        else:
+            frame = frame.quantize(palette=self.palette_image, dither=Image.Dither.NONE)
+
+            # Bounding box of the pixels that changed since the last frame:
+            changed = numpy.asarray(frame) != self.last_frame
+            changed_rows = numpy.flatnonzero(changed.any(axis=1))
+            changed_cols = numpy.flatnonzero(changed.any(axis=0))
+            if len(changed_rows) == 0:
+                # Nothing changed, the 1x1 frame keeps the timing of the animation:
+                bounding_box = (0, 0, 1, 1)
+            else:
+                bounding_box = (changed_cols[0], changed_rows[0], changed_cols[-1] + 1, changed_rows[-1] + 1)
+
+        self.last_frame = numpy.asarray(frame)
+
+        frame_delta = frame.crop(bounding_box)
+        for block in GifImagePlugin.getdata(frame_delta, offset=bounding_box[:2], duration=self.duration):
+            self.gif_file.write(block)
+
+        self.frames_count += 1
+        self.pixels_since_capture = 0
+        self.rows_since_capture = 0
+        self.last_capture_time = time.monotonic()
+        self.capture_time += self.last_capture_time - capture_start_time
+
+    def close(self, np_image=None, row=None):
+        """
+        Finishes the gif. If the image is given, a last frame with the
+        final image is captured first, so the gif always ends with the
+        result, no matter the capture interval.
+
+        :param np_image: the final image, in numpy format
+        :param row: the row where the green line is drawn
+        """
+        if np_image is not None and (self.pixels_since_capture > 0 or self.rows_since_capture > 0):
+            self.frame_capture(np_image, row)
+
+        if self.gif_file is not None:
+            self.gif_file.write(GIF_TRAILER)
+            self.gif_file.close()
+            self.gif_file = None
@@ -1,33 +1,110 @@
-import random
+import time
 import numpy
 
 from pixel import Pixel
+from population import Population, fitness_table_create, generation_split_check, GENERATION_SPLIT, PARENTS_RATIO
+from random_source import RandomSource
+from batched_ga_engine import BatchedGAEngine
+from direct_solver import DirectSolver
+from image_wrapper import neighborhood_moments_get, NEIGHBORHOOD_START_POSITION_SUBSTRACTOR
+from checkpoint import noise_mask_fingerprint_get
 
 """
-Supposing a pixel is a tuple of (R,G,B) and each channel
-is in the range of 0-255. The population will be conformed
-by the neighborhood and random mutant pixels.
+A pixel is a tuple with a value per channel, (R,G,B) for a color
+image. The population will be conformed by the neighborhood and random
+mutant pixels. It is the default of GAImageApplier.population_size_set.
 """
 POPULATION_SIZE = 25
 
+"""
+Adaptive mode (see GAImageApplier.adaptive_set), per noisy pixel:
+- A neighborhood with the standard deviation of every channel under
+LOW_VARIANCE_STD (for 8 bits channels, scaled to the bit depth) is
+almost flat, and any individual close to its mean is fit, so the
+population has MIN_POPULATION_SIZE individuals.
+- A population without a fit individual after GROWTH_GENERATION
+generations is struggling, and grows to MAX_POPULATION_SIZE individuals.
+- A pixel with more than NOISY_NEIGHBORS_RATIO of its window flagged as
+noisy has a neighborhood dominated by the noise, so its GA takes the
+neighborhood of a window RADIUS_GROWTH pixels wider on each side.
+"""
+MIN_POPULATION_SIZE = 10
+MAX_POPULATION_SIZE = 50
+LOW_VARIANCE_STD = 4.0
+GROWTH_GENERATION = 10
+NOISY_NEIGHBORS_RATIO = 0.5
+RADIUS_GROWTH = 1
+
+# Settings of a profile (see GAImageApplier.profile_apply and ga_tuner):
+PROFILE_KEYS = ("population_size", "neighborhood_radius", "elite_ratio", "crossover_ratio", "mutant_ratio", "adaptive",
+                "max_channel_deviation", "min_deviation_coefficient", "max_deviation_coefficient")
+
 R_INDEX = 0
 G_INDEX = 1
 B_INDEX = 2
 IMAGE_CHANNELS = [R_INDEX, G_INDEX, B_INDEX]
 
+# A pixel is noisy if any channel deviates more than this from its
+# neighborhood (see GAImageApplier.max_channel_deviation_set):
 MAX_CHANNEL_DEVIATION = 2
 
+# Range of the channels of an 8 bits image, [0:256[. The GA takes the
+# range of the image it works on (see GAImageApplier.image_obj_set), so
+# 16 bits images use [0:65536[:
 MIN_PIXEL_VALUE = 0
 MAX_PIXEL_VALUE = 256
 PIXEL_CHANNELS_NUM = 3
 
-VALID_VALS_IN_CHANNELS = [i for i in range(MAX_PIXEL_VALUE)] # List of 1,2,3,...,255
-
+# Fitness range of the chromosome that replaces a noisy pixel (see
+# GAImageApplier.deviation_coefficients_set):
 MIN_DEVIATION_COEFFICIENT = 0
 MAX_DEVIATION_COEFFICIENT = 0.5
 
 LIST_OF_RESULTING_IMAGES = list()
 
+# Engines to run the GA: pixel by pixel, or all the noisy pixels at once.
+# The DIRECT_ENGINE does not evolve, it solves the replacement of all the
+# noisy pixels at once (see DirectSolver). The BATCH_ENGINES repair all
+# the noisy pixels against the image before any pixel is repaired.
+PIXEL_ENGINE = "pixel"
+BATCHED_ENGINE = "batched"
+DIRECT_ENGINE = "direct"
+ENGINES = [PIXEL_ENGINE, BATCHED_ENGINE, DIRECT_ENGINE]
+BATCH_ENGINES = (BATCHED_ENGINE, DIRECT_ENGINE)
+
+# Limits for the GA of a single pixel. A pixel whose neighborhood is flat,
+# or whose fitness range can not be reached, could evolve forever, so
+# after MAX_GENERATIONS (or once the time budget of the whole image is
+# exhausted) the GA stops and the pixel is replaced by the fallback:
+MAX_GENERATIONS = 1000
+TIME_BUDGET = None # Seconds for the whole image, None means no budget
+
+# Fallbacks for the pixels that reach a limit: the best individual found
+# so far, or the median of the neighborhood
+FALLBACK_BEST = "best"
+FALLBACK_MEDIAN = "median"
+
+# Passes over the image: after the first one, only the pixels next to a
+# changed pixel are checked again (see start_ga_over_image)
+MAX_PASSES = 1
+
+"""
+The BATCHED_ENGINE evolves at most BATCH_MAX_PIXELS noisy pixels at
+once, so its memory does not grow with the image.
+
+Memory per pixel of an image with C channels of B bytes (B = 1 for 8
+bits, 2 for 16 bits), all buffers in compact integers or float32:
+- The image: C*B, and the same again for its padded copy, the layout
+  of the windows (ImageWrapper.windows_get), except for a memmap image.
+- The detection: the noise mask (1) and the deviation coefficients
+  (4*C) stay until the run ends. While the whole image is detected, the
+  summed-area tables and the mean and standard deviation planes take
+  about 7 buffers of 4*C (8*C for the int64 tables of 16 bits images).
+- The batched GA: about 3 KB per noisy pixel in the batch (for C = 3),
+  so at most about BATCH_MAX_PIXELS*3 KB, whatever the image size.
+"""
+BATCH_MAX_PIXELS = 1 << 15
+
 class GAImageApplier:
     """
     This class will be in charged of applying the GA over all the image.
@@ -40,49 +117,251 @@ class GAImageApplier:
     """
     def __init__(self):
         self.image_obj = None # An instance of the ImageWrapper
-        self.population = list() # List of instances of the class Pixel
+        self.population = Population(numpy.empty((0, PIXEL_CHANNELS_NUM))) # Population of the pixel being repaired
         self.neighborhood_raw = None # Numpy array with the neighborhood of the Pixel
         self.resulting_images = list() # List of the resulting images of each pixel processed
         self.list_of_rows = list()
+        self.frame_recorder = None # FrameRecorder that streams the frames, instead of resulting_images
+        self.keep_resulting_images = True # False to not store any frame at all
+        self.verbose = True # False to not print the progress of the GA
+        self.random_source = RandomSource() # Random numbers for crossover and mutants
+        self.metrics = None # MetricsCollector, None to not collect metrics
+        self.noise_mask = None # Boolean numpy array, True where the pixel is noisy
+        self.z_scores = None # Deviation coefficient per pixel and channel, see z_scores_get
+        self.nbh_mean = None # Mean planes of a cached detection, the z_scores are calculated from them
+        self.nbh_std = None # Standard deviation planes of a cached detection
+        self.detection_cache = None # DetectionCache, None to always detect the noise
+        self.engine = PIXEL_ENGINE # One of ENGINES
+        self.max_generations = MAX_GENERATIONS
+        self.time_budget = TIME_BUDGET
+        self.fallback_strategy = FALLBACK_BEST # FALLBACK_BEST or FALLBACK_MEDIAN
+        self.max_passes = MAX_PASSES
+        self.max_pixel_value = MAX_PIXEL_VALUE # The channels are in [0:max_pixel_value[
+        self.passes_num = 0 # Passes done by the last run
+        self.deadline = None # time.monotonic() value when the time budget is exhausted
+        self.capped_pixels = {"generations": 0, "time_budget": 0} # Pixels that used the fallback
+        self.checkpointer = None # Checkpointer that saves the progress of the run, None for no checkpoints
+        self.population_size = POPULATION_SIZE
+        self.generation_split = GENERATION_SPLIT # Ratios of each generation, see population.GENERATION_SPLIT
+        self.neighborhood_radius = None # Radius of the window, None for the one of the ImageWrapper
+        self.adaptive = False # True to adapt the population and the window to each pixel
+        self.min_population_size = MIN_POPULATION_SIZE
+        self.max_population_size = MAX_POPULATION_SIZE
+        self.noisy_neighbors = None # Noisy pixels in the window of each pixel, for the adaptive mode
+        self.max_channel_deviation = MAX_CHANNEL_DEVIATION
+        self.min_deviation_coefficient = MIN_DEVIATION_COEFFICIENT
+        self.max_deviation_coefficient = MAX_DEVIATION_COEFFICIENT
+        self.checkpoint_fingerprint = None # What identifies the run in its checkpoints
 
     # -- Setters & getters --
     def image_obj_set(self, image_obj):
+        """
+        Sets the image to repair. The range of the channels is taken
+        from the type of the image, 8 or 16 bits. The detection and the
+        rows of a previous image are dropped, so an applier can be
+        reused for another image.
+        """
         self.image_obj = image_obj
+        self.noise_mask = None
+        self.z_scores = None
+        self.nbh_mean = None
+        self.nbh_std = None
+        self.noisy_neighbors = None
+        self.list_of_rows = list()
+        self.resulting_images = list()
+        if self.neighborhood_radius is not None:
+            self.image_obj.neighborhood_radius_set(self.neighborhood_radius)
+        if image_obj.get_np_image_format() is not None:
+            self.max_pixel_value = int(image_obj.max_channel_value_get()) + 1
+        if self.metrics is not None:
+            self.image_obj.metrics_set(self.metrics)
+    def metrics_set(self, metrics):
+        """
+        Sets the MetricsCollector of the GA, and of its ImageWrapper.
+        """
+        self.metrics = metrics
+        if self.image_obj is not None:
+            self.image_obj.metrics_set(metrics)
+    def metrics_get(self):
+        return self.metrics
+    def engine_set(self, engine):
+        self.engine = engine
+    def max_generations_set(self, max_generations):
+        self.max_generations = max_generations
+    def time_budget_set(self, time_budget):
+        self.time_budget = time_budget
+    def fallback_strategy_set(self, fallback_strategy):
+        self.fallback_strategy = fallback_strategy
+    def random_source_set(self, random_source):
+        """
+        Sets the RandomSource of the GA, e.g. RandomSource(seed) for a
+        reproducible run.
+        """
+        self.random_source = random_source
+    def random_source_get(self):
+        return self.random_source
+    def max_passes_set(self, max_passes):
+        self.max_passes = max_passes
+    def passes_num_get(self):
+        return self.passes_num
+    def capped_pixels_get(self):
+        return self.capped_pixels
     def population_get(self):
-        return self.population
+        """
+        :return: the population as a list of Pixel instances (views
+        of the rows of the Population)
+        :rtype: list
+        """
+        return self.population.pixels_get()
 
     def resulting_images_get(self):
         return self.resulting_images
 
     def list_of_rows_get(self):
         return self.list_of_rows
+
+    def frame_recorder_set(self, frame_recorder):
+        self.frame_recorder = frame_recorder
+    def checkpointer_set(self, checkpointer):
+        self.checkpointer = checkpointer
+    def checkpointer_get(self):
+        return self.checkpointer
+    def detection_cache_set(self, detection_cache):
+        self.detection_cache = detection_cache
+    def detection_cache_get(self):
+        return self.detection_cache
+    def population_size_set(self, population_size):
+        self.population_size = population_size
+    def population_size_get(self):
+        return self.population_size
+    def generation_split_set(self, elite_ratio, crossover_ratio, mutant_ratio, parents_ratio=PARENTS_RATIO):
+        """
+        Sets the split of each new generation: the ratio of the population
+        bypassed, created by crossover (from the best parents_ratio of the
+        population) and mutated. ValueError if it can not create
+        generations (see population.generation_split_check).
+        """
+        split = (elite_ratio, crossover_ratio, parents_ratio, mutant_ratio)
+        generation_split_check(split)
+        self.generation_split = split
+    def generation_split_get(self):
+        return self.generation_split
+    def neighborhood_radius_set(self, radius):
+        """
+        Sets the radius of the window of the detection and of the GA (2
+        for the 5 x 5 window), for this image and the next ones.
+        """
+        self.neighborhood_radius = radius
+        if self.image_obj is not None:
+            self.image_obj.neighborhood_radius_set(radius)
+    def neighborhood_radius_get(self):
+        if self.image_obj is not None:
+            return self.image_obj.neighborhood_radius_get()
+        if self.neighborhood_radius is not None:
+            return self.neighborhood_radius
+        return NEIGHBORHOOD_START_POSITION_SUBSTRACTOR
+    def adaptive_set(self, adaptive, min_population_size=MIN_POPULATION_SIZE, max_population_size=MAX_POPULATION_SIZE):
+        """
+        Turns the adaptive mode on or off, see MIN_POPULATION_SIZE.
+        """
+        self.adaptive = adaptive
+        self.min_population_size = min_population_size
+        self.max_population_size = max_population_size
+    def max_channel_deviation_set(self, max_channel_deviation):
+        self.max_channel_deviation = max_channel_deviation
+    def max_channel_deviation_get(self):
+        return self.max_channel_deviation
+    def deviation_coefficients_set(self, min_deviation_coefficient, max_deviation_coefficient):
+        self.min_deviation_coefficient = min_deviation_coefficient
+        self.max_deviation_coefficient = max_deviation_coefficient
+    def deviation_coefficients_get(self):
+        return self.min_deviation_coefficient, self.max_deviation_coefficient
+    def keep_resulting_images_set(self, keep_resulting_images):
+        self.keep_resulting_images = keep_resulting_images
+    def verbose_set(self, verbose):
+        self.verbose = verbose
+
+    def noise_mask_get(self):
+        return self.noise_mask
+    def noise_mask_set(self, noise_mask):
+        self.noise_mask = noise_mask
+        self.noisy_neighbors = None
+    def z_scores_get(self):
+        """
+        :return: the deviation coefficients of the last detection. A
+        detection taken from the cache only has the planes of the
+        neighborhoods, so they are calculated from them the first time.
+        :rtype: numpy array (height, width, channels) or None
+        """
+        if self.z_scores is None and self.nbh_mean is not None:
+            self.z_scores = self.z_scores_calculate(self.nbh_mean, self.nbh_std)
+        return self.z_scores
+
+    def profile_apply(self, profile):
+        """
+        Applies the settings of a profile, a dict with some of the
+        PROFILE_KEYS (as written by ga_tuner). The missing ones keep
+        their values.
+        """
+        if "population_size" in profile:
+            self.population_size_set(profile["population_size"])
+        if "neighborhood_radius" in profile:
+            self.neighborhood_radius_set(profile["neighborhood_radius"])
+        if any(key in profile for key in ("elite_ratio", "crossover_ratio", "mutant_ratio")):
+            elite_ratio, crossover_ratio, parents_ratio, mutant_ratio = self.generation_split
+            self.generation_split_set(profile.get("elite_ratio", elite_ratio),
+                                      profile.get("crossover_ratio", crossover_ratio),
+                                      profile.get("mutant_ratio", mutant_ratio), parents_ratio)
+        if "adaptive" in profile:
+            self.adaptive_set(profile["adaptive"], self.min_population_size, self.max_population_size)
+        if "max_channel_deviation" in profile:
+            self.max_channel_deviation_set(profile["max_channel_deviation"])
+        if "min_deviation_coefficient" in profile or "max_deviation_coefficient" in profile:
+            self.deviation_coefficients_set(profile.get("min_deviation_coefficient", self.min_deviation_coefficient),
+                                            profile.get("max_deviation_coefficient", self.max_deviation_coefficient))
+
+    def profile_get(self):
+        """
+        :return: the current settings, as profile_apply takes them
+        :rtype: dict
+        """
+        elite_ratio, crossover_ratio, _, mutant_ratio = self.generation_split
+        return {
+            "population_size": self.population_size,
+            "neighborhood_radius": int(self.neighborhood_radius_get()),
+            "elite_ratio": elite_ratio,
+            "crossover_ratio": crossover_ratio,
+            "mutant_ratio": mutant_ratio,
+            "adaptive": self.adaptive,
+            "max_channel_deviation": self.max_channel_deviation,
+            "min_deviation_coefficient": self.min_deviation_coefficient,
+            "max_deviation_coefficient": self.max_deviation_coefficient
+        }
     
     def population_set(self, population):
         """
         This function will set the new population, and the expected
-        value is list of instances of the class Pixel.
+        value is a Population, or a list of instances of the class Pixel.
 
         More than setting, this function converts the list of Pixel
-        instances to a raw numpy array.
+        instances to a Population, measured against the same
+        neighborhood as the current population. neighborhood_raw keeps
+        the neighborhood of the noisy pixel.
 
-        :param population: list of Pixel instances to be set to the
-        member population.
+        :param population: Population or list of Pixel instances to be
+        set to the member population.
         """
-        # Just setting the new population
-        self.population = population
+        if not isinstance(population, Population):
+            population = Population.from_pixels(population, self.population.fitness_table_get())
 
-        self.neighborhood_raw = list()
-        # Convert the population to raw neighborhood:
-        for pixel in self.population:
-            self.neighborhood_raw.append(numpy.array(pixel.get_chromosome()))
-        
-        self.neighborhood_raw = numpy.array(self.neighborhood_raw)
+        self.population = population
     # -- End of Setters & getters --
 
     def calculate_deviation_coeff(self, pixel, neighborhood):
         """
         The neighborhood is a list of pixels, accomodated in
-        a numpy array as follows:
+        a numpy array as follows (for an RGB image, the same goes
+        for any number of channels):
 
         [
             ...,
@@ -106,31 +385,30 @@ class GAImageApplier:
 
         If |Z| > 2 -> probable that is out of the average
         if |Z| > 3 -> highly probable that the value is a rare one.
-        """
-        # Since the neighborhood is numpy array, we can get columns at
-        # once, with the following notation [:, col_index]. This means
-        # that we want all the column in the certain x index.
-        # Note: ngh stands for neighborhood, shorting it for readability
-        nbh_r_channel = neighborhood[:, R_INDEX]
-        nbh_g_channel = neighborhood[:, G_INDEX]
-        nbh_b_channel = neighborhood[:, B_INDEX]
 
-        # Getting the average per channel
-        nbh_r_channel_mean = numpy.mean(nbh_r_channel)
-        nbh_g_channel_mean = numpy.mean(nbh_g_channel)
-        nbh_b_channel_mean = numpy.mean(nbh_b_channel)
+        :return: the deviation coefficient of each channel, as float32
+        (a tuple of R, G and B can be unpacked from it)
+        :rtype: numpy array
+        """
+        if self.metrics is not None:
+            start_time = time.perf_counter()
 
-        # Getting the standard deviation (std) per channel
-        nbh_r_channel_std = numpy.std(nbh_r_channel)
-        nbh_g_channel_std = numpy.std(nbh_g_channel)
-        nbh_b_channel_std = numpy.std(nbh_b_channel)
+        # Since the neighborhood is numpy array, we can get the columns
+        # (channels) at once, with axis=0. The mean and the standard
+        # deviation (std) are accumulated in float32, without float64
+        # temporaries:
+        # Note: ngh stands for neighborhood, shorting it for readability
+        nbh_channels_mean = numpy.mean(neighborhood, axis=0, dtype=numpy.float32)
+        nbh_channels_std = numpy.std(neighborhood, axis=0, dtype=numpy.float32)
 
         # Getting the deviation coeffiecient (dc) per channel
-        nbh_r_channel_dc = (pixel[R_INDEX] - nbh_r_channel_mean)/nbh_r_channel_std
-        nbh_g_channel_dc = (pixel[G_INDEX] - nbh_g_channel_mean)/nbh_g_channel_std
-        nbh_b_channel_dc = (pixel[B_INDEX] - nbh_b_channel_mean)/nbh_b_channel_std
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            nbh_channels_dc = (numpy.reshape(pixel, -1) - nbh_channels_mean)/nbh_channels_std
+
+        if self.metrics is not None:
+            self.metrics.time_add("calculate_deviation_coeff", time.perf_counter() - start_time)
 
-        return nbh_r_channel_dc, nbh_g_channel_dc, nbh_b_channel_dc
+        return nbh_channels_dc
 
 
     def is_pixel_noisy(self, pixel, neighborhood):
@@ -144,62 +422,267 @@ class GAImageApplier:
 
         :param pixel: the Pixel to be analized
         :param neighborhood: the beighborhood to compare the given pixel to.
-        :return: True if the deviation of any of the 3 channels is greater
+        :return: True if the deviation of any of the channels is greater
         than 2, false otherwise.
         :rtype: boolean
         """
 
         # Getting the deviation coefficient based on the pixel to be analized
         # and its given neighborhood
-        nbh_r_channel_dc, nbh_g_channel_dc, nbh_b_channel_dc = self.calculate_deviation_coeff(pixel, neighborhood)
+        nbh_channels_dc = self.calculate_deviation_coeff(pixel, neighborhood)
         
         # If one of all deviations is greater than 2, then the pixel is
         # considered as noisy. It means in further steps we need to appply
         # GA to clean the pixel.
-        return abs(nbh_r_channel_dc) > MAX_CHANNEL_DEVIATION or\
-            abs(nbh_g_channel_dc) > MAX_CHANNEL_DEVIATION or\
-            abs(nbh_b_channel_dc) > MAX_CHANNEL_DEVIATION
+        return bool(numpy.any(numpy.abs(nbh_channels_dc) > self.max_channel_deviation))
+
+    def noise_mask_calculate(self):
+        """
+        This function does the same as is_pixel_noisy, but for the whole
+        image at once. The mean and the standard deviation of every
+        neighborhood are taken from the ImageWrapper, that builds them
+        with summed-area tables, so no neighborhood is extracted.
+
+        The deviation coefficient of a pixel against a flat neighborhood
+        (std = 0) is nan if the pixel is equal to the mean, and inf
+        otherwise, the same as calculate_deviation_coeff would give.
+
+        With a DetectionCache (see detection_cache_set), the detection
+        of an image already detected with the same window is taken from
+        it, and a new one is stored in it. The deviation coefficients
+        are not calculated on a hit, see z_scores_get.
+
+        :return: the noise mask with shape (height, width), True if the
+        pixel is noisy, and the deviation coefficients with shape
+        (height, width, channels), None on a hit of the cache.
+        :rtype: tuple of 2 numpy arrays
+        """
+        if self.metrics is not None:
+            start_time = time.perf_counter()
+
+        self.noisy_neighbors = None
+        self.z_scores = None
+        self.nbh_mean = None
+        self.nbh_std = None
+
+        cache_key = None
+        if self.detection_cache is not None:
+            cache_key = self.detection_cache.key_get(self.image_obj.get_np_image_format(), self.detection_parameters_get())
+            cached = self.detection_cache.load(cache_key)
+            if cached is not None:
+                self.noise_mask, self.nbh_mean, self.nbh_std = cached
+                if self.metrics is not None:
+                    self.metrics.time_add("detection", time.perf_counter() - start_time)
+                    self.metrics.count("detection_cache_hits", 1)
+                return self.noise_mask, None
+
+        nbh_mean, nbh_std, nbh_count = self.image_obj.neighborhood_statistics_get()
+        self.z_scores = self.z_scores_calculate(nbh_mean, nbh_std)
+
+        # nan compares as False, so a pixel equal to a flat neighborhood
+        # is not noisy:
+        self.noise_mask = numpy.any(numpy.abs(self.z_scores) > self.max_channel_deviation, axis=2)
+
+        if cache_key is not None:
+            self.detection_cache.store(cache_key, self.noise_mask, nbh_mean, nbh_std, self.detection_parameters_get())
+
+        if self.metrics is not None:
+            self.metrics.time_add("detection", time.perf_counter() - start_time)
+            self.metrics.count("pixels_scanned", self.noise_mask.size)
+
+        return self.noise_mask, self.z_scores
+
+    def z_scores_calculate(self, nbh_mean, nbh_std):
+        """
+        :return: the deviation coefficient of every pixel and channel of
+        the image against the given planes of the neighborhoods
+        :rtype: numpy array (height, width, channels)
+        """
+        image = self.image_obj.get_np_image_format()
+        if image.ndim == 2:
+            image = image[:, :, numpy.newaxis]
+
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return (image - nbh_mean)/nbh_std
+
+    def detection_parameters_get(self):
+        """
+        :return: the parameters the detection depends on, besides the
+        image, for the key of the DetectionCache
+        :rtype: dict
+        """
+        return {
+            "neighborhood_radius": int(self.image_obj.neighborhood_radius_get()),
+            "max_channel_deviation": self.max_channel_deviation
+        }
+
+    def noise_mask_update(self, pixels_y, pixels_x):
+        """
+        Detects again only the given pixels, and updates noise_mask and
+        z_scores with the result. The neighborhood of each pixel is
+        gathered from the window view of the ImageWrapper, so the cost
+        depends on the number of pixels and not on the image size.
+
+        The statistics are calculated with the same integers and the
+        same float32 operations as neighborhood_statistics_get (see
+        neighborhood_moments_get), so a pixel gets the same result
+        noise_mask_calculate would give.
+
+        :param pixels_y: numpy array with the y positions of the pixels
+        :param pixels_x: numpy array with the x positions of the pixels
+        :return: True for each pixel that is noisy
+        :rtype: numpy array
+        """
+        if self.metrics is not None:
+            start_time = time.perf_counter()
+
+        # The deviation coefficients of a cached detection are needed
+        # before the pixels change:
+        self.z_scores_get()
+
+        neighborhoods, neighborhoods_valid = self.image_obj.neighborhoods_get(pixels_y, pixels_x)
+        dtype = self.image_obj.accumulator_dtype_get()
+        neighborhoods = neighborhoods.astype(dtype)*neighborhoods_valid[:, :, numpy.newaxis]
+
+        count = neighborhoods_valid.sum(axis=1)[:, numpy.newaxis]
+        nbh_sum = neighborhoods.sum(axis=1, dtype=dtype)
+        nbh_sum_sq = (neighborhoods*neighborhoods).sum(axis=1, dtype=dtype)
+        nbh_mean, nbh_std = neighborhood_moments_get(nbh_sum, nbh_sum_sq, count)
+
+        pixels = self.image_obj.get_np_image_format()[pixels_y, pixels_x].reshape(
+            (len(pixels_y), self.image_obj.channels_num_get()))
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            z_scores = (pixels - nbh_mean)/nbh_std
+        noisy = numpy.any(numpy.abs(z_scores) > self.max_channel_deviation, axis=1)
+
+        self.noise_mask[pixels_y, pixels_x] = noisy
+        self.noisy_neighbors = None
+        if self.z_scores is not None:
+            self.z_scores[pixels_y, pixels_x] = z_scores
+
+        if self.metrics is not None:
+            self.metrics.time_add("detection", time.perf_counter() - start_time)
+            self.metrics.count("pixels_scanned", len(pixels_y))
+
+        return noisy
+
+    def dirty_pixels_get(self, changed_y, changed_x):
+        """
+        Gets the pixels whose neighborhood contains at least one of the
+        changed pixels, that is, the changed pixels grown by the window.
+
+        :param changed_y: numpy array with the y positions of the changed pixels
+        :param changed_x: numpy array with the x positions of the changed pixels
+        :return: the y and x positions of the dirty pixels, without
+        duplicates and in raster order
+        :rtype: tuple of 2 numpy arrays
+        """
+        image_height, image_width = self.image_obj.shape_get()[:2]
+
+        # A pixel has the changed pixel in its window if it is at the
+        # opposite offset from the changed pixel:
+        window_offsets = self.image_obj.neighborhood_start_position_substractor -\
+            numpy.arange(self.image_obj.neighborhood_height_width)
+        offsets_y, offsets_x = numpy.meshgrid(window_offsets, window_offsets, indexing="ij")
 
-    def create_population(self, neighborhood):
+        dirty_y = (changed_y[:, numpy.newaxis] + offsets_y.ravel()).ravel()
+        dirty_x = (changed_x[:, numpy.newaxis] + offsets_x.ravel()).ravel()
+        inside = (dirty_y >= 0) & (dirty_y < image_height) & (dirty_x >= 0) & (dirty_x < image_width)
+
+        dirty_pixels = numpy.unique(dirty_y[inside]*image_width + dirty_x[inside])
+        return numpy.divmod(dirty_pixels, image_width)
+
+    def create_population(self, neighborhood, population_size=None):
         """
         This function creates an initial population based on the
-        neighborhood. The expected population size is contained
-        in POPULATION_SIZE. If the neighborhood is lower than that
-        constant, then adding mutant pixels.
+        neighborhood. The expected population size is population_size.
+        If the neighborhood is smaller than that (e.g. the neighborhood
+        of an edge pixel), then adding mutant pixels.
 
         :param neighborhood: the neighborhood to start creating the
         population of the GA.
+        :param population_size: the expected population size,
+        self.population_size if None
         """
-        neighborhood_len = len(neighborhood)
-        missing_individuals = POPULATION_SIZE - neighborhood_len
-
-        if missing_individuals != 0:
-            for mutant_index in range(missing_individuals):
-                # Create a list of 3 vals in the range [0:256[
-                mutant_pixel = random.sample(VALID_VALS_IN_CHANNELS, PIXEL_CHANNELS_NUM)
-                numpy.append(neighborhood, numpy.array(mutant_pixel))
+        if population_size is None:
+            population_size = self.population_size
+        missing_individuals = population_size - len(neighborhood)
+
+        chromosomes = neighborhood
+        if missing_individuals > 0:
+            # A value per channel in the range [0:max_pixel_value[ for each mutant:
+            mutant_pixels = self.random_source.integers(0, self.max_pixel_value, (missing_individuals, neighborhood.shape[1]))
+            chromosomes = numpy.concatenate((neighborhood, mutant_pixels.astype(neighborhood.dtype)))
         self.neighborhood_raw = neighborhood
 
-        pixel_objects = list()
-        # Convert each pixel representing the RGB, to an object that
-        # also stores the fitness score:
-        for neighbor in neighborhood:
-            pixel = Pixel()
-            pixel.set_chromosome(neighbor)
-            pixel_objects.append(pixel)
-        
-        self.population = pixel_objects
+        # The chromosomes are the neighbors and the mutants, and the
+        # neighborhood alone is the reference of the fitness of every
+        # generation, so its statistics are calculated only once:
+        self.population = Population(chromosomes, fitness_table_create(neighborhood, self.max_pixel_value))
+
+    def low_variance_get(self, neighborhoods, neighborhoods_valid):
+        """
+        :param neighborhoods: numpy array (pixels, window size, channels)
+        :param neighborhoods_valid: boolean numpy array (pixels, window size)
+        :return: True for each pixel whose neighborhood is almost flat,
+        see LOW_VARIANCE_STD
+        :rtype: numpy array
+        """
+        weights = neighborhoods_valid[:, :, numpy.newaxis]
+        valid_num = weights.sum(axis=1)
+        values = numpy.where(weights, neighborhoods, 0).astype(numpy.float32)
+        nbh_mean = values.sum(axis=1)/valid_num
+        deviation = numpy.where(weights, values - nbh_mean[:, numpy.newaxis], 0)
+        nbh_std = numpy.sqrt((deviation*deviation).sum(axis=1)/valid_num)
+        return numpy.all(nbh_std < LOW_VARIANCE_STD*(self.max_pixel_value - 1)/(MAX_PIXEL_VALUE - 1), axis=1)
+
+    def pixel_radii_get(self, pixels_y, pixels_x):
+        """
+        :return: the radius of the window the GA of each pixel takes its
+        neighborhood from: the one of the neighborhood, RADIUS_GROWTH
+        more in the adaptive mode for the pixels surrounded by noise
+        (see NOISY_NEIGHBORS_RATIO)
+        :rtype: numpy array of ints
+        """
+        radius = int(self.image_obj.neighborhood_radius_get())
+        if not self.adaptive:
+            return numpy.full(len(pixels_y), radius)
+
+        if self.noisy_neighbors is None:
+            self.noisy_neighbors = self.image_obj.window_sums_get(self.noise_mask, dtype=numpy.int32)
+        window_area = self.image_obj.neighborhood_height_width*self.image_obj.neighborhood_height_width
+        surrounded = self.noisy_neighbors[pixels_y, pixels_x] > NOISY_NEIGHBORS_RATIO*window_area
+        return numpy.where(surrounded, radius + RADIUS_GROWTH, radius)
+
+    def pixel_neighborhood_get(self, pixel_y, pixel_x):
+        """
+        :return: the neighborhood the GA of the pixel starts from, see
+        pixel_radii_get
+        :rtype: numpy array (neighbors, channels)
+        """
+        if not self.adaptive:
+            return self.image_obj.neighborhood_get(pixel_y, pixel_x)
+        radius = self.pixel_radii_get(numpy.array([pixel_y]), numpy.array([pixel_x]))[0]
+        return self.image_obj.neighborhood_get(pixel_y, pixel_x, int(radius))
 
     def population_fitness_calculate(self):
         """
-        This function iterates over the population (list of Pixel
-        instances) and calculates the deviation coefficient per
-        pixel. The sum of the deviations of each channel is the
-        final fitness score.
+        This function calculates the deviation coefficient of all
+        the population at once, against the neighborhood of the noisy
+        pixel. The absolute value of the sum of the deviations of each
+        channel is the final fitness score.
+
+        The deviation of every value of every channel was calculated
+        once in create_population (see fitness_table_create), so the
+        score of an individual is one table lookup per channel.
         """
-        for pixel in self.population:
-            nbh_r_channel_dc, nbh_g_channel_dc, nbh_b_channel_dc = self.calculate_deviation_coeff(pixel.get_chromosome(), self.neighborhood_raw)
-            pixel.set_fitness(nbh_r_channel_dc + nbh_g_channel_dc + nbh_b_channel_dc)
+        if self.metrics is not None:
+            start_time = time.perf_counter()
+
+        self.population.fitness_calculate()
+
+        if self.metrics is not None:
+            self.metrics.time_add("fitness", time.perf_counter() - start_time)
 
 
     def crossover_operation(self, pixel_parent_1, pixel_parent_2):
@@ -207,7 +690,7 @@ class GAImageApplier:
         This function perform the crossover operation over a random choiced
         pixels from the first 50% of the pixels of the last generation.
 
-        The idea is to iterate over the 3 channels of the new child pixel and
+        The idea is to iterate over the channels of the new child pixel and
         decide based on a random choice if the child channel will be from the
         parent 1 or the parent 2.
 
@@ -217,12 +700,11 @@ class GAImageApplier:
         :rtype: class Pixel
         """
         
-        # Chromosome is a tuple of (R, G, B)
+        # Chromosome is a tuple of (R, G, B), or of the channels of the image
         temp_chromosome = list()
-        list_parent_choice = [True, False]
         pixel = Pixel()
-        for channel in IMAGE_CHANNELS:
-            is_parent_1 = random.choice(list_parent_choice)
+        for channel in range(len(pixel_parent_1.get_chromosome())):
+            is_parent_1 = self.random_source.random() < 0.5
             if is_parent_1:
                 temp_chromosome.append(pixel_parent_1.get_chromosome()[channel])
             else:
@@ -231,134 +713,517 @@ class GAImageApplier:
 
         return pixel
 
+    def fittest_chromosome_search(self, neighborhood, seed_chromosome=None):
+        """
+        This function applies the GA over a single noisy pixel. The
+        initial population is created from its neighborhood, and new
+        generations are evolved until the fittest individual has a
+        fitness in the range of deviation_coefficients_set.
+
+        If max_generations is reached, or the time budget of the image
+        is exhausted, the GA stops and the fallback chromosome is
+        returned instead (see fallback_chromosome_get).
+
+        :param neighborhood: the neighborhood of the noisy pixel.
+        :param seed_chromosome: an extra individual for the initial
+        population (a warm start), None for no seed.
+        :return: the chromosome of the fittest individual, that will
+        replace the noisy pixel.
+        :rtype: tuple or numpy array of (R, G, B), or of the channels of
+        the image
+        """
+        # Create an initial population, that consists on
+        # the neighborhood and some mutant pixels that will be added
+        # if the neighborhood is smaller than the population size. In
+        # the adaptive mode, an almost flat neighborhood gets a small
+        # population:
+        population_size = self.population_size
+        if self.adaptive and self.low_variance_get(neighborhood[numpy.newaxis],
+                                                   numpy.ones((1, len(neighborhood)), dtype=bool))[0]:
+            population_size = self.min_population_size
+        self.create_population(neighborhood, population_size)
+
+        if seed_chromosome is not None:
+            self.population = Population(numpy.concatenate((self.population.chromosomes_get(), [seed_chromosome])),
+                                         self.population.fitness_table_get())
+
+        # Calculate the fitness of this population, we could already
+        # found the fittest pixel:
+        self.population_fitness_calculate()
+
+        # Sort the population based on the fitness score:
+        self.population.sort()
+
+        # Start generations of the GA:
+
+        # Counter for generations:
+        generation = 1
+
+        # Best individual found so far, for the fallback:
+        best_fitness = numpy.inf
+        best_chromosome = self.population.chromosomes_get()[0]
+
+        while True:
+
+            # Getting the first individual fitness, to see if it is
+            # on the required range of Z:
+            first_ind_fitness = self.population.fitness_get()[0]
+
+            if self.min_deviation_coefficient <= first_ind_fitness <= self.max_deviation_coefficient:
+
+                # If we found the fittest pixel, it is the one that will
+                # replace the noisy pixel:
+                if self.metrics is not None:
+                    self.metrics.histogram_add("generations_per_pixel", generation)
+                return self.population.chromosomes_get()[0]
+
+            # A nan fitness (flat population) is never the best one:
+            if first_ind_fitness < best_fitness:
+                best_fitness = first_ind_fitness
+                best_chromosome = self.population.chromosomes_get()[0]
+
+            # Stop the GA if the pixel reached one of the limits:
+            if self.max_generations is not None and generation >= self.max_generations:
+                self.capped_pixels["generations"] += 1
+                return self.fallback_chromosome_get(best_chromosome, neighborhood)
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                self.capped_pixels["time_budget"] += 1
+                return self.fallback_chromosome_get(best_chromosome, neighborhood)
+            
+            # If the fittest pixel is not found yet, lets continue with the GA,
+            # creating a new generation: the first 20% of the last population
+            # is bypassed, 75% are children of the first 50%, and the last 5%
+            # are mutant pixels (see generation_split_set). A struggling
+            # pixel grows its population in the adaptive mode:
+            if self.adaptive and generation == GROWTH_GENERATION:
+                population_size = self.max_population_size
+
+            if self.metrics is not None:
+                start_time = time.perf_counter()
+
+            self.population_set(self.population.next_generation_create(
+                self.random_source, population_size, self.max_pixel_value, self.generation_split))
+
+            if self.metrics is not None:
+                self.metrics.time_add("crossover", time.perf_counter() - start_time)
+            
+            # Calculate the fitness of each pixel of the recently created population:
+            self.population_fitness_calculate()
+
+            # Sort the population again based on the fitness, to be bypassed
+            # to the next generation
+            self.population.sort()
+
+            generation += 1
+
+    def fallback_chromosome_get(self, best_chromosome, neighborhood):
+        """
+        Gets the chromosome that replaces a noisy pixel whose GA reached
+        a limit, based on the fallback_strategy.
+
+        :param best_chromosome: the best individual found by the GA
+        :param neighborhood: the neighborhood of the noisy pixel
+        :return: the best chromosome with FALLBACK_BEST, or the median
+        of each channel of the neighborhood with FALLBACK_MEDIAN
+        """
+        if self.fallback_strategy == FALLBACK_MEDIAN:
+            return numpy.median(neighborhood, axis=0).round().astype(neighborhood.dtype)
+        return best_chromosome
+
+    def batched_evolve(self, pixels_y, pixels_x, seed_chromosomes=None, seeds_valid=None):
+        """
+        Evolves the given noisy pixels with the BatchedGAEngine, in
+        batches of BATCH_MAX_PIXELS pixels, to bound the memory. The
+        neighborhoods are taken from the image before any pixel is
+        repaired, nothing is written to the image.
+
+        The populations of a batch must have the same size and window,
+        so in the adaptive mode each batch is split in groups of pixels
+        with the same window and initial population size, evolved one
+        after the other.
+
+        :param seed_chromosomes: see pixels_repair
+        :param seeds_valid: see pixels_repair
+        :return: the fittest chromosome of each pixel, in the given order
+        :rtype: numpy array of shape (pixels, channels)
+        """
+        engines = dict() # Initial population size -> BatchedGAEngine
+
+        fittest_chromosomes = numpy.empty((len(pixels_y), self.image_obj.channels_num_get()),
+                                          dtype=self.image_obj.get_np_image_format().dtype)
+        for start in range(0, len(pixels_y), BATCH_MAX_PIXELS):
+            batch_indexes = numpy.arange(start, min(start + BATCH_MAX_PIXELS, len(pixels_y)))
+            radii = self.pixel_radii_get(pixels_y[batch_indexes], pixels_x[batch_indexes])
+
+            for radius in numpy.unique(radii):
+                radius_indexes = batch_indexes[radii == radius]
+                neighborhoods, neighborhoods_valid = self.image_obj.neighborhoods_get(
+                    pixels_y[radius_indexes], pixels_x[radius_indexes], int(radius))
+
+                low_variance = numpy.zeros(len(radius_indexes), dtype=bool)
+                if self.adaptive:
+                    low_variance = self.low_variance_get(neighborhoods, neighborhoods_valid)
+
+                for population_size, group in ((self.min_population_size, low_variance),
+                                               (self.population_size, ~low_variance)):
+                    if not group.any():
+                        continue
+                    if population_size not in engines:
+                        engines[population_size] = self.batched_engine_create(population_size)
+
+                    group_indexes = radius_indexes[group]
+                    fittest_chromosomes[group_indexes] = engines[population_size].evolve(
+                        neighborhoods[group], neighborhoods_valid[group],
+                        seed_chromosomes[group_indexes] if seed_chromosomes is not None else None,
+                        seeds_valid[group_indexes] if seeds_valid is not None else None)
+
+        for engine in engines.values():
+            self.capped_pixels["generations"] += engine.capped_pixels["generations"]
+            self.capped_pixels["time_budget"] += engine.capped_pixels["time_budget"]
+
+        return fittest_chromosomes
+
+    def batched_engine_create(self, population_size):
+        """
+        :return: a BatchedGAEngine with the settings of the GA, whose
+        populations start with population_size individuals (and grow in
+        the adaptive mode, see GROWTH_GENERATION), or a DirectSolver
+        with the DIRECT_ENGINE
+        :rtype: BatchedGAEngine
+        """
+        if self.engine == DIRECT_ENGINE:
+            return DirectSolver(self.min_deviation_coefficient, self.max_deviation_coefficient,
+                                self.max_pixel_value, self.fallback_strategy, self.metrics)
+        return BatchedGAEngine(population_size=population_size,
+                               min_deviation_coefficient=self.min_deviation_coefficient,
+                               max_deviation_coefficient=self.max_deviation_coefficient,
+                               max_pixel_value=self.max_pixel_value,
+                               rng=self.random_source,
+                               max_generations=self.max_generations,
+                               deadline=self.deadline,
+                               fallback_strategy=self.fallback_strategy,
+                               metrics=self.metrics,
+                               split=self.generation_split,
+                               max_population_size=self.max_population_size if self.adaptive else None,
+                               growth_generation=GROWTH_GENERATION)
+
+    def batched_ga_apply(self, done_chromosomes=None):
+        """
+        This function applies the GA over all the noisy pixels at once,
+        with the BatchedGAEngine (see batched_evolve). The neighborhoods
+        are taken from the image before any pixel is repaired.
+
+        With a Checkpointer, the pixels are evolved batch by batch (the
+        same batches of batched_evolve), and a checkpoint is written
+        after a batch when it is due, and after the last one.
+
+        :param done_chromosomes: the chromosomes of the first noisy
+        pixels, from a checkpoint, None to evolve all of them
+        :return: the fittest chromosome of each noisy pixel, in the
+        same order as numpy.nonzero(self.noise_mask) (row by row).
+        :rtype: numpy array of shape (noisy pixels, channels)
+        """
+        noisy_pixels_y, noisy_pixels_x = numpy.nonzero(self.noise_mask)
+        if self.checkpointer is None:
+            return self.batched_evolve(noisy_pixels_y, noisy_pixels_x)
+
+        noisy_pixels_num = len(noisy_pixels_y)
+        fittest_chromosomes = numpy.empty((noisy_pixels_num, self.image_obj.channels_num_get()),
+                                          dtype=self.image_obj.get_np_image_format().dtype)
+        done = 0
+        if done_chromosomes is not None:
+            done = len(done_chromosomes)
+            fittest_chromosomes[:done] = done_chromosomes
+
+        checkpoint_done = done # Pixels saved by the last checkpoint
+        for start in range(done, noisy_pixels_num, BATCH_MAX_PIXELS):
+            stop = min(start + BATCH_MAX_PIXELS, noisy_pixels_num)
+            fittest_chromosomes[start:stop] = self.batched_evolve(noisy_pixels_y[start:stop], noisy_pixels_x[start:stop])
+
+            if stop == noisy_pixels_num or self.checkpointer.due_check():
+                self.checkpoint_write(stop, 0, fittest_chromosomes[checkpoint_done:stop])
+                checkpoint_done = stop
+
+        return fittest_chromosomes
+
+    def chromosomes_store(self, pixels_y, pixels_x, chromosomes):
+        """
+        Replaces the given pixels with their chromosomes.
+
+        :param chromosomes: numpy array (pixels, channels)
+        :return: True for each pixel that changed
+        :rtype: numpy array
+        """
+        image = self.image_obj.get_np_image_format()
+        old_pixels = image[pixels_y, pixels_x]
+        changed = numpy.any(old_pixels.reshape(chromosomes.shape) != chromosomes, axis=1)
+        self.image_obj.pixels_set(pixels_y, pixels_x, chromosomes.reshape(old_pixels.shape))
+        return changed
+
+    def checkpoint_fingerprint_get(self):
+        """
+        :return: what identifies a run in its checkpoints: the shape and
+        type of the image, the detection, the engine and the settings
+        of the GA
+        :rtype: dict
+        """
+        image = self.image_obj.get_np_image_format()
+        return {
+            "shape": list(image.shape),
+            "dtype": str(image.dtype),
+            "engine": self.engine,
+            "noise_mask": noise_mask_fingerprint_get(self.noise_mask),
+            "profile": self.profile_get()
+        }
+
+    def checkpoint_write(self, noisy_pixels_done, rows_done, chromosomes):
+        """
+        Queues a checkpoint of the first pass, see Checkpointer.
+
+        :param noisy_pixels_done: noisy pixels done so far, in the order
+        of numpy.nonzero(self.noise_mask)
+        :param rows_done: rows finished by the PIXEL_ENGINE, 0 for the
+        BATCH_ENGINES (their rows are stored after all the pixels evolve)
+        :param chromosomes: the chromosomes of the noisy pixels done
+        since the previous checkpoint
+        """
+        self.checkpointer.write({
+            "fingerprint": self.checkpoint_fingerprint,
+            "noisy_pixels_done": int(noisy_pixels_done),
+            "rows_done": int(rows_done),
+            "list_of_rows": [int(frames_num) for frames_num in self.list_of_rows],
+            "capped_pixels": dict(self.capped_pixels),
+            "random_state": self.random_source.state_get()
+        }, chromosomes)
+
+    def pixels_repair(self, pixels_y, pixels_x, seed_chromosomes=None, seeds_valid=None):
+        """
+        Applies the GA over the given noisy pixels, in the given order,
+        with the selected engine. No frames are recorded.
+
+        :param pixels_y: numpy array with the y positions of the pixels
+        :param pixels_x: numpy array with the x positions of the pixels
+        :param seed_chromosomes: numpy array (pixels, channels) with an
+        extra individual for the initial population of each pixel (a
+        warm start), None for no seeds
+        :param seeds_valid: boolean numpy array (pixels), False for the
+        pixels without seed. All the seeds are valid if None.
+        :return: the y and x positions of the pixels that changed
+        :rtype: tuple of 2 numpy arrays
+        """
+        if seed_chromosomes is not None and seeds_valid is None:
+            seeds_valid = numpy.ones(len(pixels_y), dtype=bool)
+        if self.metrics is not None and seed_chromosomes is not None:
+            self.metrics.count("pixels_warm_started", int(seeds_valid.sum()))
+
+        if self.engine in BATCH_ENGINES:
+            fittest_chromosomes = self.batched_evolve(pixels_y, pixels_x, seed_chromosomes, seeds_valid)
+            changed = self.chromosomes_store(pixels_y, pixels_x, fittest_chromosomes)
+            return pixels_y[changed], pixels_x[changed]
+
+        changed = numpy.zeros(len(pixels_y), dtype=bool)
+        for index, (j, i) in enumerate(zip(pixels_y, pixels_x)):
+            neighborhood = self.pixel_neighborhood_get(j, i)
+            seed_chromosome = seed_chromosomes[index] if seed_chromosomes is not None and seeds_valid[index] else None
+            fittest_chromosome = self.fittest_chromosome_search(neighborhood, seed_chromosome)
+            changed[index] = numpy.any(self.image_obj.pixel_get(j, i) != fittest_chromosome)
+            self.image_obj.new_pixel_set(j, i, fittest_chromosome)
+        return pixels_y[changed], pixels_x[changed]
+
     def start_ga_over_image(self):
         """
         This function iterates over the entire image, looking for noisy
         pixels and applying the GA over those.
 
+        The noisy pixels are detected at once for the whole image by
+        noise_mask_calculate (unless a mask was already given with
+        noise_mask_set), so the loop only visits the flagged pixels.
+
+        With the PIXEL_ENGINE, the GA runs pixel by pixel, and each
+        pixel sees the pixels repaired before it. With the BATCHED_ENGINE
+        all the noisy pixels are evolved together first, and then stored
+        in the same order, and so are the ones of the DIRECT_ENGINE.
+
+        The pixels that reach max_generations or the time_budget are
+        counted in capped_pixels, to be able to tune those limits.
+
+        With max_passes > 1, after each pass only the pixels whose
+        neighborhood contains a pixel changed by that pass are detected
+        again (see noise_mask_update), and the ones still noisy are
+        repaired in a new pass. It stops once a pass changes nothing,
+        or after max_passes passes, so the cost of the later passes
+        depends on the number of changes and not on the image size.
+        The frames are only recorded during the first pass.
+
+        If a FrameRecorder was set, the frames are streamed to it and
+        resulting_images stays empty; list_of_rows then stores the
+        number of frames the recorder captured at the end of each row.
+
+        If a MetricsCollector was set, it has the metrics of the run
+        once this function returns (see MetricsCollector.as_dict).
+
+        If a Checkpointer was set, the first pass writes checkpoints
+        (after a row with the PIXEL_ENGINE, after a batch of pixels with
+        the BATCH_ENGINES, and at its end), and a run that finds a
+        checkpoint of the same image resumes from it: the repaired
+        pixels, list_of_rows, the capped pixels and the state of the
+        RandomSource are restored, so the output is the same as the one
+        of an uninterrupted run. The later passes are repeated from the
+        end of the first one. The time budget starts again, and the
+        frames recorded before the checkpoint are not restored.
         """
-        # Getting the np formated image:
-        image_to_process = self.image_obj.get_np_image_format()
         image_shape = self.image_obj.shape_get()
         image_height = image_shape[0]
         image_width = image_shape[1]
-        image_channels = image_shape[2]
+        image_channels = self.image_obj.channels_num_get()
         
-        print("------------------------------")
-        print("Starting the Genetic Algorithm")
-
-
-        image = 0
-        # Accessing all pixels of the image:
-        for j in range(image_height):
-            for i in range(image_width):
+        if self.verbose:
+            print("------------------------------")
+            print("Starting the Genetic Algorithm")
 
-                #if one_image >= image_width:
-                #    return 0
+        if self.metrics is not None:
+            run_start_time = time.perf_counter()
 
-                # Get the neighborhood of a given a pixel
-                neighborhood = self.image_obj.neighborhood_get(j, i)
 
-                # Check if the current pixel is noisy
-                if (self.is_pixel_noisy(self.image_obj.pixel_get(j,i), neighborhood) == True):
+        # The time budget is for the whole image:
+        self.capped_pixels = {"generations": 0, "time_budget": 0}
+        self.list_of_rows = list()
+        self.deadline = time.monotonic() + self.time_budget if self.time_budget is not None else None
+
+        # Detecting all the noisy pixels before starting to repair them:
+        if self.noise_mask is None:
+            self.noise_mask_calculate()
+
+        if self.metrics is not None:
+            self.metrics.count("pixels_flagged", int(numpy.count_nonzero(self.noise_mask)))
+
+        # Resuming from the last checkpoint of the first pass, if any:
+        resumed_chromosomes = None
+        rows_done = 0
+        if self.checkpointer is not None:
+            noisy_pixels_y, noisy_pixels_x = numpy.nonzero(self.noise_mask)
+            self.checkpoint_fingerprint = self.checkpoint_fingerprint_get()
+            checkpoint = self.checkpointer.load(self.checkpoint_fingerprint)
+            if checkpoint is not None:
+                manifest, resumed_chromosomes = checkpoint
+                rows_done = manifest["rows_done"]
+                self.list_of_rows = manifest["list_of_rows"]
+                self.capped_pixels = manifest["capped_pixels"]
+                self.random_source.state_set(manifest["random_state"])
+                if self.verbose:
+                    print("Resuming from the checkpoint, noisy pixels done:", len(resumed_chromosomes))
+
+        if self.engine in BATCH_ENGINES:
+            batched_chromosomes = self.batched_ga_apply(resumed_chromosomes)
+        noisy_pixel_index = 0
+
+        # Pixels changed by the pass, to know which ones to check again:
+        changed_y = list()
+        changed_x = list()
+
+        if self.engine not in BATCH_ENGINES and resumed_chromosomes is not None:
+            # The rows done before the checkpoint get their pixels back:
+            noisy_pixel_index = len(resumed_chromosomes)
+            done_y = noisy_pixels_y[:noisy_pixel_index]
+            done_x = noisy_pixels_x[:noisy_pixel_index]
+            changed = self.chromosomes_store(done_y, done_x, resumed_chromosomes)
+            changed_y.extend(done_y[changed])
+            changed_x.extend(done_x[changed])
+        checkpoint_index = noisy_pixel_index # Noisy pixels saved by the last checkpoint
+
+        image = self.list_of_rows[-1] if rows_done > 0 else 0
+        # Accessing only the noisy pixels of the image:
+        for j in range(rows_done, image_height):
+            for i in numpy.flatnonzero(self.noise_mask[j]):
+
+                if self.engine in BATCH_ENGINES:
+                    fittest_chromosome = batched_chromosomes[noisy_pixel_index]
+                else:
+                    # Get the neighborhood of a given a pixel
+                    neighborhood = self.pixel_neighborhood_get(j, i)
+                    fittest_chromosome = self.fittest_chromosome_search(neighborhood)
+                noisy_pixel_index += 1
+
+                if numpy.any(self.image_obj.pixel_get(j, i) != fittest_chromosome):
+                    changed_y.append(j)
+                    changed_x.append(i)
+
+                # Replace the noisy pixel with the fittest one:
+                self.image_obj.new_pixel_set(j, i, fittest_chromosome)
+
+                if self.metrics is not None:
+                    start_time = time.perf_counter()
+
+                if self.frame_recorder is not None:
+                    # The recorder decides if this is a frame to capture:
+                    self.frame_recorder.pixel_repaired(self.image_obj.get_np_image_format(), j)
+                    image = self.frame_recorder.frames_count_get()
+
+                elif self.keep_resulting_images:
+                    # Adding the image in numpy format to see the final result as an animated
+                    # gif:
+                    self.resulting_images.append(self.image_obj.get_np_image_format().copy())
                     
-                    # Create an initial population, that consists on
-                    # the neighborhood and some mutant pixels that will be added
-                    # if the neighborhood is not 25 total:
-                    self.create_population(neighborhood)
-
-
-                    # Calculate the fitness of this population, we could already
-                    # found the fittest pixel:
-                    self.population_fitness_calculate()
-
-                    # Sort the population based on the fitness score:
-                    sorted_population = sorted(self.population_get(), key=lambda pixel:pixel.fitness)
-
-                    # Setting the sorted population:
-                    self.population_set(sorted_population)
-
-                    # Start generations of the GA:
-
-                    # Flag that is rised when a fittest pixel is found:
-                    fittest_pixel_found = False
-
-                    # Counter for generations:
-                    generation = 1
+                    # Incrementing a counter that will tell in further stages, which is the last
+                    # image for each row, that will be required to draw a green line indicating
+                    # where the algorithm already passed
+                    image += 1
 
+                if self.metrics is not None:
+                    self.metrics.time_add("frame_capture", time.perf_counter() - start_time)
 
-                    while not fittest_pixel_found:
+            if self.frame_recorder is not None:
+                self.frame_recorder.row_finished(self.image_obj.get_np_image_format(), j)
+                image = self.frame_recorder.frames_count_get()
 
-                        # Getting the first individual fitness, to see if it is
-                        # on the required range of Z:
-                        first_ind_fitness = self.population_get()[0].fitness
-
-                        if MIN_DEVIATION_COEFFICIENT <= first_ind_fitness <= MAX_DEVIATION_COEFFICIENT:
-
-                            # If we found the fittest pixel, then replace the noisy pixel
-                            # with the fittest one:
-                            self.image_obj.new_pixel_set(j, i, self.population_get()[0].get_chromosome())  
-
-                            fittest_pixel_found = True
-
-
-                            # Adding the image in numpy format to see the final result as an animated
-                            # gif:
-                            self.resulting_images.append(self.image_obj.get_np_image_format().copy())
-                            
-                            # Incrementing a counter that will tell in further stages, which is the last
-                            # image for each row, that will be required to draw a green line indicating
-                            # where the algorithm already passed
-                            image += 1
-
-                            # Break the loop for the current pixel, so we can continue with the
-                            # following:
-                            break
-                        
-                        # If the fittest pixel is not found yet, lets continue with the GA,
-                        # creating a new generation:
-
-                        # Bypass the first 20% of the last population to the new population
-                        new_population = self.population_get()[0:int(POPULATION_SIZE*0.20)]
-
-                        # Perform some crossover operation over the first 50% of the
-                        # individuals of the last generation, to complete the 70%
-                        # of the next generation:
-                        for pixel_count in range(int(POPULATION_SIZE*0.75)):
-                            pixel_parent_1 = random.choice(self.population_get()[0:int(POPULATION_SIZE*0.50)])
-                            pixel_parent_2 = random.choice(self.population_get()[0:int(POPULATION_SIZE*0.50)])
-
-                            # Crossover parent 1 with parent 2:
-                            child_pixel = self.crossover_operation(pixel_parent_1, pixel_parent_2)
-                            new_population.append(child_pixel)
-
-                        # Complete the last 10% of the next generation by introducing some
-                        # mutant pixels:
-                        for pixel_count in range(int(POPULATION_SIZE*0.05)):
-                            # Get random R G B values and converting this as the new
-                            # mutant pixel:
-                            mutant_chromosome = random.sample(VALID_VALS_IN_CHANNELS, PIXEL_CHANNELS_NUM)
-                            mutant_pixel = Pixel()
-                            mutant_pixel.set_chromosome(tuple(mutant_chromosome))
-                            new_population.append(mutant_pixel)
-
-                        # Now we have the Full next generation to work with:
-                        self.population_set(new_population)
-                        
-                        # Calculate the fitness of each pixel of the recently created population:
-                        self.population_fitness_calculate()
-
-                        # Sort the population again based on the fitness
-                        sorted_new_population = sorted(new_population, key=lambda pixel:pixel.fitness)
-                        
-                        # Finally, set the sorted population to be bypassed to the next generation:
-                        self.population_set(sorted_new_population)
-
-                        generation += 1
             # Once the row has been completed, store the index of the last
             # image of the last row:
             self.list_of_rows.append(image)     
-        print("Finished the Genetic Algorithm")
-        print("------------------------------")
-        
 
+            if self.checkpointer is not None and self.engine not in BATCH_ENGINES and \
+                    (j == image_height - 1 or self.checkpointer.due_check()):
+                # The pixels repaired since the last checkpoint hold
+                # their chromosomes:
+                repaired_y = noisy_pixels_y[checkpoint_index:noisy_pixel_index]
+                repaired_x = noisy_pixels_x[checkpoint_index:noisy_pixel_index]
+                self.checkpoint_write(noisy_pixel_index, j + 1, self.image_obj.get_np_image_format()[
+                    repaired_y, repaired_x].reshape((len(repaired_y), image_channels)))
+                checkpoint_index = noisy_pixel_index
+
+        if self.checkpointer is not None:
+            self.checkpointer.close()
+
+        self.passes_num = 1
+        changed_y = numpy.array(changed_y, dtype=numpy.intp)
+        changed_x = numpy.array(changed_x, dtype=numpy.intp)
+
+        while self.passes_num < self.max_passes and len(changed_y) > 0:
+            # Only the neighbors of the changed pixels can have changed
+            # their detection:
+            dirty_y, dirty_x = self.dirty_pixels_get(changed_y, changed_x)
+            noisy = self.noise_mask_update(dirty_y, dirty_x)
+
+            if self.verbose:
+                print("Pass", self.passes_num + 1, "- pixels checked:", len(dirty_y), " noisy:", int(noisy.sum()))
+            if self.metrics is not None:
+                self.metrics.count("pixels_flagged", int(noisy.sum()))
+
+            changed_y, changed_x = self.pixels_repair(dirty_y[noisy], dirty_x[noisy])
+            self.passes_num += 1
+
+        if self.metrics is not None:
+            self.metrics.count("passes", self.passes_num)
+
+        if self.frame_recorder is not None:
+            self.frame_recorder.close(self.image_obj.get_np_image_format(), image_height - 1)
+
+        if self.metrics is not None:
+            self.metrics.count("pixels_not_converged", self.capped_pixels["generations"] + self.capped_pixels["time_budget"])
+            self.metrics.time_add("start_ga_over_image", time.perf_counter() - run_start_time)
+
+        if self.verbose:
+            print("Pixels capped by max generations: ", self.capped_pixels["generations"])
+            print("Pixels capped by the time budget: ", self.capped_pixels["time_budget"])
+            print("Finished the Genetic Algorithm")
+            print("------------------------------")
+        
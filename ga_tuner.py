@@ -0,0 +1,234 @@
+import argparse
+import json
+import time
+
+import numpy
+
+from image_wrapper import ImageWrapper
+from ga_image_applier import GAImageApplier, BATCHED_ENGINE, ENGINES, PROFILE_KEYS
+from noise_corpus import noisy_image_create, NOISE_TYPES, SALT_PEPPER_NOISE
+from random_source import RandomSource
+from quality_metrics import psnr_calculate
+
+"""
+The sample is tuned on a crop of its center of TUNE_CROP_SIZE x
+TUNE_CROP_SIZE pixels: the settings are compared with each other, not
+timed for the whole image, and the crop keeps each evaluation short.
+"""
+TUNE_CROP_SIZE = 128
+
+"""
+The settings searched, one at a time (see GATuner.tune). The splits are
+the elite, crossover and mutant ratios of each generation, the first one
+is the 20/75/5 split of population.GENERATION_SPLIT.
+"""
+POPULATION_SIZES = [10, 15, 25, 35, 50]
+NEIGHBORHOOD_RADII = [1, 2, 3]
+GENERATION_SPLITS = [(0.2, 0.75, 0.05), (0.1, 0.8, 0.1), (0.3, 0.6, 0.1), (0.2, 0.7, 0.1), (0.1, 0.85, 0.05)]
+ADAPTIVE_MODES = [False, True]
+
+# Passes over all the settings, at most, while one of them improves:
+MAX_TUNE_ROUNDS = 3
+
+# The starting point of the search, the defaults of the GAImageApplier:
+DEFAULT_PROFILE = GAImageApplier().profile_get()
+
+def profile_save(profile, path):
+    with open(path, "w") as profile_file:
+        json.dump(profile, profile_file, indent=2)
+
+def profile_load(path):
+    """
+    :return: a profile written by profile_save, with only the
+    PROFILE_KEYS (for GAImageApplier.profile_apply)
+    :rtype: dict
+    """
+    with open(path) as profile_file:
+        profile = json.load(profile_file)
+    return {key: profile[key] for key in PROFILE_KEYS if key in profile}
+
+def center_crop_get(image, crop_size=TUNE_CROP_SIZE):
+    image_height, image_width = image.shape[:2]
+    top = max((image_height - crop_size)//2, 0)
+    left = max((image_width - crop_size)//2, 0)
+    return numpy.array(image[top:top + crop_size, left:left + crop_size])
+
+class GATuner:
+    """
+    This class searches the settings of the GA (population size, radius
+    of the window, split of the generations and adaptive mode) for a
+    sample image, with a target:
+
+    - A time target (seconds for the sample): the profile with the best
+    PSNR among the ones that take at most that time.
+    - A quality target (PSNR in dB): the fastest profile among the ones
+    that reach it.
+
+    When no profile meets the target, the closest one wins (the fastest
+    one for a time target, the best PSNR for a quality target).
+
+    The search is a coordinate descent: starting from the defaults, each
+    setting is tried with all its values while the others are kept, the
+    best value is kept, and the passes are repeated until no setting
+    improves (or MAX_TUNE_ROUNDS passes). Each profile is evaluated once,
+    with the same seed, so the profiles only differ in their settings.
+
+    :param clean: numpy array of the clean sample
+    :param noisy: numpy array of the noisy sample, with the shape of clean
+    :param engine: one of ENGINES
+    :param seed: seed of every evaluation
+    """
+    def __init__(self, clean, noisy, engine=BATCHED_ENGINE, seed=0):
+        self.clean = clean
+        self.noisy = noisy
+        self.engine = engine
+        self.seed = seed
+        self.time_target = None # Seconds for the sample
+        self.quality_target = None # PSNR in dB
+        self.evaluations = dict() # Profile (as a sorted tuple) -> evaluation
+        self.verbose = True
+
+    # -- Setters & getters --
+    def time_target_set(self, time_target):
+        self.time_target = time_target
+    def quality_target_set(self, quality_target):
+        self.quality_target = quality_target
+    def verbose_set(self, verbose):
+        self.verbose = verbose
+    def evaluations_get(self):
+        return list(self.evaluations.values())
+    # -- End of Setters & getters --
+
+    def evaluate(self, profile):
+        """
+        Denoises the noisy sample with the profile, or takes the result
+        of a previous evaluation of the same profile.
+
+        :return: dict with the profile, the seconds and the PSNR
+        :rtype: dict
+        """
+        key = tuple(sorted(profile.items()))
+        if key in self.evaluations:
+            return self.evaluations[key]
+
+        image = ImageWrapper("")
+        image.np_image_format_set(self.noisy.copy())
+
+        ga_applier = GAImageApplier()
+        ga_applier.profile_apply(profile)
+        ga_applier.image_obj_set(image)
+        ga_applier.engine_set(self.engine)
+        ga_applier.random_source_set(RandomSource(self.seed))
+        ga_applier.keep_resulting_images_set(False)
+        ga_applier.verbose_set(False)
+
+        start_time = time.perf_counter()
+        ga_applier.noise_mask_calculate()
+        ga_applier.start_ga_over_image()
+        seconds = time.perf_counter() - start_time
+
+        evaluation = {
+            "profile": dict(profile),
+            "seconds": seconds,
+            "psnr": psnr_calculate(image.get_np_image_format(), self.clean)
+        }
+        self.evaluations[key] = evaluation
+        if self.verbose:
+            print("{:8.3f} s  {:7.3f} dB  {}".format(seconds, evaluation["psnr"], json.dumps(profile)))
+        return evaluation
+
+    def score_get(self, evaluation):
+        """
+        :return: the score of an evaluation for the target, higher is
+        better. The evaluations that meet the target always score higher
+        than the ones that do not.
+        :rtype: tuple
+        """
+        if self.time_target is not None:
+            if evaluation["seconds"] <= self.time_target:
+                return (1, evaluation["psnr"])
+            return (0, -evaluation["seconds"])
+        if evaluation["psnr"] >= self.quality_target:
+            return (1, -evaluation["seconds"])
+        return (0, evaluation["psnr"])
+
+    def candidates_get(self, profile):
+        """
+        :return: the profiles with one setting of profile changed, for
+        each setting, as lists of profiles
+        :rtype: list
+        """
+        return [
+            [dict(profile, population_size=size) for size in POPULATION_SIZES],
+            [dict(profile, neighborhood_radius=radius) for radius in NEIGHBORHOOD_RADII],
+            [dict(profile, elite_ratio=elite_ratio, crossover_ratio=crossover_ratio, mutant_ratio=mutant_ratio)
+             for elite_ratio, crossover_ratio, mutant_ratio in GENERATION_SPLITS],
+            [dict(profile, adaptive=adaptive) for adaptive in ADAPTIVE_MODES]
+        ]
+
+    def tune(self):
+        """
+        Searches the profile for the target, see the class.
+
+        :return: the best profile, with its seconds, PSNR and target
+        :rtype: dict
+        """
+        if (self.time_target is None) == (self.quality_target is None):
+            raise ValueError("Set either a time target or a quality target")
+
+        best = self.evaluate(dict(DEFAULT_PROFILE))
+        for _ in range(MAX_TUNE_ROUNDS):
+            improved = False
+            for setting_profiles in self.candidates_get(best["profile"]):
+                for profile in setting_profiles:
+                    evaluation = self.evaluate(profile)
+                    if self.score_get(evaluation) > self.score_get(best):
+                        best = evaluation
+                        improved = True
+            if not improved:
+                break
+
+        result = dict(best["profile"])
+        result.update({
+            "engine": self.engine,
+            "seconds": best["seconds"],
+            "psnr": best["psnr"],
+            "time_target": self.time_target,
+            "quality_target": self.quality_target,
+            "target_met": self.score_get(best)[0] == 1,
+            "sample_shape": list(self.noisy.shape),
+            "evaluations": len(self.evaluations)
+        })
+        return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the settings of the GA for a time or quality target")
+    parser.add_argument("clean", help="clean sample image")
+    parser.add_argument("--noisy", default=None, help="noisy version of the sample, added with --noise if missing")
+    parser.add_argument("--noise", choices=NOISE_TYPES, default=SALT_PEPPER_NOISE)
+    parser.add_argument("--strength", type=float, default=None, help="strength of the added noise")
+    parser.add_argument("--crop-size", type=int, default=TUNE_CROP_SIZE)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--time-target", type=float, help="seconds of the crop")
+    target.add_argument("--quality-target", type=float, help="PSNR in dB")
+    parser.add_argument("--engine", choices=ENGINES, default=BATCHED_ENGINE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="profile.json", help="where the profile is written")
+    args = parser.parse_args()
+
+    clean_image = ImageWrapper(args.clean)
+    clean_image.image_opener()
+    clean = center_crop_get(clean_image.get_np_image_format(), args.crop_size)
+    if args.noisy is not None:
+        noisy_image = ImageWrapper(args.noisy)
+        noisy_image.image_opener()
+        noisy = center_crop_get(noisy_image.get_np_image_format(), args.crop_size)
+    else:
+        noisy = noisy_image_create(clean, args.noise, args.strength, seed=args.seed)
+
+    tuner = GATuner(clean, noisy, args.engine, args.seed)
+    tuner.time_target_set(args.time_target)
+    tuner.quality_target_set(args.quality_target)
+    profile = tuner.tune()
+    profile_save(profile, args.output)
+    print("Profile written to", args.output, json.dumps(profile))
@@ -1,13 +1,63 @@
+import os
+import tempfile
+import time
+
 from PIL import Image, ImageDraw, ImageFont
 import numpy
 
+from band_io import image_to_memmap, image_band_save, pil_image_normalize, pil_image_has_alpha, pil_array_get,\
+    png_wide_color_check, png_band_read_check, png_read, image_8_bits_get, ALPHA_MODES
+
 NEIGHBORHOOD_START_POSITION_SUBSTRACTOR = 2
 NEIGHBORHOOD_HEIGHT_WIDTH = 5
 
+# Kernels of the deterministic denoiser:
+MEAN_KERNEL = "mean"
+MEDIAN_KERNEL = "median"
+ADAPTIVE_MEDIAN_KERNEL = "adaptive_median"
+
+DETERMINISTIC_WINDOW_SIZE = 3
+ADAPTIVE_MEDIAN_MAX_WINDOW_SIZE = 7
+
+# Default parameters of the noise injectors:
+NOISE_DENSITY = 0.10 # Fraction of the pixels hit by salt & pepper or chroma noise
+PERIODIC_NOISE_AMPLITUDE = 20
+PERIODIC_NOISE_FREQUENCY = 10
+GAUSSIAN_NOISE_MEAN = 0
+GAUSSIAN_NOISE_STD_DEV = 50
+
+# The median kernels sort the windows of this many rows at once, to
+# bound the memory used:
+MEDIAN_BAND_HEIGHT = 128
+
 R_INDEX = 0
 G_INDEX = 1
 B_INDEX = 2
 
+def neighborhood_moments_get(nbh_sum, nbh_sum_sq, count):
+    """
+    Calculates the mean and the standard deviation of neighborhoods from
+    the integer sums of their values and of their squared values. The
+    variance is calculated exactly with integers, as
+    (n*sum_sq - sum^2)/n^2, so a flat neighborhood gets a standard
+    deviation of exactly 0. Both are float32, the same for the whole
+    image (ImageWrapper.neighborhood_statistics_get) and for some pixels
+    (GAImageApplier.noise_mask_update).
+
+    :param nbh_sum: integer numpy array (..., channels), of a type that
+    holds n*sum_sq (see ImageWrapper.accumulator_dtype_get)
+    :param nbh_sum_sq: integer numpy array (..., channels), same type
+    :param count: number of neighbors, broadcastable to nbh_sum
+    :return: the mean and the standard deviation
+    :rtype: tuple of 2 float32 numpy arrays
+    """
+    count = numpy.asarray(count)
+    numerator = count.astype(nbh_sum.dtype)*nbh_sum_sq - nbh_sum*nbh_sum
+    count = count.astype(numpy.float32)
+    nbh_mean = nbh_sum.astype(numpy.float32)/count
+    nbh_std = numpy.sqrt(numerator.astype(numpy.float32))/count
+    return nbh_mean, nbh_std
+
 class ImageWrapper:
     """
     This Image Wrapper covers some operations over an Image,
@@ -15,6 +65,11 @@ class ImageWrapper:
     a pixel, convert the PIL image to Numpy array,
     insert salt and peper noise to an Image if required.
 
+    The image can be grayscale (height, width) or have any number of
+    channels (height, width, channels), with 8 or 16 bits per channel.
+    An alpha channel is not part of the image to process: it is kept
+    apart in alpha, untouched, and added back by save.
+
     :param image_path: the string to the path of the image to
     work with
     """
@@ -29,21 +84,50 @@ class ImageWrapper:
         self.shape = None # (shape tuple: height, width, channels)
         self.pil_image_format = None
         self.np_image_format = None
-        self.neighborhood_start_position_substractor = 2
-        self.neighborhood_height_width = 5
+        self.neighborhood_start_position_substractor = NEIGHBORHOOD_START_POSITION_SUBSTRACTOR
+        self.neighborhood_height_width = NEIGHBORHOOD_HEIGHT_WIDTH
         self.result_image_name = str()
+        self.metrics = None # MetricsCollector, None to not collect metrics
+        self.scratch_path = None # .npy file backing the image, see image_memmap_opener
+        self.padded_image = None # Copy of the image with a border around it, see windows_get
+        self.padded_source = None # The np_image_format padded_image is a copy of
+        self.padded_valid = None # Which positions of padded_image are in the image
+        self.padding = 0 # Width of the border of padded_image
+        self.windows_views = dict() # (start, size) of a window -> its windows and valid mask, see windows_get
+        self.alpha = None # Alpha channel, apart from the image, None if the image has no alpha
+        self.memmap_image = None # Whole memmap of image_memmap_opener, alpha included
 
     # -- Setters & getters --
     def get_np_image_format(self): 
         return self.np_image_format
+    def np_image_format_set(self, np_image_format):
+        self.np_image_format = np_image_format
+        self.shape = np_image_format.shape
     def shape_get(self):
         return self.shape
+    def channels_num_get(self):
+        return self.shape[2] if len(self.shape) == 3 else 1
+    def alpha_get(self):
+        return self.alpha
+    def alpha_set(self, alpha):
+        self.alpha = alpha
     def new_pixel_set(self, pixel_y, pixel_x, rgb_value):
-        self.np_image_format[pixel_y][pixel_x] = rgb_value
+        self.pixels_set(pixel_y, pixel_x, numpy.reshape(rgb_value, self.shape[2:]))
     def pixel_get(self, pixel_y, pixel_x):
         return self.np_image_format[pixel_y][pixel_x]
     def set_result_image_name(self, name):
         self.result_image_name = name
+    def metrics_set(self, metrics):
+        self.metrics = metrics
+    def neighborhood_radius_set(self, radius):
+        """
+        Sets the neighborhood to the (2*radius + 1) x (2*radius + 1)
+        window centered on the pixel, for the detection and the GA.
+        """
+        self.neighborhood_start_position_substractor = radius
+        self.neighborhood_height_width = 2*radius + 1
+    def neighborhood_radius_get(self):
+        return self.neighborhood_start_position_substractor
     # -- End of Setters & getters --
 
     def image_opener(self):
@@ -51,90 +135,203 @@ class ImageWrapper:
         Loading the image in RAM and extract some details, like
         the format, shape, and convert the PIL image to Numpy
         array.
+
+        The image keeps 8 or 16 bits per channel. Palette and other
+        modes are converted to grayscale or RGB (see
+        band_io.pil_image_normalize), and the alpha channel is moved
+        to alpha. PIL reduces the 16 bits color PNG images to 8 bits, so
+        they are read by band_io.png_read.
         """
 
         # Opening the image from the given path
         self.pil_image_format = Image.open(self.image_path)
+        self.format = self.pil_image_format.format
 
         # Converting the image to numpy format
-        self.np_image_format = numpy.array(self.pil_image_format)
+        if png_wide_color_check(self.image_path):
+            self.np_image_with_alpha_set(png_read(self.image_path), pil_image_has_alpha(self.pil_image_format))
+        else:
+            self.pil_image_load(self.pil_image_format)
 
-        self.format = self.pil_image_format.format
-        
         self.shape = self.np_image_format.shape
 
-    
-    def introduce_salt_peper_noise(self):
+    def pil_image_load(self, pil_image):
         """
-        If the image has no noise, then introduce it
+        Takes the image from a PIL image, as image_opener does (for
+        images that do not come from a file, e.g. the denoising service).
+
+        :param pil_image: PIL image, in any mode
         """
+        pil_image = pil_image_normalize(pil_image)
+        self.np_image_with_alpha_set(pil_array_get(pil_image), pil_image.mode in ALPHA_MODES)
 
-        # Introduce 10% of noise:
-        noise_pixels_num = int(self.shape[0] * self.shape[1] * 0.10)
+    def np_image_with_alpha_set(self, image, has_alpha):
+        """
+        Sets the image, moving its last channel to alpha if it has one.
 
-        for noise_pixel in range(noise_pixels_num):
-            new_noise_pixel_x = random.randint(0, self.shape[1] - 1)
-            new_noise_pixel_y = random.randint(0, self.shape[0] - 1)
+        :param image: numpy array (height, width) or (height, width, channels)
+        :param has_alpha: True if the last channel is alpha
+        """
+        if has_alpha:
+            self.alpha = image[:, :, -1].copy()
+            image = numpy.ascontiguousarray(image[:, :, 0] if image.shape[2] == 2 else image[:, :, :-1])
+        else:
+            self.alpha = None
+        self.np_image_format_set(image)
+
+    def np_image_with_alpha_get(self):
+        """
+        :return: the image with its alpha channel added back, if it has one
+        :rtype: numpy array
+        """
+        if self.alpha is None:
+            return self.np_image_format
+        return numpy.dstack((self.np_image_format, self.alpha))
 
-            new_pixel_color = random.randint(0, 1)
+    def image_memmap_opener(self, scratch_path=None):
+        """
+        Opens the image as image_opener does, but the numpy array is a
+        memmap of a .npy scratch file instead of living in RAM, for
+        images larger than the memory (see band_io.image_to_memmap).
+        save() then writes it band by band.
 
-            self.np_image_format[new_noise_pixel_y][new_noise_pixel_x] = numpy.array([new_pixel_color*255, new_pixel_color*255, new_pixel_color*255])
+        :param scratch_path: the .npy file backing the image, a temporary
+        file if None. scratch_remove deletes it.
+        """
+        if scratch_path is None:
+            scratch_file, scratch_path = tempfile.mkstemp(suffix=".npy")
+            os.close(scratch_file)
+        self.scratch_path = scratch_path
+
+        self.memmap_image = image_to_memmap(self.image_path, scratch_path)
+        self.np_image_format = self.memmap_image
+
+        has_alpha = False
+        if png_band_read_check(self.image_path):
+            # Read without PIL, the grayscale and RGB images with alpha
+            # have 2 and 4 channels:
+            self.format = "PNG"
+            has_alpha = self.memmap_image.ndim == 3 and self.memmap_image.shape[2] in (2, 4)
+        elif not self.image_path.lower().endswith(".npy"):
+            with Image.open(self.image_path) as pil_image:
+                self.format = pil_image.format
+                has_alpha = pil_image_has_alpha(pil_image)
+
+        # The image and the alpha are views of the same memmap, so the
+        # alpha is written back untouched:
+        if has_alpha:
+            self.alpha = self.memmap_image[:, :, -1]
+            if self.memmap_image.shape[2] == 2:
+                self.np_image_format = self.memmap_image[:, :, 0]
+            else:
+                self.np_image_format = self.memmap_image[:, :, :-1]
 
-    def introduce_chroma_noise(self):
+        self.shape = self.np_image_format.shape
 
-        # Introduce 10% of noise:
-        noise_pixels_num = int(self.shape[0] * self.shape[1] * 0.10)
+    def scratch_remove(self):
+        """
+        Deletes the scratch file created by image_memmap_opener. The
+        image can not be used after this.
+        """
+        if self.scratch_path is not None:
+            self.np_image_format = None
+            self.alpha = None
+            self.memmap_image = None
+            os.remove(self.scratch_path)
+            self.scratch_path = None
+
+    def max_channel_value_get(self):
+        """
+        :return: the largest value a channel can have, based on the
+        type of the image (255 for 8 bits images)
+        :rtype: int
+        """
+        return numpy.iinfo(self.np_image_format.dtype).max
 
-        for noise_pixel in range(noise_pixels_num):
-            new_noise_pixel_x = random.randint(0, self.shape[1] - 1)
-            new_noise_pixel_y = random.randint(0, self.shape[0] - 1)
+    def noisy_pixels_choose(self, density, rng):
+        """
+        Chooses int(height * width * density) different pixels of the image.
 
-            noisy_pixel = random.sample(VALID_VALS_IN_CHANNELS, PIXEL_CHANNELS_NUM)
+        :return: the y and x positions of the chosen pixels
+        :rtype: tuple of 2 numpy arrays
+        """
+        pixels_num = self.shape[0] * self.shape[1]
+        noise_pixels_num = int(pixels_num * density)
 
-            self.np_image_format[new_noise_pixel_y][new_noise_pixel_x] = numpy.array(noisy_pixel)
+        noise_pixels = rng.choice(pixels_num, size=noise_pixels_num, replace=False)
+        return numpy.unravel_index(noise_pixels, self.shape[:2])
 
+    def introduce_salt_peper_noise(self, density=NOISE_DENSITY, seed=None):
+        """
+        If the image has no noise, then introduce it. Each noisy pixel
+        is black or white, in all its channels.
 
-    def introduce_periodic_noise(self):
-        # Introduce 10% of noise:
-        image_height = self.shape[0]
-        image_width = self.shape[1]
+        :param density: fraction of the pixels to turn into noise
+        :param seed: seed or numpy Generator, to get the same noise again
+        """
+        rng = numpy.random.default_rng(seed)
 
-        # Accessing all pixels of the image:
-        for j in range(image_height):
-            for i in range(image_width):
-                current_pixel = self.pixel_get(j, i)
-                noise_to_introduce = int(20*numpy.sin(10*j))
+        noise_pixels_y, noise_pixels_x = self.noisy_pixels_choose(density, rng)
+        new_pixel_color = rng.integers(0, 2, len(noise_pixels_y)) * self.max_channel_value_get()
 
-                if current_pixel[0] + noise_to_introduce > 255:
-                   current_pixel[0] = 255
-                else:
-                    current_pixel[0] = current_pixel[0] + noise_to_introduce
+        self.np_image_format[noise_pixels_y, noise_pixels_x] = new_pixel_color.reshape(
+            (-1,) + (1,) * (self.np_image_format.ndim - 2))
 
-                if current_pixel[1] + noise_to_introduce > 255:
-                   current_pixel[1] = 255
-                else:
-                    current_pixel[1] = current_pixel[1] + noise_to_introduce
+    def introduce_chroma_noise(self, density=NOISE_DENSITY, seed=None):
+        """
+        Replaces some pixels with a random color.
 
-                if current_pixel[2] + noise_to_introduce > 255:
-                   current_pixel[2] = 255
-                else:
-                    current_pixel[2] = current_pixel[2] + noise_to_introduce
+        :param density: fraction of the pixels to turn into noise
+        :param seed: seed or numpy Generator, to get the same noise again
+        """
+        rng = numpy.random.default_rng(seed)
 
-    def introduce_gaussian_noise(self):
+        noise_pixels_y, noise_pixels_x = self.noisy_pixels_choose(density, rng)
+        noisy_pixels = rng.integers(0, self.max_channel_value_get(),
+                                    (len(noise_pixels_y),) + self.shape[2:], endpoint=True)
+
+        self.np_image_format[noise_pixels_y, noise_pixels_x] = noisy_pixels
+
+    def introduce_periodic_noise(self, amplitude=PERIODIC_NOISE_AMPLITUDE, frequency=PERIODIC_NOISE_FREQUENCY):
         """
-        mean is set to 127.5, the midpoint of the 0-255 range, to center the distribution.
-        std_dev is set to 50, a value that ensures most values will fall within the 0-255 range, but you can adjust it as needed.
-        np.clip ensures that no values are less than 0 or greater than 255.
-        .astype(np.uint8) converts the array to unsigned 8-bit integers, a common format for image data.
+        Adds int(amplitude * sin(frequency * row)) to every channel of
+        every pixel of each row. The result saturates at 0 and at the
+        max channel value, instead of wrapping around.
+
+        :param amplitude: amplitude of the sine wave
+        :param frequency: frequency of the sine wave, in radians per row
         """
-        mean = 0
-        std_dev = 50
-        gaussian = numpy.random.normal(mean, std_dev, (self.shape[0], self.shape[1], self.shape[2]))
-        clipped_values = numpy.clip(gaussian, 0, 255)
-        uint8_values = clipped_values.astype(numpy.uint8)
-        self.np_image_format = self.np_image_format + uint8_values
+        noise_to_introduce = (amplitude * numpy.sin(frequency * numpy.arange(self.shape[0]))).astype(numpy.int64)
+        noise_to_introduce = noise_to_introduce.reshape((-1,) + (1,) * (self.np_image_format.ndim - 1))
+
+        self.noise_add(noise_to_introduce)
 
-    def neighborhood_get(self, pixel_y, pixel_x):
+    def introduce_gaussian_noise(self, mean=GAUSSIAN_NOISE_MEAN, std_dev=GAUSSIAN_NOISE_STD_DEV, seed=None):
+        """
+        Adds noise from a normal distribution to every channel of every
+        pixel. The result saturates at 0 and at the max channel value,
+        instead of wrapping around.
+
+        :param mean: mean of the noise
+        :param std_dev: standard deviation of the noise
+        :param seed: seed or numpy Generator, to get the same noise again
+        """
+        rng = numpy.random.default_rng(seed)
+
+        gaussian = rng.normal(mean, std_dev, self.shape)
+        self.noise_add(numpy.round(gaussian))
+
+    def noise_add(self, noise):
+        """
+        Adds the noise to the image, clipping the result to the valid
+        range of the channels.
+
+        :param noise: numpy array that can be broadcasted to the image shape
+        """
+        noisy_image = numpy.clip(self.np_image_format + noise, 0, self.max_channel_value_get())
+        self.np_image_format = noisy_image.astype(self.np_image_format.dtype)
+
+    def neighborhood_get(self, pixel_y, pixel_x, radius=None):
         """
         The neighborhood of the pixel is a matrix represented
         as follows:
@@ -149,51 +346,386 @@ class ImageWrapper:
         The 0 represents a neighbor of that pixel
 
         This function will take care of the edge pixels, and
-        get the proper neighborhood.
+        get the proper neighborhood: the neighbors out of the
+        image are not part of it.
 
         :param pixel_y: y position of the pixel being processed
         :param pixel_x: x position of the pixel being processed
+        :param radius: radius of the window (see window_get), the one of
+        the neighborhood if None
 
-        :return: a list corresponding to the pixel's neighborhood
-        :rtype: list
+        :return: a copy of the pixel's neighborhood, one neighbor per
+        row, in raster order, with shape (neighbors, channels) (1
+        channel for a grayscale image)
+        :rtype: numpy array
         """
         
+        if self.metrics is not None:
+            start_time = time.perf_counter()
+
+        # The clipped window, flattened into a list of neighbors. The
+        # copy keeps the neighborhood independent of the pixels that
+        # are repaired later:
+        neighborhood_view = self.neighborhood_view_get(pixel_y, pixel_x, radius)
+        neighborhood = numpy.array(neighborhood_view).reshape((-1, self.channels_num_get()))
+
+        if self.metrics is not None:
+            self.metrics.time_add("neighborhood_get", time.perf_counter() - start_time)
+
+        return neighborhood
+
+    def neighborhood_view_get(self, pixel_y, pixel_x, radius=None):
+        """
+        Gets the neighborhood of the pixel as a view of the image,
+        without copying any pixel. Since the window is clipped against
+        the image borders, it is a rectangle of the image: the
+        neighborhood of an edge pixel is a smaller rectangle.
+
+        :param pixel_y: y position of the pixel being processed
+        :param pixel_x: x position of the pixel being processed
+        :param radius: see neighborhood_get
+
+        :return: the window, with shape (rows, columns) or (rows,
+        columns, channels)
+        :rtype: numpy array view
+        """
+        start_position_substractor, height_width = self.window_get(radius)
+
         # Calculating the start positions of the pixel neighborhood
-        temp_start_x_pos = pixel_x - self.neighborhood_start_position_substractor
-        temp_start_y_pos = pixel_y - self.neighborhood_start_position_substractor
+        temp_start_x_pos = pixel_x - start_position_substractor
+        temp_start_y_pos = pixel_y - start_position_substractor
 
         # If the process is accesing edge pixels, the start positions
         # might be negative, so those pixels are out of range (in python
-        # there is the posibility to access negative indexes, but here
-        # is something we want to avoid)
-        start_x_pos = temp_start_x_pos if temp_start_x_pos >= 0 else 0 
-        start_y_pos = temp_start_y_pos if temp_start_y_pos >= 0 else 0
-
-        # Calculating the end positions of the neighborhood. We are not
-        # taking into consideration if the ending indexes are out of the
-        # of the range, because there is a try/except catching if the
-        # process is in that scenary
-        finish_x_pos = temp_start_x_pos + self.neighborhood_height_width
-        finish_y_pos = temp_start_y_pos + self.neighborhood_height_width
-
-        neighborhood_list = list()
-
-        for j in range(start_y_pos, finish_y_pos):
-            for i in range(start_x_pos, finish_x_pos):
-                
-                # Catch the case where the routine is accesing pixels
-                # out of the range
-                try:
-                    neighborhood_list.append(self.np_image_format[j][i])
-                except IndexError:
-                    # If out of index, then continue with the next position
-                    continue
-                
-        return numpy.array(neighborhood_list)
+        # negative indexes would read from the other side of the image,
+        # which is something we want to avoid). The end positions beyond
+        # the image are clipped by the slice itself.
+        start_x_pos = max(temp_start_x_pos, 0)
+        start_y_pos = max(temp_start_y_pos, 0)
+
+        finish_x_pos = max(temp_start_x_pos + height_width, 0)
+        finish_y_pos = max(temp_start_y_pos + height_width, 0)
+
+        return self.np_image_format[start_y_pos:finish_y_pos, start_x_pos:finish_x_pos]
+
+    def window_get(self, radius=None):
+        """
+        :param radius: radius of a window centered on the pixel, None for
+        the window of the neighborhood
+        :return: the positions of the window before the pixel (in each
+        axis), and the size of the window
+        :rtype: tuple of 2 ints
+        """
+        if radius is None:
+            return self.neighborhood_start_position_substractor, self.neighborhood_height_width
+        return radius, 2*radius + 1
+
+    def windows_get(self, radius=None):
+        """
+        Gets the neighborhood window of every pixel of the image at
+        once, as a zero-copy view.
+
+        The first time, the image is copied into a padded buffer, with a
+        border as wide as the window reaches out of the image. The
+        windows are a sliding window view of the buffer, so getting a
+        window never copies. np_image_format stays the array it was, and
+        new_pixel_set and pixels_set write both, so the windows always
+        show the current pixels (after any other write, windows_reset
+        drops the buffer). The buffer is built again if np_image_format
+        is replaced by a new array, or if a window reaches further than
+        its border. A memmap image is never copied into RAM this way:
+        neighborhoods_get gathers its neighborhoods from the memmap
+        itself (see neighborhoods_gather).
+
+        Windows of several radii are views of the same buffer, so a GA
+        can use a larger window for some pixels (see
+        GAImageApplier.adaptive_set) without copying the image again.
+
+        The positions of the border hold zeros, the valid mask tells
+        which positions of each window are in the image. The valid
+        positions of a window are exactly the neighbors neighborhood_get
+        gives, in the same raster order.
+
+        :param radius: see window_get
+        :return: the windows, with shape (height, width, window height,
+        window width) + channels, and the valid mask, with shape
+        (height, width, window height, window width)
+        :rtype: tuple of 2 numpy array views
+        """
+        if isinstance(self.np_image_format, numpy.memmap):
+            raise ValueError("A memmap image is not copied into a padded buffer, see neighborhoods_gather")
+        window = self.window_get(radius)
+        reach = max(window[0], window[1] - 1 - window[0])
+        if self.padded_image is None or self.padded_source is not self.np_image_format or reach > self.padding:
+            self.windows_layout_set(max(reach, self.padding))
+        if window not in self.windows_views:
+            self.windows_views[window] = self.windows_views_create(*window)
+        return self.windows_views[window]
+
+    def windows_layout_set(self, padding):
+        """
+        Builds the padded buffer of windows_get, a copy of the image.
+
+        :param padding: width of the border around the image
+        """
+        image_height, image_width = self.shape[:2]
+
+        self.padded_image = numpy.zeros((image_height + 2*padding, image_width + 2*padding) + self.shape[2:],
+                                        dtype=self.np_image_format.dtype)
+        inside = (slice(padding, padding + image_height), slice(padding, padding + image_width))
+        self.padded_image[inside] = self.np_image_format
+        self.padded_source = self.np_image_format
+
+        self.padded_valid = numpy.zeros(self.padded_image.shape[:2], dtype=bool)
+        self.padded_valid[inside] = True
+        self.padding = padding
+        self.windows_views = dict()
+
+    def windows_reset(self):
+        """
+        Drops the padded buffer of windows_get, so it is built again
+        from the image. Needed after the image is written other than
+        through new_pixel_set or pixels_set.
+        """
+        self.padded_image = None
+        self.padded_source = None
+        self.padded_valid = None
+        self.padding = 0
+        self.windows_views = dict()
+
+    def pixels_set(self, pixels_y, pixels_x, values):
+        """
+        Writes many pixels at once, in the image and in the padded
+        buffer of windows_get, so the windows show them.
+
+        :param pixels_y: numpy array with the y positions of the pixels
+        :param pixels_x: numpy array with the x positions of the pixels
+        :param values: the values of the pixels, with the shape of
+        np_image_format[pixels_y, pixels_x]
+        """
+        self.np_image_format[pixels_y, pixels_x] = values
+        if self.padded_image is not None and self.padded_source is self.np_image_format:
+            self.padded_image[pixels_y + self.padding, pixels_x + self.padding] = values
+
+    def windows_views_create(self, start_position_substractor, height_width):
+        """
+        :return: the windows of every pixel and their valid masks, as
+        windows_get returns them, views of the padded buffer
+        :rtype: tuple of 2 numpy array views
+        """
+        image_height, image_width = self.shape[:2]
+        after = height_width - 1 - start_position_substractor
+        window_area = (slice(self.padding - start_position_substractor, self.padding + image_height + after),
+                       slice(self.padding - start_position_substractor, self.padding + image_width + after))
+
+        # sliding_window_view puts the window axes last, after the
+        # channels, so they are moved before them:
+        windows = numpy.lib.stride_tricks.sliding_window_view(self.padded_image[window_area],
+                                                              (height_width, height_width), axis=(0, 1))
+        windows_valid = numpy.lib.stride_tricks.sliding_window_view(self.padded_valid[window_area],
+                                                                    (height_width, height_width))
+        return numpy.moveaxis(windows, (-2, -1), (2, 3)), windows_valid
+
+    def neighborhoods_get(self, pixels_y, pixels_x, radius=None):
+        """
+        Gets the neighborhood of many pixels at once. Since the edge
+        pixels have smaller neighborhoods, all of them are returned
+        with the full size of the window, together with a mask telling
+        which neighbors are inside the image. The neighbors of a pixel
+        are in the same order neighborhood_get would give them.
+
+        :param pixels_y: numpy array with the y positions of the pixels
+        :param pixels_x: numpy array with the x positions of the pixels
+        :param radius: see window_get
+
+        :return: the neighborhoods with shape (pixels, window size, channels)
+        and the valid neighbors mask with shape (pixels, window size)
+        :rtype: tuple of 2 numpy arrays
+        """
+        if self.metrics is not None:
+            start_time = time.perf_counter()
+
+        if isinstance(self.np_image_format, numpy.memmap):
+            neighborhoods, neighbors_valid = self.neighborhoods_gather(pixels_y, pixels_x, radius)
+        else:
+            windows, windows_valid = self.windows_get(radius)
+            window_area = windows_valid.shape[2]*windows_valid.shape[3]
+            channels_num = self.channels_num_get()
+
+            # Gathering the windows of the pixels is the only copy. The
+            # positions out of the image are zeros, marked as not valid:
+            neighborhoods = windows[pixels_y, pixels_x].reshape((len(pixels_y), window_area, channels_num))
+            neighbors_valid = windows_valid[pixels_y, pixels_x].reshape((len(pixels_y), window_area))
+
+        if self.metrics is not None:
+            self.metrics.time_add("neighborhood_get", time.perf_counter() - start_time, len(neighborhoods))
+
+        return neighborhoods, neighbors_valid
+
+    def neighborhoods_gather(self, pixels_y, pixels_x, radius=None):
+        """
+        Gets the neighborhoods as neighborhoods_get does, but reading
+        them from np_image_format itself instead of the windows of
+        windows_get, for the memmap images: the positions out of the
+        image are clipped to its border, read, and then set to zero and
+        marked as not valid.
+
+        :return: see neighborhoods_get
+        :rtype: tuple of 2 numpy arrays
+        """
+        start_position_substractor, height_width = self.window_get(radius)
+        image_height, image_width = self.shape[:2]
+        offsets = numpy.arange(height_width) - start_position_substractor
+
+        neighbors_y = numpy.asarray(pixels_y)[:, numpy.newaxis, numpy.newaxis] + offsets[:, numpy.newaxis]
+        neighbors_x = numpy.asarray(pixels_x)[:, numpy.newaxis, numpy.newaxis] + offsets
+        neighbors_valid = ((neighbors_y >= 0) & (neighbors_y < image_height)) &\
+            ((neighbors_x >= 0) & (neighbors_x < image_width))
+
+        neighborhoods = self.np_image_format[numpy.clip(neighbors_y, 0, image_height - 1),
+                                             numpy.clip(neighbors_x, 0, image_width - 1)]
+        neighborhoods = neighborhoods.reshape((len(pixels_y), height_width*height_width, self.channels_num_get()))
+        neighbors_valid = neighbors_valid.reshape((len(pixels_y), height_width*height_width))
+        neighborhoods[~neighbors_valid] = 0
+        return numpy.asarray(neighborhoods), neighbors_valid
+
+    def neighborhood_bounds_get(self, start_position_substractor=None, height_width=None):
+        """
+        Calculates, for every row and every column of the image, where
+        the neighborhood window starts and where it finishes. The
+        windows are clipped against the image borders exactly the same
+        way neighborhood_get does it, so an edge pixel has a smaller
+        neighborhood instead of a padded one.
+
+        :param start_position_substractor: distance from the pixel to the
+        start of the window, the one of the neighborhood if None
+        :param height_width: size of the window, the one of the
+        neighborhood if None
+        :return: the start and finish positions of the window for each
+        row (y) and each column (x)
+        :rtype: tuple of 4 numpy arrays (start_y, finish_y, start_x, finish_x)
+        """
+        if start_position_substractor is None:
+            start_position_substractor = self.neighborhood_start_position_substractor
+        if height_width is None:
+            height_width = self.neighborhood_height_width
+
+        image_height = self.shape[0]
+        image_width = self.shape[1]
+
+        temp_start_y_pos = numpy.arange(image_height) - start_position_substractor
+        temp_start_x_pos = numpy.arange(image_width) - start_position_substractor
+
+        start_y_pos = numpy.clip(temp_start_y_pos, 0, image_height)
+        start_x_pos = numpy.clip(temp_start_x_pos, 0, image_width)
+        finish_y_pos = numpy.clip(temp_start_y_pos + height_width, 0, image_height)
+        finish_x_pos = numpy.clip(temp_start_x_pos + height_width, 0, image_width)
+
+        return start_y_pos, finish_y_pos, start_x_pos, finish_x_pos
+
+    def accumulator_dtype_get(self):
+        """
+        The window sums of window_sums_get are differences of running
+        sums. Integer running sums may wrap around, but their differences
+        are still exact as long as the window sums themselves fit in the
+        type, so the type only depends on the window and the bit depth,
+        not on the image size.
+
+        :return: numpy.int32 if n*sum_sq (see neighborhood_moments_get)
+        over a neighborhood fits in it, numpy.int64 otherwise (e.g. for 16
+        bits images)
+        :rtype: numpy dtype
+        """
+        window_area = self.neighborhood_height_width*self.neighborhood_height_width
+        max_value = int(self.max_channel_value_get())
+        if window_area*window_area*max_value*max_value <= numpy.iinfo(numpy.int32).max:
+            return numpy.int32
+        return numpy.int64
+
+    def window_sums_get(self, values, start_position_substractor=None, height_width=None, dtype=None):
+        """
+        Sums the values inside the window of every pixel, with the
+        windows clipped as in neighborhood_bounds_get.
+
+        The sum is separable: the values are accumulated along the
+        rows, the window sum of each column is the difference of 2
+        accumulated values, and the same is done along the columns.
+        Together both steps are a summed-area table (integral image).
+
+        :param values: numpy array (height, width, ...) to be summed
+        :param dtype: type of the sums, the type of values if None (see
+        accumulator_dtype_get)
+        :return: the window sums, same shape as values
+        :rtype: numpy array
+        """
+        start_y_pos, finish_y_pos, start_x_pos, finish_x_pos = self.neighborhood_bounds_get(
+            start_position_substractor, height_width)
+        if dtype is None:
+            dtype = values.dtype
+
+        # An extra row (column) of zeros, so a window that starts at
+        # position 0 does not need special care:
+        accumulated = numpy.zeros((values.shape[0] + 1,) + values.shape[1:], dtype=dtype)
+        numpy.cumsum(values, axis=0, dtype=dtype, out=accumulated[1:])
+        column_sums = accumulated[finish_y_pos] - accumulated[start_y_pos]
+
+        accumulated = numpy.zeros((column_sums.shape[0], column_sums.shape[1] + 1) + column_sums.shape[2:], dtype=dtype)
+        numpy.cumsum(column_sums, axis=1, out=accumulated[:, 1:])
+        return accumulated[:, finish_x_pos] - accumulated[:, start_x_pos]
+
+    def window_counts_get(self, start_position_substractor=None, height_width=None):
+        """
+        :return: the number of pixels inside the window of every pixel,
+        with shape (height, width)
+        :rtype: numpy array
+        """
+        start_y_pos, finish_y_pos, start_x_pos, finish_x_pos = self.neighborhood_bounds_get(
+            start_position_substractor, height_width)
+        return numpy.outer(finish_y_pos - start_y_pos, finish_x_pos - start_x_pos)
+
+    def neighborhood_statistics_get(self):
+        """
+        Calculates the mean and the standard deviation of the
+        neighborhood of every pixel of the image at once, per channel.
+
+        Instead of extracting each neighborhood, two summed-area tables
+        (integral images) are built with window_sums_get: one of the
+        values and one of the squared values. The sum over any window is
+        then obtained with 4 lookups:
+
+            sum = I[y1, x1] - I[y0, x1] - I[y1, x0] + I[y0, x0]
+
+        The tables are accumulated with the compact integers of
+        accumulator_dtype_get, and the planes are float32 (see
+        neighborhood_moments_get): a flat neighborhood gets a standard
+        deviation of exactly 0, the same as numpy.std over the
+        neighborhood list would give.
+
+        :return: mean and standard deviation planes with shape
+        (height, width, channels), and the number of neighbors of each
+        pixel with shape (height, width)
+        :rtype: tuple of 3 numpy arrays
+        """
+        image = self.np_image_format
+        if image.ndim == 2:
+            image = image[:, :, numpy.newaxis]
+        dtype = self.accumulator_dtype_get()
+
+        nbh_sum = self.window_sums_get(image, dtype=dtype)
+        image_sq = image.astype(dtype)
+        image_sq *= image_sq
+        nbh_sum_sq = self.window_sums_get(image_sq)
+        del image_sq
+        nbh_count = self.window_counts_get()
+
+        nbh_mean, nbh_std = neighborhood_moments_get(nbh_sum, nbh_sum_sq, nbh_count[:, :, numpy.newaxis])
+        return nbh_mean, nbh_std, nbh_count
 
     def create_gif_from_images(self, list_of_np_images, list_of_rows):
 
-        list_np_images_to_pil_form = [Image.fromarray(image) for image in list_of_np_images]
+        # The gif has 8 bits channels:
+        list_np_images_to_pil_form = [Image.fromarray(image_8_bits_get(image)).convert("RGB")
+                                      for image in list_of_np_images]
 
         len_of_np_images = len(list_np_images_to_pil_form)
 
@@ -221,29 +753,129 @@ class ImageWrapper:
                                            duration=15,
                                            loop=0)
 
-    def denoise_salt_pepper_deterministically(self):
-        image_height = self.shape[0]
-        image_width = self.shape[1]
+    def sorted_windows_get(self, source, top, bottom, window_size):
+        """
+        Gets the window of every pixel of the rows [top, bottom[ of the
+        source, with its values sorted per channel. The windows are
+        clipped as in neighborhood_get: the positions out of the image
+        are nan, and they are sorted after the valid values.
+
+        :param source: numpy array (height, width, channels)
+        :param window_size: odd size of the square window
+        :return: the sorted windows with shape (rows, width, channels,
+        window_size*window_size), and the number of valid values of
+        each window with shape (rows, width, channels)
+        :rtype: tuple of 2 numpy arrays
+        """
+        image_height, image_width, image_channels = source.shape
+        window_radius = window_size//2
+
+        # The rows of the band, with the halo the windows need, and nan
+        # out of the image:
+        band = numpy.full((bottom - top + 2*window_radius, image_width + 2*window_radius, image_channels),
+                          numpy.nan, dtype=numpy.float32)
+        source_top = max(top - window_radius, 0)
+        source_bottom = min(bottom + window_radius, image_height)
+        band[source_top - (top - window_radius):source_bottom - (top - window_radius),
+             window_radius:window_radius + image_width] = source[source_top:source_bottom]
+
+        windows = numpy.lib.stride_tricks.sliding_window_view(band, (window_size, window_size), axis=(0, 1))
+        windows = windows.reshape(windows.shape[:3] + (window_size*window_size,))
+        windows.sort(axis=3)
+
+        valid_num = window_size*window_size - numpy.isnan(windows).sum(axis=3)
+        return windows, valid_num
+
+    def denoise_salt_pepper_deterministically(self, kernel=MEAN_KERNEL,
+                                              window_size=DETERMINISTIC_WINDOW_SIZE,
+                                              max_window_size=ADAPTIVE_MEDIAN_MAX_WINDOW_SIZE):
+        """
+        Denoises the whole image with a deterministic filter, to compare
+        it against the GA. Every window is read from the original image,
+        and the result is written into a separate buffer, so a pixel is
+        never filtered with pixels that were already filtered. The
+        windows of the edge pixels are clipped, as in neighborhood_get.
+
+        Kernels:
+        - MEAN_KERNEL: mean of the window, with separable box sums.
+        - MEDIAN_KERNEL: median of the window.
+        - ADAPTIVE_MEDIAN_KERNEL: the window grows from window_size up to
+        max_window_size until its median is not an impulse (the min or
+        the max of the window). The pixel is kept if it is not an
+        impulse itself, else it is replaced by the median. Meant for
+        salt & pepper noise, as it leaves the clean pixels untouched.
+
+        :param kernel: MEAN_KERNEL, MEDIAN_KERNEL or ADAPTIVE_MEDIAN_KERNEL
+        :param window_size: odd size of the square window
+        :param max_window_size: largest window of the ADAPTIVE_MEDIAN_KERNEL
+        """
+        source = self.np_image_format
+        if source.ndim == 2:
+            source = source[:, :, numpy.newaxis]
+        image_height = source.shape[0]
+
+        if kernel == MEAN_KERNEL:
+            window_sums = self.window_sums_get(source, window_size//2, window_size, self.accumulator_dtype_get())
+            window_counts = self.window_counts_get(window_size//2, window_size)
+            result = window_sums.astype(numpy.float32)/window_counts[:, :, numpy.newaxis].astype(numpy.float32)
+        else:
+            result = numpy.empty(source.shape, dtype=numpy.float32)
+            for top in range(0, image_height, MEDIAN_BAND_HEIGHT):
+                bottom = min(top + MEDIAN_BAND_HEIGHT, image_height)
+                if kernel == MEDIAN_KERNEL:
+                    result[top:bottom] = self.band_median_get(source, top, bottom, window_size)
+                else:
+                    result[top:bottom] = self.band_adaptive_median_get(source, top, bottom, window_size, max_window_size)
+
+        result = numpy.round(result).astype(self.np_image_format.dtype)
+        self.np_image_format = result.reshape(self.np_image_format.shape)
+
+    def band_median_get(self, source, top, bottom, window_size):
+        """
+        :return: the median of the window of each pixel of the rows
+        [top, bottom[ of the source
+        :rtype: numpy array (rows, width, channels)
+        """
+        windows, valid_num = self.sorted_windows_get(source, top, bottom, window_size)
+        return self.sorted_windows_median_get(windows, valid_num)
+
+    def sorted_windows_median_get(self, windows, valid_num):
+        """
+        :return: the median of each sorted window, taking only its valid
+        values (the average of the 2 middle ones if their number is even)
+        :rtype: numpy array
+        """
+        lower = numpy.take_along_axis(windows, ((valid_num - 1)//2)[..., numpy.newaxis], axis=-1)[..., 0]
+        upper = numpy.take_along_axis(windows, (valid_num//2)[..., numpy.newaxis], axis=-1)[..., 0]
+        return (lower + upper)/2
 
-        self.neighborhood_height_width = 3
-        self.neighborhood_start_position_substractor = 1
+    def band_adaptive_median_get(self, source, top, bottom, window_size, max_window_size):
+        """
+        :return: the adaptive median of each pixel of the rows [top, bottom[
+        of the source (see denoise_salt_pepper_deterministically)
+        :rtype: numpy array (rows, width, channels)
+        """
+        pixels = source[top:bottom].astype(numpy.float32)
+        result = numpy.empty(pixels.shape, dtype=numpy.float32)
+        pending = numpy.ones(pixels.shape, dtype=bool)
 
-        # Accessing all pixels of the image:
-        for j in range(image_height):
-            for i in range(image_width):
-                neighborhood = self.neighborhood_get(j, i)
-                nbh_r_channel = neighborhood[:, R_INDEX]
-                nbh_g_channel = neighborhood[:, G_INDEX]
-                nbh_b_channel = neighborhood[:, B_INDEX]
+        for current_window_size in range(window_size, max_window_size + 1, 2):
+            windows, valid_num = self.sorted_windows_get(source, top, bottom, current_window_size)
+            window_min = windows[..., 0]
+            window_max = numpy.take_along_axis(windows, (valid_num - 1)[..., numpy.newaxis], axis=-1)[..., 0]
+            window_median = self.sorted_windows_median_get(windows, valid_num)
 
-                # Getting the average per channel
-                nbh_r_channel_mean = numpy.mean(nbh_r_channel)
-                nbh_g_channel_mean = numpy.mean(nbh_g_channel)
-                nbh_b_channel_mean = numpy.mean(nbh_b_channel)
+            # The median is not an impulse, so this window is big enough:
+            median_found = pending & (window_min < window_median) & (window_median < window_max)
+            is_impulse = (pixels <= window_min) | (pixels >= window_max)
+            result[median_found] = numpy.where(is_impulse, window_median, pixels)[median_found]
+            pending &= ~median_found
 
-                
-                self.new_pixel_set(j, i, numpy.array([nbh_r_channel_mean, nbh_g_channel_mean, nbh_b_channel_mean]))
+            # Once the largest window is reached, the median is used:
+            if current_window_size + 2 > max_window_size:
+                result[pending] = window_median[pending]
 
+        return result
 
     def show(self):
         # Convert image from Numpy to PIL image:
@@ -251,5 +883,20 @@ class ImageWrapper:
         self.pil_image_format.show()
 
     def save(self):
-        self.pil_image_format = Image.fromarray(self.np_image_format)
+        # A memmap is written band by band, instead of converting it to
+        # a single PIL image (the image and its alpha are views of it):
+        if isinstance(self.np_image_format, numpy.memmap):
+            image_band_save(self.memmap_image if self.memmap_image is not None else self.np_image_format,
+                            self.result_image_name)
+            return
+
+        image = self.np_image_with_alpha_get()
+
+        # PIL has no mode for 16 bits color images, the PNG is written by
+        # the band writer:
+        if image.ndim == 3 and image.dtype.itemsize > 1:
+            image_band_save(image, self.result_image_name)
+            return
+
+        self.pil_image_format = Image.fromarray(image)
         self.pil_image_format.save(self.result_image_name)
\ No newline at end of file
@@ -1,6 +1,9 @@
 from pixel import Pixel
 from ga_image_applier import GAImageApplier
 from image_wrapper import ImageWrapper
+from frame_recorder import FrameRecorder
+from noise_classifier import noise_classify
+from auto_denoiser import NOISE_STRATEGIES
 import time
 
 def denoise_image():
@@ -36,6 +39,12 @@ def denoise_image():
     # image to Numpy Array:
     image.image_opener()
 
+    # The noise found in the image, and the strategy the auto method of
+    # batch_denoise would repair it with:
+    classification = noise_classify(image)
+    print("Detected noise:", classification["noise_type"],
+          "- suggested strategy:", NOISE_STRATEGIES[classification["noise_type"]])
+
     image.set_result_image_name("./test.png")
 
     # Create the instance of the object in charged of
@@ -45,17 +54,16 @@ def denoise_image():
     # Passing the image that will be processed to the
     # Genetic Algorithm applier:
     ga_applier.image_obj_set(image)
+
+    # Streaming the progress to the gif while the GA runs, so the
+    # frames are not kept in RAM:
+    ga_applier.frame_recorder_set(FrameRecorder("./result.gif"))
     
     start_time = time.time()
     ga_applier.start_ga_over_image()
     end_time = time.time()
     print("The GA took: ", end_time - start_time)
 
-    list_of_resulting_images = ga_applier.resulting_images_get()
-    list_of_rows = ga_applier.list_of_rows_get()
-
-    image.create_gif_from_images(list_of_resulting_images, list_of_rows)
-
     image.save()
 
     image2 = ImageWrapper(TARGET_IMAGE_PATH)
@@ -66,4 +74,6 @@ def denoise_image():
     end_time = time.time()
     print("The math algorithm took: ", end_time - start_time)
     image2.save()
-denoise_image()
+
+if __name__ == "__main__":
+    denoise_image()
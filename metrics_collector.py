@@ -0,0 +1,58 @@
+import json
+
+class MetricsCollector:
+    """
+    This class collects metrics of a run of the GA: counters, time spent
+    in each stage, and histograms.
+
+    The GAImageApplier, the ImageWrapper and the BatchedGAEngine only
+    report to a collector if one was set (their metrics member is None
+    otherwise), so when the metrics are disabled the only overhead is a
+    None check in each instrumented place.
+    """
+    def __init__(self):
+        self.counters = dict() # Name -> count
+        self.timers = dict() # Name -> {"seconds": total seconds, "calls": calls}
+        self.histograms = dict() # Name -> {value: count}
+
+    def count(self, name, amount=1):
+        """
+        Adds the amount to the counter with the given name.
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def time_add(self, name, seconds, calls=1):
+        """
+        Adds the seconds spent in a stage, and the number of calls that
+        took that time.
+        """
+        timer = self.timers.setdefault(name, {"seconds": 0.0, "calls": 0})
+        timer["seconds"] += seconds
+        timer["calls"] += calls
+
+    def histogram_add(self, name, value, amount=1):
+        """
+        Adds the amount to the bin of the value, in the histogram with
+        the given name.
+        """
+        histogram = self.histograms.setdefault(name, dict())
+        histogram[value] = histogram.get(value, 0) + amount
+
+    def as_dict(self):
+        """
+        :return: all the metrics, with the histograms sorted by value
+        :rtype: dict
+        """
+        return {
+            "counters": dict(self.counters),
+            "timers": {name: dict(timer) for name, timer in self.timers.items()},
+            "histograms": {name: {str(value): histogram[value] for value in sorted(histogram)}
+                           for name, histogram in self.histograms.items()}
+        }
+
+    def as_json(self, indent=2):
+        """
+        :return: all the metrics as a JSON string
+        :rtype: str
+        """
+        return json.dumps(self.as_dict(), indent=indent)
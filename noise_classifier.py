@@ -0,0 +1,221 @@
+import argparse
+import json
+
+import numpy
+
+from image_wrapper import ImageWrapper
+from noise_corpus import SALT_PEPPER_NOISE, CHROMA_NOISE, GAUSSIAN_NOISE, PERIODIC_NOISE
+
+# Noise the classifier can not name, e.g. a clean image:
+UNKNOWN_NOISE = "unknown"
+
+"""
+Images larger than CLASSIFY_CROP_SIZE x CLASSIFY_CROP_SIZE are
+classified from a crop of their center: the noise is spread over the
+whole image, so the crop has the same statistics at a fraction of the
+cost.
+"""
+CLASSIFY_CROP_SIZE = 512
+
+"""
+An impulse is a pixel black or white in all its channels, that differs
+in more than IMPULSE_MIN_DEVIATION from the median of the pixels of its
+neighborhood that are not black or white. With less than
+IMPULSE_MIN_CLEAN_NEIGHBORS of those pixels the impulse is ambiguous:
+it can be noise or a saturated area of the image.
+"""
+IMPULSE_MIN_DEVIATION = 40
+IMPULSE_MIN_CLEAN_NEIGHBORS = 3
+
+"""
+An outlier is a pixel that differs in more than OUTLIER_MIN_DEVIATION
+from the median of its 3 x 3 window, in any channel.
+"""
+OUTLIER_WINDOW_SIZE = 3
+OUTLIER_MIN_DEVIATION = 60
+
+"""
+A periodic component shows as a peak of the spectrum: a frequency
+PERIODIC_PEAK_THRESHOLD times (in log scale) over the mean of the
+PERIODIC_PEAK_WINDOW x PERIODIC_PEAK_WINDOW frequencies around it. The
+frequencies under PERIODIC_MIN_FREQUENCY (in cycles per pixel) belong
+to the image itself and are never peaks.
+"""
+PERIODIC_PEAK_THRESHOLD = 2.5
+PERIODIC_PEAK_WINDOW = 7
+PERIODIC_MIN_FREQUENCY = 0.02
+
+# Minimum estimates to tell each type of noise:
+IMPULSE_MIN_DENSITY = 0.001
+OUTLIER_MIN_DENSITY = 0.001
+GAUSSIAN_MIN_SIGMA = 5.0
+
+"""
+The deviations and GAUSSIAN_MIN_SIGMA above are for 8 bits images, they
+are scaled to the bit depth of the image (x 257 for 16 bits images).
+"""
+REFERENCE_MAX_VALUE = 255
+
+def impulses_get(image_obj, min_deviation=None, min_clean_neighbors=IMPULSE_MIN_CLEAN_NEIGHBORS):
+    """
+    Finds the impulses (salt & pepper pixels) of the image. Only the
+    black and white pixels are gathered, with the neighborhoods of
+    ImageWrapper.neighborhoods_get, so the cost depends on their number.
+
+    :param image_obj: ImageWrapper with the image loaded
+    :param min_deviation: None for IMPULSE_MIN_DEVIATION, scaled to the
+    bit depth of the image
+    :return: the y and x positions of the impulses, the median of the
+    clean neighbors of each one, with shape (impulses, channels), and
+    True for the ambiguous ones (their median is not valid)
+    :rtype: tuple of 4 numpy arrays
+    """
+    image = image_obj.get_np_image_format()
+    if image.ndim == 2:
+        image = image[:, :, numpy.newaxis]
+    max_value = image_obj.max_channel_value_get()
+    if min_deviation is None:
+        min_deviation = IMPULSE_MIN_DEVIATION*max_value/REFERENCE_MAX_VALUE
+
+    candidates = numpy.all(image == 0, axis=2) | numpy.all(image == max_value, axis=2)
+    candidates_y, candidates_x = numpy.nonzero(candidates)
+
+    neighborhoods, neighbors_valid = image_obj.neighborhoods_get(candidates_y, candidates_x)
+    neighbors_extreme = numpy.all(neighborhoods == 0, axis=2) | numpy.all(neighborhoods == max_value, axis=2)
+    neighbors_clean = neighbors_valid & ~neighbors_extreme
+
+    # Sorting the clean neighbors first, as sorted_windows_median_get
+    # expects them:
+    windows = numpy.where(neighbors_clean[:, :, numpy.newaxis], neighborhoods, numpy.nan)
+    windows = numpy.sort(windows.transpose(0, 2, 1).astype(numpy.float32), axis=2)
+    clean_num = neighbors_clean.sum(axis=1)
+    medians = image_obj.sorted_windows_median_get(windows, numpy.repeat(clean_num[:, numpy.newaxis], image.shape[2], axis=1))
+
+    ambiguous = clean_num < min_clean_neighbors
+    with numpy.errstate(invalid="ignore"):
+        deviated = numpy.any(numpy.abs(image[candidates_y, candidates_x] - medians) > min_deviation, axis=1)
+    impulses = ambiguous | deviated
+
+    return candidates_y[impulses], candidates_x[impulses], medians[impulses], ambiguous[impulses]
+
+def median_residual_get(image, window_size=OUTLIER_WINDOW_SIZE):
+    """
+    :param image: numpy array (height, width, channels)
+    :return: the image minus the median of the window of each pixel
+    (the windows of the edge pixels repeat the edge)
+    :rtype: numpy array of floats, with the shape of the image
+    """
+    image_height, image_width = image.shape[:2]
+    reach = window_size//2
+    padded = numpy.pad(image, ((reach, reach), (reach, reach), (0, 0)), mode="edge")
+    windows = numpy.stack([padded[offset_y:offset_y + image_height, offset_x:offset_x + image_width]
+                           for offset_y in range(window_size) for offset_x in range(window_size)])
+    return image - numpy.median(windows, axis=0)
+
+def spectrum_peaks_get(gray, threshold=PERIODIC_PEAK_THRESHOLD, window_size=PERIODIC_PEAK_WINDOW,
+                       min_frequency=PERIODIC_MIN_FREQUENCY):
+    """
+    Finds the peaks of the spectrum of a single channel image, see
+    PERIODIC_PEAK_THRESHOLD.
+
+    :param gray: numpy array (height, width)
+    :return: True for each peak frequency, in the layout of
+    numpy.fft.fft2, and the height of the highest frequency (in log
+    scale) over the frequencies around it
+    :rtype: tuple (numpy array, float)
+    """
+    image_height, image_width = gray.shape
+    log_spectrum = numpy.log1p(numpy.abs(numpy.fft.fft2(gray - gray.mean())))
+
+    # The spectrum wraps around, and so do its windows:
+    reach = window_size//2
+    padded = numpy.pad(log_spectrum, reach, mode="wrap")
+    windows = numpy.lib.stride_tricks.sliding_window_view(padded, (window_size, window_size))
+    peak_heights = log_spectrum - windows.mean(axis=(2, 3))
+
+    frequencies_y = numpy.abs(numpy.fft.fftfreq(image_height))[:, numpy.newaxis]
+    frequencies_x = numpy.abs(numpy.fft.fftfreq(image_width))[numpy.newaxis, :]
+    peak_heights[numpy.maximum(frequencies_y, frequencies_x) < min_frequency] = 0
+
+    return peak_heights > threshold, float(peak_heights.max())
+
+def noise_classify(image_obj, crop_size=CLASSIFY_CROP_SIZE):
+    """
+    Estimates the type of noise of an image, and how much of it there
+    is, from statistics of the image, in the following order:
+
+    - PERIODIC_NOISE if the spectrum has peaks, see spectrum_peaks_get.
+    - GAUSSIAN_NOISE if the noise level (sigma, the median absolute
+    difference to the 3 x 3 median of the pixels that are not
+    impulses, scaled as the standard deviation of a normal
+    distribution) is at least GAUSSIAN_MIN_SIGMA. Most pixels are not
+    changed by the impulse and chroma noise, so they keep it low, while
+    the gaussian noise changes every pixel (and its clipped pixels can
+    look like impulses). A chroma noise so dense that it reaches
+    GAUSSIAN_MIN_SIGMA is taken as gaussian too.
+    - SALT_PEPPER_NOISE if there are impulses, see impulses_get.
+    - CHROMA_NOISE if there are outliers that are not impulses.
+    - UNKNOWN_NOISE otherwise.
+
+    :param image_obj: ImageWrapper with the image loaded, not modified
+    :return: dict with the noise_type, its density (fraction of pixels
+    with noise, 1 for the noise that hits every pixel), the sigma, the
+    number of periodic peaks and the highest peak
+    :rtype: dict
+    """
+    image = image_obj.get_np_image_format()
+    if image.ndim == 2:
+        image = image[:, :, numpy.newaxis]
+    image_height, image_width = image.shape[:2]
+
+    top = max((image_height - crop_size)//2, 0)
+    left = max((image_width - crop_size)//2, 0)
+    crop = numpy.array(image[top:top + crop_size, left:left + crop_size])
+    pixels_num = crop.shape[0]*crop.shape[1]
+
+    crop_obj = ImageWrapper("")
+    crop_obj.np_image_format_set(crop)
+    depth_scale = crop_obj.max_channel_value_get()/REFERENCE_MAX_VALUE
+    impulses_y, impulses_x, _, _ = impulses_get(crop_obj)
+    impulse_mask = numpy.zeros(crop.shape[:2], dtype=bool)
+    impulse_mask[impulses_y, impulses_x] = True
+
+    residual = numpy.abs(median_residual_get(crop.astype(numpy.float32)))
+    outlier_mask = numpy.any(residual > OUTLIER_MIN_DEVIATION*depth_scale, axis=2) & ~impulse_mask
+    sigma = 1.4826*float(numpy.median(residual[~impulse_mask]))
+
+    peaks, highest_peak = spectrum_peaks_get(crop.mean(axis=2))
+
+    classification = {
+        "impulse_density": len(impulses_y)/pixels_num,
+        "outlier_density": int(outlier_mask.sum())/pixels_num,
+        "sigma": sigma,
+        "periodic_peaks": int(peaks.sum()),
+        "highest_peak": highest_peak
+    }
+    if classification["periodic_peaks"] > 0:
+        classification["noise_type"] = PERIODIC_NOISE
+        classification["density"] = 1.0
+    elif sigma >= GAUSSIAN_MIN_SIGMA*depth_scale:
+        classification["noise_type"] = GAUSSIAN_NOISE
+        classification["density"] = 1.0
+    elif classification["impulse_density"] >= IMPULSE_MIN_DENSITY:
+        classification["noise_type"] = SALT_PEPPER_NOISE
+        classification["density"] = classification["impulse_density"]
+    elif classification["outlier_density"] >= OUTLIER_MIN_DENSITY:
+        classification["noise_type"] = CHROMA_NOISE
+        classification["density"] = classification["outlier_density"]
+    else:
+        classification["noise_type"] = UNKNOWN_NOISE
+        classification["density"] = 0.0
+    return classification
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate the type of noise of images")
+    parser.add_argument("images", nargs="+")
+    args = parser.parse_args()
+
+    for path in args.images:
+        image = ImageWrapper(path)
+        image.image_opener()
+        print(path, json.dumps(noise_classify(image)))
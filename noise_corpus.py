@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+
+from PIL import Image
+import numpy
+
+from image_wrapper import ImageWrapper
+
+# Types of noise the corpus can have:
+SALT_PEPPER_NOISE = "salt_pepper"
+CHROMA_NOISE = "chroma"
+GAUSSIAN_NOISE = "gaussian"
+PERIODIC_NOISE = "periodic"
+NOISE_TYPES = [SALT_PEPPER_NOISE, CHROMA_NOISE, GAUSSIAN_NOISE, PERIODIC_NOISE]
+
+CORPUS_SOURCE_IMAGE = "./images/lena.jpg"
+CORPUS_SIZES = [225, 512, 1024, 2048]
+CORPUS_MANIFEST_NAME = "manifest.json"
+
+def noisy_image_create(clean_image, noise_type, strength=None, seed=None):
+    """
+    Creates a noisy copy of a clean image.
+
+    :param clean_image: numpy array of the clean image, not modified
+    :param noise_type: one of NOISE_TYPES
+    :param strength: the density for salt & pepper and chroma noise, the
+    standard deviation for gaussian noise and the amplitude for periodic
+    noise. The default of the ImageWrapper if None.
+    :param seed: seed or numpy Generator
+    :return: the noisy image
+    :rtype: numpy array
+    """
+    image = ImageWrapper("")
+    image.np_image_format_set(clean_image.copy())
+
+    strength_kwargs = dict()
+    if noise_type == SALT_PEPPER_NOISE:
+        if strength is not None:
+            strength_kwargs["density"] = strength
+        image.introduce_salt_peper_noise(seed=seed, **strength_kwargs)
+    elif noise_type == CHROMA_NOISE:
+        if strength is not None:
+            strength_kwargs["density"] = strength
+        image.introduce_chroma_noise(seed=seed, **strength_kwargs)
+    elif noise_type == GAUSSIAN_NOISE:
+        if strength is not None:
+            strength_kwargs["std_dev"] = strength
+        image.introduce_gaussian_noise(seed=seed, **strength_kwargs)
+    elif noise_type == PERIODIC_NOISE:
+        if strength is not None:
+            strength_kwargs["amplitude"] = strength
+        image.introduce_periodic_noise(**strength_kwargs)
+    else:
+        raise ValueError("Unknown noise type: " + str(noise_type))
+
+    return image.get_np_image_format()
+
+def corpus_generate(output_dir, source_path=CORPUS_SOURCE_IMAGE, sizes=CORPUS_SIZES,
+                    noise_types=NOISE_TYPES, strengths=(None,), seed=0):
+    """
+    Writes a corpus of noisy images: the source image resized to each
+    size, with each type and strength of noise. The clean resized
+    images are also written, to be used as reference.
+
+    Each noisy image gets its own random stream, spawned from the seed,
+    so the same seed always gives the same corpus, and any image can be
+    generated again on its own.
+
+    :param output_dir: directory where the corpus is written
+    :return: the manifest, also written as output_dir/manifest.json
+    :rtype: dict
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    items = [(size, noise_type, strength)
+             for size in sizes for noise_type in noise_types for strength in strengths]
+    item_seeds = numpy.random.SeedSequence(seed).spawn(len(items))
+
+    source = Image.open(source_path).convert("RGB")
+    clean_images = dict()
+    manifest = {"source": source_path, "seed": seed, "clean": dict(), "noisy": list()}
+
+    for size in sizes:
+        clean_image = numpy.array(source.resize((size, size), Image.LANCZOS))
+        clean_path = os.path.join(output_dir, "clean_{}.png".format(size))
+        Image.fromarray(clean_image).save(clean_path, compress_level=1)
+        clean_images[size] = clean_image
+        manifest["clean"][str(size)] = clean_path
+
+    for (size, noise_type, strength), item_seed in zip(items, item_seeds):
+        noisy_image = noisy_image_create(clean_images[size], noise_type, strength,
+                                         numpy.random.default_rng(item_seed))
+
+        name = "{}_{}".format(noise_type, size)
+        if strength is not None:
+            name += "_{}".format(strength)
+        noisy_path = os.path.join(output_dir, name + ".png")
+        Image.fromarray(noisy_image).save(noisy_path, compress_level=1)
+
+        manifest["noisy"].append({"path": noisy_path, "clean": manifest["clean"][str(size)],
+                                  "size": size, "noise_type": noise_type, "strength": strength})
+
+    with open(os.path.join(output_dir, CORPUS_MANIFEST_NAME), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a reproducible corpus of noisy images")
+    parser.add_argument("output_dir")
+    parser.add_argument("--source", default=CORPUS_SOURCE_IMAGE)
+    parser.add_argument("--sizes", type=int, nargs="+", default=CORPUS_SIZES)
+    parser.add_argument("--noise-types", nargs="+", choices=NOISE_TYPES, default=NOISE_TYPES)
+    parser.add_argument("--strengths", type=float, nargs="+", default=[None])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus_generate(args.output_dir, args.source, args.sizes, args.noise_types, args.strengths, args.seed)
@@ -0,0 +1,289 @@
+import functools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy
+
+from image_wrapper import ImageWrapper, NEIGHBORHOOD_START_POSITION_SUBSTRACTOR
+from random_source import RandomSource
+from ga_image_applier import GAImageApplier, PIXEL_ENGINE, BATCHED_ENGINE, MAX_GENERATIONS, TIME_BUDGET, FALLBACK_BEST
+
+"""
+The image is split in tiles of TILE_SIZE x TILE_SIZE pixels. Each tile
+is read together with a halo around it, wide enough to contain the
+neighborhood of every pixel of the tile, so the detection and the GA of
+a tile do not need any other tile (see halo_get). HALO is the halo of
+the default window.
+"""
+TILE_SIZE = 64
+
+def halo_get(neighborhood_radius):
+    """
+    :param neighborhood_radius: radius of the window of the detection
+    and of the GA (see GAImageApplier.neighborhood_radius_set)
+    :return: the rows and columns a tile or a band is read with on each
+    side, so the window of every pixel is complete
+    :rtype: int
+    """
+    return int(neighborhood_radius)
+
+HALO = halo_get(NEIGHBORHOOD_START_POSITION_SUBSTRACTOR)
+
+"""
+Consistency of the neighborhoods seen by the GA:
+
+SNAPSHOT_CONSISTENCY: every noisy pixel is repaired against the input
+image, never against a repaired pixel. The result does not depend on the
+tiling nor on the number of processes. Uses the BATCHED_ENGINE.
+
+SEQUENTIAL_CONSISTENCY: inside a tile, the pixels are repaired in the
+same raster order as GAImageApplier, so a pixel sees the pixels of its
+tile repaired before it. The halo is always read from the input image,
+so next to the top/left border of a tile a pixel sees unrepaired pixels
+where the single process run would have seen repaired ones. Uses the
+PIXEL_ENGINE.
+"""
+SNAPSHOT_CONSISTENCY = "snapshot"
+SEQUENTIAL_CONSISTENCY = "sequential"
+
+# Shared buffers, attached once by each worker process:
+worker_buffers = dict()
+
+def worker_init(source_name, result_name, shape, dtype):
+    """
+    Attaches the worker process to the shared memory of the input image
+    (source) and of the repaired image (result).
+    """
+    source_shm = shared_memory.SharedMemory(name=source_name)
+    result_shm = shared_memory.SharedMemory(name=result_name)
+
+    # Keeping the SharedMemory instances alive, as the arrays use their buffers:
+    worker_buffers["shared_memories"] = (source_shm, result_shm)
+    worker_buffers["source"] = numpy.ndarray(shape, dtype=dtype, buffer=source_shm.buf)
+    worker_buffers["result"] = numpy.ndarray(shape, dtype=dtype, buffer=result_shm.buf)
+
+def tile_ga_apply(tile, seed, image_path, consistency, max_generations, deadline, fallback_strategy,
+                  neighborhood_radius=NEIGHBORHOOD_START_POSITION_SUBSTRACTOR):
+    """
+    Detects and repairs the noisy pixels of a tile. Only the coordinates
+    of the tile travel to the worker: the pixels are read from the source
+    shared memory, and the repaired tile is written to the result shared
+    memory.
+
+    :param tile: tuple (top, bottom, left, right) of the tile, without halo
+    :param seed: seed of the random numbers of the tile
+    :param deadline: time.time() value when the time budget of the whole
+    image is exhausted, None for no budget
+    :param neighborhood_radius: radius of the window, the halo is read
+    around the tile (see halo_get)
+    :return: the tile, its number of noisy pixels and the capped pixels
+    :rtype: tuple
+    """
+    top, bottom, left, right = tile
+    source = worker_buffers["source"]
+    result = worker_buffers["result"]
+
+    halo = halo_get(neighborhood_radius)
+    halo_top = max(top - halo, 0)
+    halo_bottom = min(bottom + halo, source.shape[0])
+    halo_left = max(left - halo, 0)
+    halo_right = min(right + halo, source.shape[1])
+
+    # Only the pixels of the tile are repaired, the halo is just read:
+    tile_rows = slice(top - halo_top, bottom - halo_top)
+    tile_cols = slice(left - halo_left, right - halo_left)
+    repaired_tile, noisy_pixels_num, capped_pixels = window_ga_apply(
+        source[halo_top:halo_bottom, halo_left:halo_right], tile_rows, tile_cols, image_path,
+        consistency, max_generations, deadline, fallback_strategy, seed, neighborhood_radius)
+
+    result[top:bottom, left:right] = repaired_tile
+
+    return tile, noisy_pixels_num, capped_pixels
+
+def window_ga_apply(window, window_rows, window_cols, image_path, consistency,
+                    max_generations, deadline, fallback_strategy, seed=None,
+                    neighborhood_radius=NEIGHBORHOOD_START_POSITION_SUBSTRACTOR):
+    """
+    Detects and repairs the noisy pixels of a part of a window of the
+    image: the window is the part with its halo, so the neighborhoods
+    of its pixels are complete.
+
+    :param window: numpy array with the part and its halo, not modified
+    :param window_rows: slice of the rows of the part, inside the window
+    :param window_cols: slice of the columns of the part, inside the window
+    :param deadline: time.time() value when the time budget is
+    exhausted, None for no budget
+    :param seed: seed of the random numbers (int or numpy SeedSequence)
+    :param neighborhood_radius: radius of the window of the detection
+    and of the GA, at most the halo of the part
+    :return: the repaired part, its number of noisy pixels and the
+    capped pixels
+    :rtype: tuple
+    """
+    # The window, as an image of its own:
+    image = ImageWrapper(image_path)
+    image.np_image_format_set(numpy.array(window))
+
+    ga_applier = GAImageApplier()
+    ga_applier.image_obj_set(image)
+    ga_applier.neighborhood_radius_set(neighborhood_radius)
+    ga_applier.keep_resulting_images_set(False)
+    ga_applier.verbose_set(False)
+    ga_applier.engine_set(BATCHED_ENGINE if consistency == SNAPSHOT_CONSISTENCY else PIXEL_ENGINE)
+    ga_applier.max_generations_set(max_generations)
+    ga_applier.fallback_strategy_set(fallback_strategy)
+    ga_applier.random_source_set(RandomSource(seed))
+    if deadline is not None:
+        ga_applier.time_budget_set(max(deadline - time.time(), 0))
+
+    noise_mask, _ = ga_applier.noise_mask_calculate()
+    part_mask = numpy.zeros_like(noise_mask)
+    part_mask[window_rows, window_cols] = noise_mask[window_rows, window_cols]
+    ga_applier.noise_mask_set(part_mask)
+
+    ga_applier.start_ga_over_image()
+
+    return image.get_np_image_format()[window_rows, window_cols], int(part_mask.sum()), ga_applier.capped_pixels_get()
+
+class ParallelGAApplier:
+    """
+    This class applies the GA over an image, as GAImageApplier does,
+    but using several processes. The image is split in tiles, and each
+    process repairs tiles reading from a shared memory copy of the input
+    image and writing into a shared memory result, so the pixels of the
+    tiles are never pickled. At the end the result is copied back into
+    the ImageWrapper.
+
+    No frames are recorded in this mode.
+
+    :param processes: number of worker processes, os.cpu_count() if None
+    :param tile_size: height and width of the tiles
+    :param consistency: SNAPSHOT_CONSISTENCY or SEQUENTIAL_CONSISTENCY
+    :param seed: seed of the run. Each tile gets its own stream spawned
+    from it, so the result does not depend on which process repairs
+    each tile. None for a different run each time.
+    """
+    def __init__(self, processes=None, tile_size=TILE_SIZE, consistency=SNAPSHOT_CONSISTENCY, seed=None):
+        self.image_obj = None # An instance of the ImageWrapper
+        self.processes = processes if processes is not None else os.cpu_count()
+        self.tile_size = tile_size
+        self.consistency = consistency
+        self.seed = seed
+        self.max_generations = MAX_GENERATIONS
+        self.time_budget = TIME_BUDGET
+        self.fallback_strategy = FALLBACK_BEST
+        self.neighborhood_radius = None # Radius of the window, None for the one of the ImageWrapper
+        self.verbose = True
+        self.noisy_pixels_num = 0
+        self.capped_pixels = {"generations": 0, "time_budget": 0}
+
+    # -- Setters & getters --
+    def image_obj_set(self, image_obj):
+        self.image_obj = image_obj
+        if self.neighborhood_radius is not None:
+            self.image_obj.neighborhood_radius_set(self.neighborhood_radius)
+    def seed_set(self, seed):
+        self.seed = seed
+    def max_generations_set(self, max_generations):
+        self.max_generations = max_generations
+    def time_budget_set(self, time_budget):
+        self.time_budget = time_budget
+    def fallback_strategy_set(self, fallback_strategy):
+        self.fallback_strategy = fallback_strategy
+    def neighborhood_radius_set(self, radius):
+        """
+        Sets the radius of the window of the detection and of the GA of
+        every tile, and so their halo (see halo_get), for this image and
+        the next ones, as GAImageApplier.neighborhood_radius_set.
+        """
+        self.neighborhood_radius = radius
+        if self.image_obj is not None:
+            self.image_obj.neighborhood_radius_set(radius)
+    def neighborhood_radius_get(self):
+        if self.image_obj is not None:
+            return int(self.image_obj.neighborhood_radius_get())
+        if self.neighborhood_radius is not None:
+            return self.neighborhood_radius
+        return NEIGHBORHOOD_START_POSITION_SUBSTRACTOR
+    def verbose_set(self, verbose):
+        self.verbose = verbose
+    def noisy_pixels_num_get(self):
+        return self.noisy_pixels_num
+    def capped_pixels_get(self):
+        return self.capped_pixels
+    # -- End of Setters & getters --
+
+    def tiles_get(self):
+        """
+        Splits the image in tiles of tile_size x tile_size pixels (the
+        tiles of the last row and column can be smaller).
+
+        :return: list of tuples (top, bottom, left, right)
+        :rtype: list
+        """
+        image_height, image_width = self.image_obj.shape_get()[:2]
+
+        tiles = list()
+        for top in range(0, image_height, self.tile_size):
+            for left in range(0, image_width, self.tile_size):
+                tiles.append((top, min(top + self.tile_size, image_height),
+                              left, min(left + self.tile_size, image_width)))
+        return tiles
+
+    def start_ga_over_image(self):
+        """
+        Repairs all the tiles of the image in the process pool, and
+        copies the repaired image back into the ImageWrapper.
+        """
+        image = self.image_obj.get_np_image_format()
+
+        if self.verbose:
+            print("------------------------------")
+            print("Starting the Genetic Algorithm in", self.processes, "processes")
+
+        self.noisy_pixels_num = 0
+        self.capped_pixels = {"generations": 0, "time_budget": 0}
+        deadline = time.time() + self.time_budget if self.time_budget is not None else None
+
+        source_shm = shared_memory.SharedMemory(create=True, size=image.nbytes)
+        result_shm = shared_memory.SharedMemory(create=True, size=image.nbytes)
+        try:
+            source = numpy.ndarray(image.shape, dtype=image.dtype, buffer=source_shm.buf)
+            result = numpy.ndarray(image.shape, dtype=image.dtype, buffer=result_shm.buf)
+            source[...] = image
+            result[...] = image
+
+            tile_worker = functools.partial(tile_ga_apply,
+                                            image_path=self.image_obj.image_path,
+                                            consistency=self.consistency,
+                                            max_generations=self.max_generations,
+                                            deadline=deadline,
+                                            fallback_strategy=self.fallback_strategy,
+                                            neighborhood_radius=self.neighborhood_radius_get())
+
+            with ProcessPoolExecutor(max_workers=self.processes,
+                                     initializer=worker_init,
+                                     initargs=(source_shm.name, result_shm.name, image.shape, image.dtype)) as pool:
+                tiles = self.tiles_get()
+                tile_seeds = numpy.random.SeedSequence(self.seed).spawn(len(tiles))
+                for tile, noisy_pixels_num, capped_pixels in pool.map(tile_worker, tiles, tile_seeds):
+                    self.noisy_pixels_num += noisy_pixels_num
+                    self.capped_pixels["generations"] += capped_pixels["generations"]
+                    self.capped_pixels["time_budget"] += capped_pixels["time_budget"]
+
+            # Stitching: the result already has every tile in place
+            image[...] = result
+            self.image_obj.windows_reset()
+            del source, result
+        finally:
+            source_shm.close()
+            source_shm.unlink()
+            result_shm.close()
+            result_shm.unlink()
+
+        if self.verbose:
+            print("Noisy pixels repaired: ", self.noisy_pixels_num)
+            print("Finished the Genetic Algorithm")
+            print("------------------------------")
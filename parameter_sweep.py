@@ -0,0 +1,273 @@
+import argparse
+import itertools
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy
+
+from image_wrapper import ImageWrapper
+from ga_image_applier import GAImageApplier, BATCHED_ENGINE, ENGINES, MAX_GENERATIONS, TIME_BUDGET, PROFILE_KEYS
+from detection_cache import DetectionCache
+from random_source import RandomSource
+from quality_metrics import psnr_calculate
+
+# Columns of the table of a sweep, besides the swept settings:
+RESULT_COLUMNS = ("seconds", "noisy_pixels", "capped_pixels", "psnr")
+
+# Shared arrays, attached once by each worker process:
+worker_arrays = dict()
+
+def configurations_get(grid):
+    """
+    :param grid: dict with a list of values for each swept setting, one
+    of the PROFILE_KEYS
+    :return: every combination of the values, as profiles
+    :rtype: list of dicts
+    """
+    unknown_keys = set(grid) - set(PROFILE_KEYS)
+    if unknown_keys:
+        raise ValueError("Unknown settings: " + ", ".join(sorted(unknown_keys)))
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+def worker_init(specs):
+    """
+    Attaches the worker process to the shared memory of the sweep: the
+    image, its reference, and the deviation coefficients of each radius.
+
+    :param specs: dict name -> (shared memory name, shape, dtype)
+    """
+    shared_memories = list()
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        shared_memories.append(shm)
+        worker_arrays[name] = numpy.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    # Keeping the SharedMemory instances alive, as the arrays use their buffers:
+    worker_arrays["shared_memories"] = shared_memories
+
+def configuration_repair(configuration, engine, seed, max_generations, time_budget):
+    """
+    Repairs a copy of the shared image with a configuration. The noise
+    mask is derived from the shared deviation coefficients of its
+    radius, so only the repair runs here.
+
+    :return: the configuration, with the seconds of the repair, the
+    noisy pixels, the capped pixels and the PSNR (None without a
+    reference)
+    :rtype: dict
+    """
+    start_time = time.perf_counter()
+
+    image = ImageWrapper("")
+    image.np_image_format_set(numpy.array(worker_arrays["image"]))
+
+    ga_applier = GAImageApplier()
+    ga_applier.profile_apply(configuration)
+    ga_applier.image_obj_set(image)
+    ga_applier.engine_set(engine)
+    ga_applier.max_generations_set(max_generations)
+    ga_applier.time_budget_set(time_budget)
+    ga_applier.random_source_set(RandomSource(seed))
+    ga_applier.keep_resulting_images_set(False)
+    ga_applier.verbose_set(False)
+
+    z_scores = worker_arrays["z_scores_{}".format(ga_applier.neighborhood_radius_get())]
+    noise_mask = numpy.any(numpy.abs(z_scores) > ga_applier.max_channel_deviation_get(), axis=2)
+    ga_applier.noise_mask_set(noise_mask)
+    ga_applier.start_ga_over_image()
+
+    result = dict(configuration)
+    result["seconds"] = time.perf_counter() - start_time
+    result["noisy_pixels"] = int(noise_mask.sum())
+    result["capped_pixels"] = sum(ga_applier.capped_pixels_get().values())
+    result["psnr"] = None
+    if "reference" in worker_arrays:
+        result["psnr"] = psnr_calculate(image.get_np_image_format(), worker_arrays["reference"])
+    return result
+
+class ParameterSweep:
+    """
+    This class runs the GA over an image with every configuration of a
+    grid (see configurations_get), sharing the work they have in common:
+
+    - The image is loaded once.
+    - The detection (the neighborhood statistics and the deviation
+    coefficients) runs once per radius of the grid, or is taken from a
+    DetectionCache. The noise mask of each configuration is derived from
+    the deviation coefficients with its threshold
+    (max_channel_deviation), without touching the neighborhoods again.
+    - The image and the deviation coefficients are placed in shared
+    memory, and the repairs of the configurations run in a process pool.
+
+    Every configuration uses the same seed, so the configurations only
+    differ in their settings.
+
+    :param image_obj: ImageWrapper with the noisy image loaded, not
+    modified
+    :param reference: numpy array of the clean image, for the PSNR of
+    each configuration, None for no PSNR
+    :param engine: one of ENGINES
+    :param processes: worker processes, os.cpu_count() if None
+    :param seed: seed of the GA of every configuration
+    """
+    def __init__(self, image_obj, reference=None, engine=BATCHED_ENGINE, processes=None, seed=0):
+        self.image_obj = image_obj
+        self.reference = reference
+        self.engine = engine
+        self.processes = processes
+        self.seed = seed
+        self.max_generations = MAX_GENERATIONS
+        self.time_budget = TIME_BUDGET # Seconds for each configuration
+        self.detection_cache = None # DetectionCache, None to always detect the noise
+        self.detection_seconds = 0 # Seconds of the shared detection of the last sweep
+        self.verbose = True
+
+    # -- Setters & getters --
+    def max_generations_set(self, max_generations):
+        self.max_generations = max_generations
+    def time_budget_set(self, time_budget):
+        self.time_budget = time_budget
+    def detection_cache_set(self, detection_cache):
+        self.detection_cache = detection_cache
+    def detection_seconds_get(self):
+        return self.detection_seconds
+    def verbose_set(self, verbose):
+        self.verbose = verbose
+    # -- End of Setters & getters --
+
+    def z_scores_get(self, radius):
+        """
+        :return: the deviation coefficients of the image with the window
+        of the given radius
+        :rtype: numpy array (height, width, channels)
+        """
+        image = ImageWrapper("")
+        image.np_image_format_set(self.image_obj.get_np_image_format())
+
+        ga_applier = GAImageApplier()
+        ga_applier.neighborhood_radius_set(radius)
+        ga_applier.image_obj_set(image)
+        if self.detection_cache is not None:
+            ga_applier.detection_cache_set(self.detection_cache)
+        ga_applier.noise_mask_calculate()
+        return ga_applier.z_scores_get()
+
+    def sweep(self, configurations):
+        """
+        Repairs the image with each configuration.
+
+        :param configurations: list of profiles, see configurations_get
+        :return: a row per configuration, in the same order, with the
+        configuration and the RESULT_COLUMNS
+        :rtype: list of dicts
+        """
+        default_radius = GAImageApplier().neighborhood_radius_get()
+        radii = sorted({configuration.get("neighborhood_radius", default_radius) for configuration in configurations})
+
+        start_time = time.perf_counter()
+        arrays = {"image": numpy.asarray(self.image_obj.get_np_image_format())}
+        for radius in radii:
+            arrays["z_scores_{}".format(radius)] = self.z_scores_get(radius)
+        if self.reference is not None:
+            arrays["reference"] = numpy.asarray(self.reference)
+        self.detection_seconds = time.perf_counter() - start_time
+
+        shared_memories = list()
+        specs = dict()
+        try:
+            for name, array in arrays.items():
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                shared_memories.append(shm)
+                numpy.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+                specs[name] = (shm.name, array.shape, array.dtype)
+
+            results = list()
+            with ProcessPoolExecutor(max_workers=self.processes, initializer=worker_init, initargs=(specs,)) as pool:
+                futures = [pool.submit(configuration_repair, configuration, self.engine, self.seed,
+                                       self.max_generations, self.time_budget) for configuration in configurations]
+                for future in futures:
+                    result = future.result()
+                    results.append(result)
+                    if self.verbose:
+                        print("{:8.3f} s  {}".format(result["seconds"], json.dumps(result)))
+        finally:
+            for shm in shared_memories:
+                shm.close()
+                shm.unlink()
+        return results
+
+def sweep_table_format(results):
+    """
+    :return: the results of a sweep as a text table, a row per
+    configuration
+    :rtype: str
+    """
+    if not results:
+        return ""
+    columns = [key for key in results[0] if key not in RESULT_COLUMNS] + list(RESULT_COLUMNS)
+
+    def cell_format(value):
+        if isinstance(value, float):
+            return "{:.3f}".format(value)
+        return str(value)
+
+    rows = [columns] + [[cell_format(result[column]) for column in columns] for result in results]
+    widths = [max(len(row[index]) for row in rows) for index in range(len(columns))]
+    return "\n".join("  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the GA over an image with a grid of settings")
+    parser.add_argument("image", help="noisy image")
+    parser.add_argument("--reference", default=None, help="clean image, for the PSNR")
+    parser.add_argument("--max-channel-deviation", type=float, nargs="+")
+    parser.add_argument("--min-deviation-coefficient", type=float, nargs="+")
+    parser.add_argument("--max-deviation-coefficient", type=float, nargs="+")
+    parser.add_argument("--population-size", type=int, nargs="+")
+    parser.add_argument("--neighborhood-radius", type=int, nargs="+")
+    parser.add_argument("--split", nargs="+", default=None,
+                        help="generation splits as elite,crossover,mutant ratios, e.g. 0.2,0.75,0.05")
+    parser.add_argument("--engine", choices=ENGINES, default=BATCHED_ENGINE)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-generations", type=int, default=MAX_GENERATIONS)
+    parser.add_argument("--time-budget", type=float, default=TIME_BUDGET, help="seconds of GA per configuration")
+    parser.add_argument("--detection-cache", default=None, help="directory of the detection cache")
+    parser.add_argument("--output", default=None, help="JSON file where the results are written")
+    args = parser.parse_args()
+
+    grid = dict()
+    for key in ("max_channel_deviation", "min_deviation_coefficient", "max_deviation_coefficient",
+                "population_size", "neighborhood_radius"):
+        if getattr(args, key) is not None:
+            grid[key] = getattr(args, key)
+    configurations = configurations_get(grid)
+    if args.split is not None:
+        splits = [[float(ratio) for ratio in split.split(",")] for split in args.split]
+        configurations = [dict(configuration, elite_ratio=elite_ratio, crossover_ratio=crossover_ratio,
+                               mutant_ratio=mutant_ratio)
+                          for configuration in configurations for elite_ratio, crossover_ratio, mutant_ratio in splits]
+
+    image = ImageWrapper(args.image)
+    image.image_opener()
+    reference = None
+    if args.reference is not None:
+        reference_image = ImageWrapper(args.reference)
+        reference_image.image_opener()
+        reference = reference_image.get_np_image_format()
+
+    parameter_sweep = ParameterSweep(image, reference, args.engine, args.processes, args.seed)
+    parameter_sweep.max_generations_set(args.max_generations)
+    parameter_sweep.time_budget_set(args.time_budget)
+    if args.detection_cache is not None:
+        parameter_sweep.detection_cache_set(DetectionCache(args.detection_cache))
+    results = parameter_sweep.sweep(configurations)
+
+    print("Shared detection: {:.3f} s".format(parameter_sweep.detection_seconds_get()))
+    print(sweep_table_format(results))
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump({"image": args.image, "engine": args.engine, "seed": args.seed,
+                       "detection_seconds": parameter_sweep.detection_seconds_get(), "results": results},
+                      output_file, indent=2)
@@ -1,10 +1,11 @@
 class Pixel:
     """
     This class is intended to handle a single Pixel with its
-    chromosome (R G B), and its fitness score
+    chromosome (R G B, or a value per channel of the image), and its
+    fitness score
     """
     def __init__(self):
-        self.chromosome = tuple() # Tuple storing the RGB channels
+        self.chromosome = tuple() # Tuple storing the channels (RGB)
         self.fitness = int() # Fitness score
     
     # -- Setters & and getters --
@@ -0,0 +1,222 @@
+import numpy
+
+from pixel import Pixel
+
+"""
+Split of each new generation: 20% of the best individuals are bypassed,
+75% are children of the best 50%, and 5% are mutants.
+"""
+ELITE_RATIO = 0.20
+CROSSOVER_RATIO = 0.75
+PARENTS_RATIO = 0.50
+MUTANT_RATIO = 0.05
+
+# The split as a tuple of ratios (elite, crossover, parents, mutant):
+GENERATION_SPLIT = (ELITE_RATIO, CROSSOVER_RATIO, PARENTS_RATIO, MUTANT_RATIO)
+
+def generation_sizes_get(population_size, split=GENERATION_SPLIT):
+    """
+    :param population_size: the expected size of the population
+    :param split: the ratios of the generation, see GENERATION_SPLIT
+    :return: the number of individuals bypassed, of children, of parents
+    to choose from and of mutants of each generation
+    :rtype: tuple of 4 ints
+    """
+    return tuple(int(population_size*ratio) for ratio in split)
+
+def generation_split_check(split):
+    """
+    Raises ValueError if the split can not create generations: the
+    elite, the children and the mutants must be at most the whole
+    population, and there must be children and parents.
+
+    :param split: tuple of ratios, see GENERATION_SPLIT
+    """
+    elite_ratio, crossover_ratio, parents_ratio, mutant_ratio = split
+    if min(split) < 0 or crossover_ratio <= 0 or parents_ratio <= 0:
+        raise ValueError("The generation needs children and parents, and no ratio can be negative")
+    if elite_ratio + crossover_ratio + mutant_ratio > 1 + 1e-9:
+        raise ValueError("The elite, the children and the mutants are more than the whole population")
+
+def deviation_coefficients_get(values, reference_mean, reference_std):
+    """
+    Deviation coefficient (z-score) of each value against a reference
+    distribution. Against a flat reference (std = 0), the value equal
+    to the mean deviates 0 and any other value deviates infinitely.
+
+    :param values: numpy array
+    :param reference_mean: mean of the reference, broadcastable to values
+    :param reference_std: standard deviation of the reference,
+    broadcastable to values
+    :return: the deviation coefficients, shape of values
+    :rtype: numpy array
+    """
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        deviation_coeff = (values - reference_mean)/reference_std
+    return numpy.where(reference_std == 0, numpy.where(values == reference_mean, 0, numpy.inf), deviation_coeff)
+
+def fitness_table_create(reference, max_pixel_value):
+    """
+    Since the fitness is the sum of the deviation coefficients of each
+    channel, the coefficient of every possible value of every channel
+    can be calculated once against the reference, and the fitness of
+    any chromosome is then one lookup per channel.
+
+    :param reference: numpy array (individuals, channels), usually the
+    neighborhood of the noisy pixel
+    :param max_pixel_value: the channels have values in [0, max_pixel_value[
+    :return: the table, with shape (channels, max_pixel_value), in
+    float32 (768 KB for a 16 bits RGB reference)
+    :rtype: numpy array
+    """
+    reference_mean = reference.mean(axis=0, dtype=numpy.float32)[:, numpy.newaxis]
+    reference_std = reference.std(axis=0, dtype=numpy.float32)[:, numpy.newaxis]
+    return deviation_coefficients_get(numpy.arange(max_pixel_value, dtype=numpy.float32), reference_mean, reference_std)
+
+class PixelView(Pixel):
+    """
+    A Pixel that does not store its chromosome nor its fitness, but
+    reads and writes them in a row of a Population. It keeps the Pixel
+    API for the code that works with lists of pixels.
+
+    :param population: the Population the pixel belongs to
+    :param index: the index of the individual in the population
+    """
+    def __init__(self, population, index):
+        self.population = population
+        self.index = index
+
+    @property
+    def chromosome(self):
+        return self.population.chromosomes[self.index]
+    @chromosome.setter
+    def chromosome(self, chromosome):
+        self.population.chromosomes[self.index] = chromosome
+
+    @property
+    def fitness(self):
+        return self.population.fitness[self.index]
+    @fitness.setter
+    def fitness(self, fitness):
+        self.population.fitness[self.index] = fitness
+
+class Population:
+    """
+    This class stores the population of the GA of a single pixel as
+    arrays, instead of a list of Pixel instances: the chromosomes in a
+    numpy array of shape (individuals, channels), and the fitness of
+    each individual in a vector.
+
+    The fitness evaluation, the sort, the crossover and the mutants are
+    each a single array operation over the whole population.
+
+    :param chromosomes: numpy array (individuals, channels)
+    :param fitness_table: table of fitness_table_create, the fitness is
+    then measured against its reference. If None, the fitness is
+    measured against the population itself.
+    """
+    def __init__(self, chromosomes, fitness_table=None):
+        self.chromosomes = numpy.asarray(chromosomes)
+        self.fitness = numpy.full(len(self.chromosomes), numpy.nan)
+        self.fitness_table = fitness_table
+
+    def __len__(self):
+        return len(self.chromosomes)
+
+    # -- Setters & getters --
+    def chromosomes_get(self):
+        return self.chromosomes
+    def fitness_get(self):
+        return self.fitness
+    def fitness_table_get(self):
+        return self.fitness_table
+    def pixels_get(self):
+        """
+        :return: a list of PixelView, one for each individual
+        :rtype: list
+        """
+        return [PixelView(self, index) for index in range(len(self))]
+    # -- End of Setters & getters --
+
+    @classmethod
+    def from_pixels(cls, pixels, fitness_table=None):
+        """
+        Creates a Population from a list of Pixel instances, keeping
+        their fitness.
+        """
+        population = cls(numpy.array([pixel.get_chromosome() for pixel in pixels]), fitness_table)
+        population.fitness = numpy.array([pixel.get_fitness() for pixel in pixels], dtype=numpy.float64)
+        return population
+
+    def fitness_calculate(self):
+        """
+        Calculates the fitness of every individual: the absolute value
+        of the sum of the deviation coefficients of each channel.
+
+        With a fitness table, each coefficient is looked up in the table
+        of its channel. Without it, the coefficients are taken against
+        the population itself, and a flat channel (std = 0) gives a nan
+        fitness, which is never in the fitness range and is sorted last.
+        """
+        if self.fitness_table is not None:
+            channels = numpy.arange(self.chromosomes.shape[1])
+            deviation_coeff = self.fitness_table[channels, self.chromosomes.astype(numpy.intp)]
+            self.fitness = numpy.abs(deviation_coeff.sum(axis=1))
+            return
+
+        population_mean = self.chromosomes.mean(axis=0)
+        population_std = self.chromosomes.std(axis=0)
+
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            deviation_coeff = (self.chromosomes - population_mean)/population_std
+        self.fitness = numpy.abs(deviation_coeff.sum(axis=1))
+
+    def sort(self):
+        """
+        Sorts the individuals based on their fitness, the fittest first.
+        """
+        order = numpy.argsort(self.fitness, kind="stable")
+        self.chromosomes = self.chromosomes[order]
+        self.fitness = self.fitness[order]
+
+    def next_generation_create(self, rng, population_size, max_pixel_value, split=GENERATION_SPLIT):
+        """
+        Creates the next generation of this (sorted) population. The
+        elite is bypassed, the children take each channel from one of
+        two parents chosen among the best individuals, and some mutants
+        are added to preserve diversity.
+
+        The split is based on population_size and not on the current
+        size, so the population of an edge pixel, that starts smaller,
+        gets the same size as the others after the first generation.
+
+        All the random numbers of the generation are drawn at once: the
+        parents, the crossover masks and the mutants are slices of a
+        single block.
+
+        :param rng: RandomSource or numpy Generator
+        :param population_size: the expected size of the population
+        :param max_pixel_value: mutants have channels in [0, max_pixel_value[
+        :param split: the ratios of the generation, see GENERATION_SPLIT
+        :return: the new population, without fitness and with the same
+        fitness table
+        :rtype: Population
+        """
+        channels_num = self.chromosomes.shape[1]
+
+        elite_num, crossover_num, parents_num, mutant_num = generation_sizes_get(population_size, split)
+        parents_num = max(min(parents_num, len(self)), 1)
+
+        uniform = rng.random(crossover_num*2 + crossover_num*channels_num + mutant_num*channels_num)
+        parents_uniform, crossover_uniform, mutants_uniform = numpy.split(
+            uniform, (crossover_num*2, crossover_num*2 + crossover_num*channels_num))
+
+        parents_index = (parents_uniform*parents_num).astype(numpy.intp).reshape(crossover_num, 2)
+        is_parent_1 = crossover_uniform.reshape(crossover_num, channels_num) < 0.5
+        children = numpy.where(is_parent_1,
+                               self.chromosomes[parents_index[:, 0]],
+                               self.chromosomes[parents_index[:, 1]])
+
+        mutants = (mutants_uniform*max_pixel_value).astype(self.chromosomes.dtype).reshape(mutant_num, channels_num)
+
+        return Population(numpy.concatenate((self.chromosomes[:elite_num], children, mutants)), self.fitness_table)
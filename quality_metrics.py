@@ -0,0 +1,69 @@
+import numpy
+
+# Constants of the SSIM, from Wang et al. (2004)
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+SSIM_WINDOW_SIZE = 7
+
+def max_value_get(image):
+    """
+    :return: the largest value a channel of the image can have
+    :rtype: int or float
+    """
+    if numpy.issubdtype(image.dtype, numpy.integer):
+        return numpy.iinfo(image.dtype).max
+    return 1.0
+
+def psnr_calculate(image, reference):
+    """
+    Peak signal to noise ratio of an image against a clean reference.
+
+    :param image: numpy array of the image
+    :param reference: numpy array of the clean image, same shape
+    :return: the PSNR in dB, inf if both images are equal
+    :rtype: float
+    """
+    error = image.astype(numpy.float64) - reference.astype(numpy.float64)
+    mean_squared_error = numpy.mean(error*error)
+    if mean_squared_error == 0:
+        return float("inf")
+    return float(10*numpy.log10(max_value_get(reference)**2/mean_squared_error))
+
+def window_mean_get(values, window_size):
+    """
+    :return: the mean of every window_size x window_size window fully
+    inside the values (the "valid" windows)
+    :rtype: numpy array
+    """
+    accumulated = numpy.zeros((values.shape[0] + 1, values.shape[1] + 1) + values.shape[2:])
+    accumulated[1:, 1:] = values.cumsum(axis=0).cumsum(axis=1)
+
+    window_sums = accumulated[window_size:, window_size:] - accumulated[:-window_size, window_size:] -\
+        accumulated[window_size:, :-window_size] + accumulated[:-window_size, :-window_size]
+    return window_sums/(window_size*window_size)
+
+def ssim_calculate(image, reference, window_size=SSIM_WINDOW_SIZE):
+    """
+    Structural similarity of an image against a clean reference, with
+    uniform windows, averaged over all the windows and channels.
+
+    :param image: numpy array of the image
+    :param reference: numpy array of the clean image, same shape
+    :return: the SSIM, 1 if both images are equal
+    :rtype: float
+    """
+    image = image.astype(numpy.float64)
+    reference = reference.astype(numpy.float64)
+
+    c1 = (SSIM_K1*max_value_get(reference))**2
+    c2 = (SSIM_K2*max_value_get(reference))**2
+
+    mean_image = window_mean_get(image, window_size)
+    mean_reference = window_mean_get(reference, window_size)
+    variance_image = window_mean_get(image*image, window_size) - mean_image*mean_image
+    variance_reference = window_mean_get(reference*reference, window_size) - mean_reference*mean_reference
+    covariance = window_mean_get(image*reference, window_size) - mean_image*mean_reference
+
+    ssim_map = ((2*mean_image*mean_reference + c1)*(2*covariance + c2)) /\
+        ((mean_image*mean_image + mean_reference*mean_reference + c1)*(variance_image + variance_reference + c2))
+    return float(ssim_map.mean())
@@ -0,0 +1,122 @@
+import numpy
+
+# Uniform numbers generated at once, each time the block is used up:
+RANDOM_BLOCK_SIZE = 1 << 16
+
+class RandomSource:
+    """
+    This class is the source of the random numbers of the GA. It is
+    built on a numpy Generator, but instead of calling it for each
+    parent, crossover mask and mutant, it generates a block of uniform
+    numbers in [0, 1[ at once and hands out slices of it, so a
+    generation costs a slice instead of several generator calls.
+
+    It has the same random and integers methods of numpy Generator used
+    by the GA, so both can be used by Population and BatchedGAEngine.
+
+    The same seed always gives the same numbers, and spawn gives
+    independent streams for parallel workers: a run split in tiles,
+    bands, images or frames is reproducible no matter the order the
+    workers run in.
+
+    The state of the stream (state_get) is the state of the generator
+    before the current block, and the position in the block: it is
+    small and can be written as JSON, to resume a run (see checkpoint).
+
+    :param seed: None, an int or a numpy SeedSequence
+    :param block_size: uniform numbers generated at once
+    """
+    def __init__(self, seed=None, block_size=RANDOM_BLOCK_SIZE):
+        if isinstance(seed, numpy.random.SeedSequence):
+            self.seed_sequence = seed
+        else:
+            self.seed_sequence = numpy.random.SeedSequence(seed)
+        self.generator = numpy.random.default_rng(self.seed_sequence)
+        self.block_size = block_size
+        self.block = numpy.empty(0)
+        self.block_position = 0
+        self.block_start_state = self.generator.bit_generator.state # State before the current block
+
+    # -- Setters & getters --
+    def generator_get(self):
+        """
+        :return: the numpy Generator behind the blocks, for the numbers
+        that are not worth buffering (e.g. the noise injectors)
+        :rtype: numpy.random.Generator
+        """
+        return self.generator
+    def seed_sequence_get(self):
+        return self.seed_sequence
+
+    def state_get(self):
+        """
+        :return: the state of the stream, that can be written as JSON.
+        The numbers taken directly from generator_get are not part of it.
+        :rtype: dict
+        """
+        return {
+            "generator": self.block_start_state,
+            "block_size": len(self.block),
+            "block_position": self.block_position
+        }
+    def state_set(self, state):
+        """
+        Sets the state of the stream from state_get: the current block is
+        generated again from the state of the generator before it.
+        """
+        self.generator.bit_generator.state = state["generator"]
+        self.block_start_state = self.generator.bit_generator.state
+        self.block = self.generator.random(state["block_size"])
+        self.block_position = state["block_position"]
+    # -- End of Setters & getters --
+
+    def spawn(self, children_num):
+        """
+        :return: independent RandomSource instances, always the same
+        ones for the same seed
+        :rtype: list
+        """
+        return [RandomSource(child_seed, self.block_size) for child_seed in self.seed_sequence.spawn(children_num)]
+
+    def uniform_get(self, count):
+        """
+        :return: the next count uniform numbers in [0, 1[ of the stream
+        :rtype: numpy array
+        """
+        available = len(self.block) - self.block_position
+        if count <= available:
+            values = self.block[self.block_position:self.block_position + count]
+            self.block_position += count
+            return values
+
+        # The rest of the block, and as many new numbers as needed:
+        values = numpy.empty(count)
+        values[:available] = self.block[self.block_position:]
+        missing = count - available
+        self.block_start_state = self.generator.bit_generator.state
+        self.block = self.generator.random(max(self.block_size, missing))
+        values[available:] = self.block[:missing]
+        self.block_position = missing
+        return values
+
+    def random(self, size=None):
+        """
+        Uniform numbers in [0, 1[, as numpy.random.Generator.random.
+
+        :param size: shape of the result, a single float if None
+        """
+        if size is None:
+            return float(self.uniform_get(1)[0])
+        shape = (size,) if numpy.isscalar(size) else tuple(size)
+        return self.uniform_get(int(numpy.prod(shape, dtype=numpy.int64))).reshape(shape)
+
+    def integers(self, low, high=None, size=None):
+        """
+        Integers in [low, high[, as numpy.random.Generator.integers.
+        A single argument is the high, with low = 0.
+        """
+        if high is None:
+            low, high = 0, low
+        values = low + numpy.floor(self.random(size)*(high - low)).astype(numpy.int64)
+        # The float product can round up to high for very large ranges:
+        return numpy.minimum(values, high - 1)
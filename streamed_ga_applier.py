@@ -0,0 +1,140 @@
+import argparse
+import time
+
+import numpy
+
+from image_wrapper import ImageWrapper
+from ga_image_applier import MAX_GENERATIONS, TIME_BUDGET, FALLBACK_BEST
+from parallel_ga_applier import SNAPSHOT_CONSISTENCY, SEQUENTIAL_CONSISTENCY, window_ga_apply, halo_get
+from band_io import BAND_HEIGHT
+
+class StreamedGAApplier:
+    """
+    This class applies the GA over an image band by band, for images
+    that do not fit in RAM. The image is usually a memmap (see
+    ImageWrapper.image_memmap_opener): each band of rows is read with a
+    halo above and below it, detected and repaired as the tiles of the
+    ParallelGAApplier are, and written back in place before the next
+    band is read. So the memory used depends on the band height and the
+    image width, not on the image height.
+
+    The rows of the halo above a band were already repaired in place,
+    so the input rows of the end of each band are kept until the next
+    band is processed: a band always sees the input image, as a tile
+    does. The halo follows the radius of the window of the ImageWrapper
+    (see halo_get).
+
+    No frames are recorded in this mode.
+
+    :param band_height: rows of each band
+    :param consistency: SNAPSHOT_CONSISTENCY or SEQUENTIAL_CONSISTENCY,
+    see parallel_ga_applier
+    :param seed: seed of the run, each band gets its own stream spawned
+    from it. None for a different run each time.
+    """
+    def __init__(self, band_height=BAND_HEIGHT, consistency=SNAPSHOT_CONSISTENCY, seed=None):
+        self.image_obj = None # An instance of the ImageWrapper
+        self.band_height = band_height
+        self.consistency = consistency
+        self.seed = seed
+        self.max_generations = MAX_GENERATIONS
+        self.time_budget = TIME_BUDGET
+        self.fallback_strategy = FALLBACK_BEST
+        self.verbose = True
+        self.noisy_pixels_num = 0
+        self.capped_pixels = {"generations": 0, "time_budget": 0}
+
+    # -- Setters & getters --
+    def image_obj_set(self, image_obj):
+        self.image_obj = image_obj
+    def seed_set(self, seed):
+        self.seed = seed
+    def max_generations_set(self, max_generations):
+        self.max_generations = max_generations
+    def time_budget_set(self, time_budget):
+        self.time_budget = time_budget
+    def fallback_strategy_set(self, fallback_strategy):
+        self.fallback_strategy = fallback_strategy
+    def verbose_set(self, verbose):
+        self.verbose = verbose
+    def noisy_pixels_num_get(self):
+        return self.noisy_pixels_num
+    def capped_pixels_get(self):
+        return self.capped_pixels
+    # -- End of Setters & getters --
+
+    def start_ga_over_image(self):
+        """
+        Repairs the image band by band, in place.
+        """
+        image = self.image_obj.get_np_image_format()
+        image_height = image.shape[0]
+
+        if self.verbose:
+            print("------------------------------")
+            print("Starting the Genetic Algorithm in bands of", self.band_height, "rows")
+
+        self.noisy_pixels_num = 0
+        self.capped_pixels = {"generations": 0, "time_budget": 0}
+        deadline = time.time() + self.time_budget if self.time_budget is not None else None
+
+        neighborhood_radius = int(self.image_obj.neighborhood_radius_get())
+        halo = halo_get(neighborhood_radius)
+        band_tops = range(0, image_height, self.band_height)
+        band_seeds = numpy.random.SeedSequence(self.seed).spawn(len(band_tops))
+
+        # Input rows above the current band, already repaired in the image:
+        previous_rows = image[:0].copy()
+
+        for top, band_seed in zip(band_tops, band_seeds):
+            bottom = min(top + self.band_height, image_height)
+            halo_bottom = min(bottom + halo, image_height)
+
+            window = numpy.concatenate((previous_rows, image[top:halo_bottom]))
+            band_rows = slice(len(previous_rows), len(previous_rows) + bottom - top)
+
+            repaired_band, noisy_pixels_num, capped_pixels = window_ga_apply(
+                window, band_rows, slice(None), self.image_obj.image_path, self.consistency,
+                self.max_generations, deadline, self.fallback_strategy, band_seed, neighborhood_radius)
+
+            # Keeping the input rows the next band needs, before they are
+            # overwritten:
+            previous_rows = window[max(band_rows.stop - halo, 0):band_rows.stop].copy()
+
+            image[top:bottom] = repaired_band
+            self.noisy_pixels_num += noisy_pixels_num
+            self.capped_pixels["generations"] += capped_pixels["generations"]
+            self.capped_pixels["time_budget"] += capped_pixels["time_budget"]
+
+        if hasattr(image, "flush"):
+            image.flush()
+        self.image_obj.windows_reset()
+
+        if self.verbose:
+            print("Noisy pixels repaired: ", self.noisy_pixels_num)
+            print("Finished the Genetic Algorithm")
+            print("------------------------------")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Denoise an image larger than RAM, band by band")
+    parser.add_argument("input", help="image to denoise: .npy and non interlaced PNG images without palette are "
+                        "read band by band, any other format PIL reads is decoded whole once")
+    parser.add_argument("output", help=".png or .npy to write")
+    parser.add_argument("--scratch", default=None, help=".npy scratch file backing the image")
+    parser.add_argument("--band-height", type=int, default=BAND_HEIGHT)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--consistency", choices=[SNAPSHOT_CONSISTENCY, SEQUENTIAL_CONSISTENCY],
+                        default=SNAPSHOT_CONSISTENCY)
+    args = parser.parse_args()
+
+    image = ImageWrapper(args.input)
+    image.image_memmap_opener(args.scratch)
+    try:
+        ga_applier = StreamedGAApplier(args.band_height, args.consistency, args.seed)
+        ga_applier.image_obj_set(image)
+        ga_applier.start_ga_over_image()
+
+        image.set_result_image_name(args.output)
+        image.save()
+    finally:
+        image.scratch_remove()
@@ -0,0 +1,130 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+import numpy
+
+from band_io import PNGBandReader, PNGBandWriter, png_read, png_wide_color_check, PNG_FILTER_AVERAGE,\
+    PNG_FILTER_PAETH
+from denoise_service import job_run
+from image_wrapper import ImageWrapper
+
+SHAPES = [(24, 20), (24, 20, 2), (24, 20, 3), (24, 20, 4)]
+
+def png_bytes_get(image):
+    """
+    :return: the image written as PNG by PNGBandWriter
+    :rtype: bytes
+    """
+    output = io.BytesIO()
+    writer = PNGBandWriter(output, image.shape, image.dtype)
+    writer.band_write(image[:10])
+    writer.band_write(image[10:])
+    writer.close()
+    return output.getvalue()
+
+def row_filter(filter_type, row, previous_row, pixel_bytes):
+    """
+    Filters a row of bytes as a PNG encoder does, byte by byte, the
+    reference for PNGBandReader.row_unfilter.
+    """
+    filtered = list()
+    for position, value in enumerate(row):
+        left = int(row[position - pixel_bytes]) if position >= pixel_bytes else 0
+        above = int(previous_row[position])
+        upper_left = int(previous_row[position - pixel_bytes]) if position >= pixel_bytes else 0
+        if filter_type == PNG_FILTER_AVERAGE:
+            predictor = (left + above)//2
+        else:
+            estimate = left + above - upper_left
+            distances = [abs(estimate - left), abs(estimate - above), abs(estimate - upper_left)]
+            predictor = [left, above, upper_left][distances.index(min(distances))]
+        filtered.append((int(value) - predictor) & 0xFF)
+    return numpy.array(filtered, dtype=numpy.uint8)
+
+class PNGRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = numpy.random.default_rng(0)
+
+    def test_16_bits_round_trip(self):
+        for shape in SHAPES:
+            with self.subTest(shape=shape):
+                image = self.rng.integers(0, 1 << 16, shape).astype(numpy.uint16)
+                with tempfile.TemporaryDirectory() as directory:
+                    path = os.path.join(directory, "image.png")
+                    with open(path, "wb") as png_file:
+                        png_file.write(png_bytes_get(image))
+                    self.assertEqual(png_wide_color_check(path), len(shape) == 3)
+                    result = png_read(path)
+                self.assertEqual(result.dtype, numpy.uint16)
+                numpy.testing.assert_array_equal(result, image)
+
+    def test_8_bits_matches_pil(self):
+        # PIL chooses a filter for each row:
+        image = numpy.array(Image.open("images/lena.jpg").convert("RGB"))[:64, :64]
+        for mode in ("L", "LA", "RGB", "RGBA"):
+            with self.subTest(mode=mode):
+                pil_image = Image.fromarray(image).convert(mode)
+                output = io.BytesIO()
+                pil_image.save(output, format="PNG")
+                numpy.testing.assert_array_equal(png_read(io.BytesIO(output.getvalue())), numpy.array(pil_image))
+
+    def test_average_and_paeth_unfilter(self):
+        for pixel_bytes, shape in ((1, (4, 3)), (3, (4, 3, 3)), (6, (4, 3, 3)), (8, (4, 3, 4))):
+            dtype = numpy.uint16 if pixel_bytes > 4 else numpy.uint8
+            reader = PNGBandReader(io.BytesIO(png_bytes_get(numpy.zeros(shape, dtype=dtype))))
+            self.assertEqual(reader.pixel_bytes, pixel_bytes)
+            # A flat previous row makes Paeth add the byte on the left
+            # all along the row:
+            for filter_type, flat in ((PNG_FILTER_AVERAGE, False), (PNG_FILTER_PAETH, False), (PNG_FILTER_PAETH, True)):
+                with self.subTest(pixel_bytes=pixel_bytes, filter_type=filter_type, flat=flat):
+                    row = self.rng.integers(0, 256, 50*pixel_bytes).astype(numpy.uint8)
+                    reader.previous_row = self.rng.integers(0, 256, 50*pixel_bytes).astype(numpy.uint8)
+                    if flat:
+                        reader.previous_row[:] = 7
+                    filtered = row_filter(filter_type, row, reader.previous_row, pixel_bytes)
+                    numpy.testing.assert_array_equal(reader.row_unfilter(filter_type, filtered), row)
+
+    def test_truncated_png(self):
+        png_bytes = png_bytes_get(self.rng.integers(0, 1 << 16, (24, 20, 3)).astype(numpy.uint16))
+        for length in (40, len(png_bytes)//2):
+            with self.subTest(length=length):
+                with self.assertRaises(ValueError):
+                    png_read(io.BytesIO(png_bytes[:length]))
+
+    def test_service_keeps_16_bits(self):
+        image = self.rng.integers(0, 1 << 16, (24, 20, 3)).astype(numpy.uint16)
+        result_bytes, statistics = job_run(png_bytes_get(image), "mean", 10, None, 1, seed=0)
+        result = png_read(io.BytesIO(result_bytes))
+        self.assertEqual(result.dtype, numpy.uint16)
+        self.assertEqual(result.shape, image.shape)
+        self.assertEqual(statistics["pixels"], 24*20)
+
+    def test_memmap_without_pil(self):
+        for mode, channels in (("L", 1), ("RGB", 3), ("RGBA", 4)):
+            with self.subTest(mode=mode), tempfile.TemporaryDirectory() as directory:
+                shape = (24, 20) if channels == 1 else (24, 20, channels)
+                pil_image = Image.fromarray(self.rng.integers(0, 256, shape).astype(numpy.uint8), mode)
+                image_path = os.path.join(directory, "image.png")
+                pil_image.save(image_path)
+                expected = numpy.array(pil_image)
+
+                image = ImageWrapper(image_path)
+                failure = mock.Mock(side_effect=AssertionError("PIL decoded the PNG"))
+                with mock.patch("band_io.Image.open", failure), mock.patch("image_wrapper.Image.open", failure):
+                    image.image_memmap_opener(os.path.join(directory, "scratch.npy"))
+                try:
+                    self.assertEqual(image.format, "PNG")
+                    if channels == 4:
+                        numpy.testing.assert_array_equal(image.np_image_format, expected[:, :, :-1])
+                        numpy.testing.assert_array_equal(image.alpha, expected[:, :, -1])
+                    else:
+                        numpy.testing.assert_array_equal(image.np_image_format, expected)
+                finally:
+                    del image
+
+if __name__ == "__main__":
+    unittest.main()
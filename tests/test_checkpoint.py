@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy
+
+import ga_image_applier
+from image_wrapper import ImageWrapper
+from ga_image_applier import GAImageApplier, BATCHED_ENGINE, DIRECT_ENGINE, PIXEL_ENGINE
+from checkpoint import Checkpointer, MANIFEST_NAME
+from random_source import RandomSource
+
+IMAGE_PATH = "images/lena_salt_pepper_noised.png"
+CROP_SIZE = 64
+
+"""
+The method that fails in the middle of the first pass of each engine,
+and the call it fails on: the batches of the batch engines are
+BATCH_MAX_PIXELS pixels, see CheckpointResumeTest.
+"""
+INTERRUPTIONS = {
+    PIXEL_ENGINE: ("fittest_chromosome_search", 150),
+    BATCHED_ENGINE: ("batched_evolve", 3),
+    DIRECT_ENGINE: ("batched_evolve", 3)
+}
+BATCH_MAX_PIXELS = 100
+
+class Interruption(Exception):
+    pass
+
+class CheckpointResumeTest(unittest.TestCase):
+    """
+    A run interrupted and resumed from its checkpoint gives the same
+    output as an uninterrupted run.
+    """
+    def setUp(self):
+        image = ImageWrapper(IMAGE_PATH)
+        image.image_opener()
+        self.pixels = numpy.array(image.get_np_image_format()[:CROP_SIZE, :CROP_SIZE])
+        patcher = mock.patch.object(ga_image_applier, "BATCH_MAX_PIXELS", BATCH_MAX_PIXELS)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ga_applier_create(self, engine, checkpoint_dir=None):
+        image = ImageWrapper("")
+        image.np_image_format_set(self.pixels.copy())
+        ga_applier = GAImageApplier()
+        ga_applier.image_obj_set(image)
+        ga_applier.engine_set(engine)
+        ga_applier.max_passes_set(2)
+        ga_applier.keep_resulting_images_set(False)
+        ga_applier.verbose_set(False)
+        ga_applier.random_source_set(RandomSource(5))
+        if checkpoint_dir is not None:
+            ga_applier.checkpointer_set(Checkpointer(checkpoint_dir, interval=0))
+        return ga_applier
+
+    def test_resumed_run_matches_uninterrupted_run(self):
+        for engine, (method_name, failing_call) in INTERRUPTIONS.items():
+            with self.subTest(engine=engine), tempfile.TemporaryDirectory() as checkpoint_dir:
+                ga_applier = self.ga_applier_create(engine)
+                ga_applier.start_ga_over_image()
+                expected = ga_applier.image_obj.get_np_image_format()
+                expected_rows = ga_applier.list_of_rows_get()
+                expected_capped_pixels = ga_applier.capped_pixels_get()
+
+                # Interrupting the run in the middle of the first pass:
+                ga_applier = self.ga_applier_create(engine, checkpoint_dir)
+                method = getattr(GAImageApplier, method_name)
+                calls = [0]
+                def interrupted_method(self, *args, **kwargs):
+                    calls[0] += 1
+                    if calls[0] == failing_call:
+                        raise Interruption()
+                    return method(self, *args, **kwargs)
+                with mock.patch.object(GAImageApplier, method_name, interrupted_method):
+                    with self.assertRaises(Interruption):
+                        ga_applier.start_ga_over_image()
+                ga_applier.checkpointer_get().close()
+                with open(os.path.join(checkpoint_dir, MANIFEST_NAME)) as manifest_file:
+                    self.assertGreater(json.load(manifest_file)["noisy_pixels_done"], 0)
+
+                ga_applier = self.ga_applier_create(engine, checkpoint_dir)
+                ga_applier.start_ga_over_image()
+                numpy.testing.assert_array_equal(ga_applier.image_obj.get_np_image_format(), expected)
+                self.assertEqual(ga_applier.list_of_rows_get(), expected_rows)
+                self.assertEqual(ga_applier.capped_pixels_get(), expected_capped_pixels)
+
+if __name__ == "__main__":
+    unittest.main()
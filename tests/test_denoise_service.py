@@ -0,0 +1,79 @@
+import asyncio
+import io
+import threading
+import unittest
+
+from PIL import Image
+
+from denoise_service import DenoiseService, DenoiseClient, ServiceBusyError, QUEUED_STATUS, RUNNING_STATUS,\
+    DONE_STATUS
+from batch_denoise import GA_PIXEL_METHOD
+
+IMAGE_PATH = "images/lena_salt_pepper_noised.png"
+
+def png_crop_get(crop_size):
+    """
+    :return: the top left corner of the image, encoded as PNG
+    :rtype: bytes
+    """
+    output = io.BytesIO()
+    with Image.open(IMAGE_PATH) as pil_image:
+        pil_image.crop((0, 0, crop_size, crop_size)).save(output, format="PNG")
+    return output.getvalue()
+
+class DenoiseServiceTest(unittest.TestCase):
+    """
+    The service runs in the event loop of another thread, on an
+    ephemeral port, with a single worker and room for a single job in
+    the queue.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+        self.service = DenoiseService(workers=1, queue_size=1)
+        server = asyncio.run_coroutine_threadsafe(self.service.start(port=0), self.loop).result()
+        self.client = DenoiseClient(port=server.sockets[0].getsockname()[1], timeout=60)
+
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.service.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def test_events_stream(self):
+        job_id = self.client.submit(png_crop_get(32), max_generations=10, seed=0)
+        statuses = [job["status"] for job in self.client.events_get(job_id)]
+
+        # A line per change of the status, the ones before the first
+        # line passed before the stream started:
+        self.assertEqual(statuses[-1], DONE_STATUS)
+        self.assertEqual(statuses, [QUEUED_STATUS, RUNNING_STATUS, DONE_STATUS][-len(statuses):])
+        with Image.open(io.BytesIO(self.client.result_get(job_id))) as result:
+            self.assertEqual(result.size, (32, 32))
+
+    def test_full_queue(self):
+        # The worker takes a job, the next one fills the queue, and the
+        # one after is refused while they run:
+        image_bytes = png_crop_get(128)
+        job_ids = list()
+        with self.assertRaises(ServiceBusyError):
+            for _ in range(3):
+                job_ids.append(self.client.submit(image_bytes, GA_PIXEL_METHOD, time_budget=2, seed=0))
+        self.assertGreaterEqual(len(job_ids), 1)
+
+        status, _ = self.client.request("POST", "/jobs?method=" + GA_PIXEL_METHOD, image_bytes)
+        self.assertEqual(status, 503)
+
+    def test_unknown_method(self):
+        status, body = self.client.request("POST", "/jobs?method=unknown", png_crop_get(32))
+        self.assertEqual(status, 400)
+        self.assertIn(b"Unknown method", body)
+        self.assertEqual(self.client.health_get()["jobs"], 0)
+
+        with self.assertRaises(RuntimeError):
+            self.client.submit(png_crop_get(32), "unknown")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import unittest
+
+import numpy
+
+from image_wrapper import ImageWrapper
+from ga_image_applier import GAImageApplier, BATCHED_ENGINE, ENGINES
+from random_source import RandomSource
+
+IMAGE_PATH = "images/lena_chroma_noised.png"
+CROP_SIZE = 48
+
+def image_crop_get(path=IMAGE_PATH, crop_size=CROP_SIZE):
+    """
+    :return: an ImageWrapper with the top left crop of the image, so the
+    crop has edge pixels on two sides
+    :rtype: ImageWrapper
+    """
+    image = ImageWrapper(path)
+    image.image_opener()
+    crop = ImageWrapper("")
+    crop.np_image_format_set(numpy.array(image.get_np_image_format()[:crop_size, :crop_size]))
+    return crop
+
+class NoiseMaskTest(unittest.TestCase):
+    """
+    The detection of the whole image at once against the detection of
+    the original pixel by pixel loop (neighborhood_get, then
+    is_pixel_noisy and calculate_deviation_coeff).
+    """
+    def setUp(self):
+        self.image = image_crop_get()
+        self.ga_applier = GAImageApplier()
+        self.ga_applier.image_obj_set(self.image)
+        self.ga_applier.verbose_set(False)
+
+    def test_noise_mask_matches_pixel_by_pixel(self):
+        noise_mask, _ = self.ga_applier.noise_mask_calculate()
+        z_scores = self.ga_applier.z_scores_get()
+
+        image = self.image.get_np_image_format()
+        for j in range(image.shape[0]):
+            for i in range(image.shape[1]):
+                neighborhood = self.image.neighborhood_get(j, i)
+                self.assertEqual(bool(noise_mask[j, i]), bool(self.ga_applier.is_pixel_noisy(image[j, i], neighborhood)),
+                                 (j, i))
+                numpy.testing.assert_allclose(z_scores[j, i], self.ga_applier.calculate_deviation_coeff(
+                    image[j, i], neighborhood), rtol=1e-4, atol=1e-4)
+
+    def test_noise_mask_update_matches_full_detection(self):
+        self.ga_applier.noise_mask_calculate()
+
+        # Changing a few pixels, and detecting again only their window:
+        image = self.image.get_np_image_format()
+        changed_y = numpy.array([0, 10, 30, CROP_SIZE - 1])
+        changed_x = numpy.array([5, 10, 0, CROP_SIZE - 1])
+        image[changed_y, changed_x] = [[255, 0, 255], [0, 0, 0], [128, 128, 128], [10, 250, 10]]
+        dirty_y, dirty_x = self.ga_applier.dirty_pixels_get(changed_y, changed_x)
+        self.ga_applier.noise_mask_update(dirty_y, dirty_x)
+
+        fresh_applier = GAImageApplier()
+        fresh_applier.image_obj_set(self.image)
+        noise_mask, _ = fresh_applier.noise_mask_calculate()
+        numpy.testing.assert_array_equal(self.ga_applier.noise_mask_get(), noise_mask)
+
+    def test_noise_mask_update_without_pixels(self):
+        noise_mask, _ = self.ga_applier.noise_mask_calculate()
+        noise_mask = noise_mask.copy()
+        noisy = self.ga_applier.noise_mask_update(numpy.array([], dtype=int), numpy.array([], dtype=int))
+        self.assertEqual(len(noisy), 0)
+        numpy.testing.assert_array_equal(self.ga_applier.noise_mask_get(), noise_mask)
+
+class MultiPassDetectionTest(unittest.TestCase):
+    """
+    The detection again of the neighbors of the pixels changed by a pass
+    of start_ga_over_image against a full detection of the image after
+    that pass.
+    """
+    def test_noise_mask_update_after_pass(self):
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                image = image_crop_get()
+                ga_applier = GAImageApplier()
+                ga_applier.image_obj_set(image)
+                ga_applier.engine_set(engine)
+                ga_applier.max_passes_set(3)
+                ga_applier.random_source_set(RandomSource(0))
+                ga_applier.keep_resulting_images_set(False)
+                ga_applier.verbose_set(False)
+
+                # Checking the mask each time a pass ends:
+                noise_mask_update = ga_applier.noise_mask_update
+                full_noise_masks = list()
+                def noise_mask_update_checked(dirty_y, dirty_x):
+                    noisy = noise_mask_update(dirty_y, dirty_x)
+                    fresh_applier = GAImageApplier()
+                    fresh_applier.image_obj_set(image)
+                    full_noise_mask, _ = fresh_applier.noise_mask_calculate()
+                    full_noise_masks.append(full_noise_mask)
+
+                    numpy.testing.assert_array_equal(ga_applier.noise_mask_get(), full_noise_mask)
+                    numpy.testing.assert_array_equal(noisy, full_noise_mask[dirty_y, dirty_x])
+                    return noisy
+                ga_applier.noise_mask_update = noise_mask_update_checked
+
+                ga_applier.start_ga_over_image()
+                self.assertGreaterEqual(len(full_noise_masks), 1)
+                self.assertEqual(ga_applier.passes_num, len(full_noise_masks) + 1)
+
+class ReusedApplierTest(unittest.TestCase):
+    """
+    An applier reused for another image repairs it as a new applier
+    would, without the detection of the first image.
+    """
+    def ga_apply(self, ga_applier, image):
+        ga_applier.image_obj_set(image)
+        ga_applier.random_source_set(RandomSource(1))
+        ga_applier.start_ga_over_image()
+        return image.get_np_image_format()
+
+    def test_reused_applier(self):
+        for engine in ("pixel", BATCHED_ENGINE):
+            with self.subTest(engine=engine):
+                reused_applier = GAImageApplier()
+                reused_applier.engine_set(engine)
+                reused_applier.verbose_set(False)
+                self.ga_apply(reused_applier, image_crop_get("images/lena_salt_pepper_noised.png"))
+                reused_result = self.ga_apply(reused_applier, image_crop_get())
+
+                new_applier = GAImageApplier()
+                new_applier.engine_set(engine)
+                new_applier.verbose_set(False)
+                new_result = self.ga_apply(new_applier, image_crop_get())
+
+                numpy.testing.assert_array_equal(reused_result, new_result)
+                self.assertEqual(len(reused_applier.list_of_rows_get()), CROP_SIZE)
+
+if __name__ == "__main__":
+    unittest.main()
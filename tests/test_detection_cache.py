@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from image_wrapper import ImageWrapper
+from ga_image_applier import GAImageApplier
+from detection_cache import DetectionCache, ENTRY_MANIFEST_NAME
+from tests.test_detection import image_crop_get
+
+class DetectionCacheTest(unittest.TestCase):
+    """
+    The detection of GAImageApplier through a DetectionCache: the hits
+    are keyed by the content of the image and by the parameters of the
+    detection, and the least recently used entries are evicted.
+    """
+    def setUp(self):
+        self.cache_directory = tempfile.TemporaryDirectory()
+        self.detection_cache = DetectionCache(self.cache_directory.name)
+
+    def tearDown(self):
+        self.cache_directory.cleanup()
+
+    def noise_mask_calculate(self, image, detection_cache=None):
+        ga_applier = GAImageApplier()
+        ga_applier.image_obj_set(image)
+        ga_applier.detection_cache_set(detection_cache if detection_cache is not None else self.detection_cache)
+        ga_applier.verbose_set(False)
+        noise_mask, _ = ga_applier.noise_mask_calculate()
+        return numpy.array(noise_mask), ga_applier
+
+    def test_content_keyed_hit(self):
+        noise_mask, _ = self.noise_mask_calculate(image_crop_get())
+        self.assertEqual((self.detection_cache.hits_get(), self.detection_cache.misses_get()), (0, 1))
+
+        # The same pixels in another array, from another file:
+        image_path = os.path.join(self.cache_directory.name, "image.npy")
+        numpy.save(image_path, image_crop_get().get_np_image_format())
+        image = ImageWrapper("")
+        image.np_image_format_set(numpy.load(image_path))
+        cached_noise_mask, _ = self.noise_mask_calculate(image)
+
+        self.assertEqual((self.detection_cache.hits_get(), self.detection_cache.misses_get()), (1, 1))
+        numpy.testing.assert_array_equal(cached_noise_mask, noise_mask)
+        self.assertEqual(len(self.detection_cache.entries_get()), 1)
+
+    def test_invalidation(self):
+        self.noise_mask_calculate(image_crop_get())
+
+        changes = {
+            "max_channel_deviation": lambda ga_applier: ga_applier.max_channel_deviation_set(0.5),
+            "neighborhood_radius": lambda ga_applier: ga_applier.neighborhood_radius_set(1),
+            "pixel": lambda ga_applier: ga_applier.image_obj.pixels_set(
+                numpy.array([0]), numpy.array([0]), numpy.zeros((1, 3), dtype=numpy.uint8))
+        }
+        for entries_num, (name, change) in enumerate(changes.items(), 2):
+            with self.subTest(change=name):
+                ga_applier = GAImageApplier()
+                ga_applier.image_obj_set(image_crop_get())
+                ga_applier.verbose_set(False)
+                change(ga_applier)
+                expected_noise_mask, _ = ga_applier.noise_mask_calculate()
+                expected_noise_mask = numpy.array(expected_noise_mask)
+
+                # The same detection, missed in the cache and stored:
+                ga_applier.detection_cache_set(self.detection_cache)
+                misses = self.detection_cache.misses_get()
+                noise_mask, _ = ga_applier.noise_mask_calculate()
+                self.assertEqual(self.detection_cache.misses_get(), misses + 1)
+                numpy.testing.assert_array_equal(noise_mask, expected_noise_mask)
+                self.assertEqual(len(self.detection_cache.entries_get()), entries_num)
+        self.assertEqual(self.detection_cache.hits_get(), 0)
+
+    def test_lru_eviction(self):
+        image = image_crop_get().get_np_image_format()
+        images = [image, image[::-1], image[:, ::-1]]
+        keys = [self.detection_cache.key_get(image, {}) for image in images]
+        noise_mask = numpy.zeros(image.shape[:2], dtype=bool)
+        planes = numpy.zeros(image.shape, dtype=numpy.float32)
+
+        self.detection_cache.store(keys[0], noise_mask, planes, planes)
+        self.detection_cache.store(keys[1], noise_mask, planes, planes)
+        entry_bytes = max(entry_bytes for _, entry_bytes, _ in self.detection_cache.entries_get())
+        for key, last_use in zip(keys, (1000, 2000)):
+            os.utime(os.path.join(self.cache_directory.name, key, ENTRY_MANIFEST_NAME), (last_use, last_use))
+
+        # Room for two entries: the hit makes the first one the most
+        # recently used, so the second one goes:
+        detection_cache = DetectionCache(self.cache_directory.name, max_bytes=2*entry_bytes + entry_bytes//2)
+        self.assertIsNotNone(detection_cache.load(keys[0]))
+        detection_cache.store(keys[2], noise_mask, planes, planes)
+
+        entry_paths = [entry_path for _, _, entry_path in detection_cache.entries_get()]
+        self.assertEqual(entry_paths, [os.path.join(self.cache_directory.name, key) for key in (keys[0], keys[2])])
+        self.assertIsNone(detection_cache.load(keys[1]))
+
+if __name__ == "__main__":
+    unittest.main()
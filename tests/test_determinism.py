@@ -0,0 +1,69 @@
+import json
+import unittest
+
+import numpy
+
+from ga_image_applier import GAImageApplier, PIXEL_ENGINE, BATCHED_ENGINE
+from parallel_ga_applier import ParallelGAApplier, SNAPSHOT_CONSISTENCY, SEQUENTIAL_CONSISTENCY
+from random_source import RandomSource
+from tests.test_detection import image_crop_get
+
+SEED = 7
+
+class SeededRunTest(unittest.TestCase):
+    """
+    Two runs with the same seed give the same bytes, with every engine
+    and in parallel.
+    """
+    def ga_apply(self, engine):
+        image = image_crop_get()
+        ga_applier = GAImageApplier()
+        ga_applier.image_obj_set(image)
+        ga_applier.engine_set(engine)
+        ga_applier.random_source_set(RandomSource(SEED))
+        ga_applier.keep_resulting_images_set(False)
+        ga_applier.verbose_set(False)
+        ga_applier.start_ga_over_image()
+        return image.get_np_image_format().tobytes()
+
+    def parallel_ga_apply(self, consistency, processes):
+        image = image_crop_get()
+        parallel_applier = ParallelGAApplier(processes, tile_size=24, consistency=consistency, seed=SEED)
+        parallel_applier.image_obj_set(image)
+        parallel_applier.verbose_set(False)
+        parallel_applier.start_ga_over_image()
+        return image.get_np_image_format().tobytes()
+
+    def test_engines(self):
+        for engine in (PIXEL_ENGINE, BATCHED_ENGINE):
+            with self.subTest(engine=engine):
+                self.assertEqual(self.ga_apply(engine), self.ga_apply(engine))
+
+    def test_parallel(self):
+        for consistency in (SNAPSHOT_CONSISTENCY, SEQUENTIAL_CONSISTENCY):
+            with self.subTest(consistency=consistency):
+                result = self.parallel_ga_apply(consistency, 2)
+                self.assertEqual(self.parallel_ga_apply(consistency, 2), result)
+                # Each tile has its own stream, whatever process repairs it:
+                self.assertEqual(self.parallel_ga_apply(consistency, 1), result)
+
+class RandomSourceStateTest(unittest.TestCase):
+    """
+    A stream set to a state written by state_get goes on with the same
+    numbers, within a block and across blocks.
+    """
+    def test_state_round_trip(self):
+        for taken in (0, 5, 16, 21):
+            with self.subTest(taken=taken):
+                random_source = RandomSource(SEED, block_size=16)
+                random_source.random(taken)
+                state = json.loads(json.dumps(random_source.state_get()))
+                expected = random_source.random(40)
+
+                resumed_source = RandomSource(SEED + 1, block_size=16)
+                resumed_source.state_set(state)
+                numpy.testing.assert_array_equal(resumed_source.random(40), expected)
+                self.assertEqual(resumed_source.state_get(), random_source.state_get())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+
+import numpy
+
+from image_wrapper import ImageWrapper
+from ga_image_applier import GAImageApplier, BATCHED_ENGINE, DIRECT_ENGINE, MIN_DEVIATION_COEFFICIENT,\
+    MAX_DEVIATION_COEFFICIENT
+from direct_solver import DirectSolver
+from population import deviation_coefficients_get
+from noise_corpus import noisy_image_create, CHROMA_NOISE, SALT_PEPPER_NOISE
+from random_source import RandomSource
+
+CLEAN_IMAGE_PATH = "images/lena.jpg"
+CROP_SIZE = 48
+
+"""
+Pixels capped by the generations (the ones that got the fallback) in
+the seeded corpus images, with each engine.
+"""
+EXPECTED_CAPPED_PIXELS = {
+    (CHROMA_NOISE, BATCHED_ENGINE): 0,
+    (CHROMA_NOISE, DIRECT_ENGINE): 0,
+    (SALT_PEPPER_NOISE, BATCHED_ENGINE): 0,
+    (SALT_PEPPER_NOISE, DIRECT_ENGINE): 0
+}
+
+class DirectSolverTest(unittest.TestCase):
+    """
+    The pixels repaired by the direct solver against the ones of the
+    batched GA, in a single pass over a seeded corpus image: both must
+    meet the fitness range of the GA against the same neighborhood
+    statistics.
+    """
+    def setUp(self):
+        clean = ImageWrapper(CLEAN_IMAGE_PATH)
+        clean.image_opener()
+        self.clean_image = numpy.array(clean.get_np_image_format()[:CROP_SIZE, :CROP_SIZE])
+
+    def ga_apply(self, noisy_image, engine):
+        """
+        :return: the squared deviation coefficients of the channels of
+        each repaired pixel against its neighborhood, the fitness of each
+        of them, and the applier
+        :rtype: tuple (numpy array, numpy array, GAImageApplier)
+        """
+        image = ImageWrapper("")
+        image.np_image_format_set(noisy_image.copy())
+        ga_applier = GAImageApplier()
+        ga_applier.image_obj_set(image)
+        ga_applier.engine_set(engine)
+        ga_applier.max_passes_set(1)
+        ga_applier.random_source_set(RandomSource(0))
+        ga_applier.keep_resulting_images_set(False)
+        ga_applier.verbose_set(False)
+
+        # The statistics of the neighborhoods before the repair, as the
+        # engines calculate them:
+        noise_mask, _ = ga_applier.noise_mask_calculate()
+        pixels_y, pixels_x = numpy.nonzero(noise_mask)
+        neighborhoods, neighborhoods_valid = image.neighborhoods_get(pixels_y, pixels_x)
+        reference_mean, reference_std = DirectSolver(
+            MIN_DEVIATION_COEFFICIENT, MAX_DEVIATION_COEFFICIENT, image.max_channel_value_get()
+        ).reference_statistics_get(neighborhoods.astype(numpy.float32), neighborhoods_valid)
+
+        ga_applier.start_ga_over_image()
+        repaired = image.get_np_image_format()[pixels_y, pixels_x].astype(numpy.float32)[:, numpy.newaxis]
+        deviation_coeff = deviation_coefficients_get(repaired, reference_mean, reference_std)[:, 0]
+        return (deviation_coeff*deviation_coeff).sum(axis=1), numpy.abs(deviation_coeff.sum(axis=1)), ga_applier
+
+    def test_direct_meets_fitness_range(self):
+        for noise_type in (CHROMA_NOISE, SALT_PEPPER_NOISE):
+            noisy_image = noisy_image_create(self.clean_image, noise_type, seed=0)
+            squared_deviations = dict()
+            for engine in (BATCHED_ENGINE, DIRECT_ENGINE):
+                with self.subTest(noise_type=noise_type, engine=engine):
+                    squared_deviations[engine], fitness, ga_applier = self.ga_apply(noisy_image, engine)
+                    capped_pixels = ga_applier.capped_pixels_get()
+                    self.assertEqual(capped_pixels["generations"], EXPECTED_CAPPED_PIXELS[(noise_type, engine)])
+                    self.assertEqual(capped_pixels["time_budget"], 0)
+
+                    # Only the capped pixels can be out of range:
+                    in_range = (MIN_DEVIATION_COEFFICIENT <= fitness) & (fitness <= MAX_DEVIATION_COEFFICIENT)
+                    self.assertGreaterEqual(int(in_range.sum()), len(fitness) - capped_pixels["generations"])
+
+            # Both repaired the same pixels, the direct solver with the
+            # values closest to the mean of their neighborhood:
+            self.assertEqual(len(squared_deviations[DIRECT_ENGINE]), len(squared_deviations[BATCHED_ENGINE]))
+            self.assertLessEqual(squared_deviations[DIRECT_ENGINE].mean(), squared_deviations[BATCHED_ENGINE].mean())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+import numpy
+
+from image_wrapper import ImageWrapper
+from ga_image_applier import GAImageApplier, PIXEL_ENGINE
+from frame_recorder import FrameRecorder
+from noise_corpus import noisy_image_create, SALT_PEPPER_NOISE
+from random_source import RandomSource
+
+IMAGE_SIZE = 20
+
+class FrameRecorderTest(unittest.TestCase):
+    """
+    The progress gif of 8 and 16 bits images, streamed by a
+    FrameRecorder or built from the resulting_images.
+    """
+    def setUp(self):
+        rng = numpy.random.default_rng(0)
+        clean = numpy.full((IMAGE_SIZE, IMAGE_SIZE, 3), 30000, dtype=numpy.uint16) +\
+            rng.integers(0, 500, (IMAGE_SIZE, IMAGE_SIZE, 3)).astype(numpy.uint16)
+        self.images = {
+            "16 bits": noisy_image_create(clean, SALT_PEPPER_NOISE, 0.05, seed=0),
+            "8 bits": noisy_image_create((clean >> 8).astype(numpy.uint8), SALT_PEPPER_NOISE, 0.05, seed=0)
+        }
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def ga_applier_create(self, image_array):
+        image = ImageWrapper("")
+        image.np_image_format_set(image_array.copy())
+        ga_applier = GAImageApplier()
+        ga_applier.image_obj_set(image)
+        ga_applier.engine_set(PIXEL_ENGINE)
+        ga_applier.verbose_set(False)
+        ga_applier.random_source_set(RandomSource(0))
+        return ga_applier
+
+    def test_frame_recorder(self):
+        for name, image_array in self.images.items():
+            with self.subTest(image=name):
+                gif_path = os.path.join(self.directory, "progress.gif")
+                ga_applier = self.ga_applier_create(image_array)
+                frame_recorder = FrameRecorder(gif_path, every_n_pixels=5)
+                ga_applier.frame_recorder_set(frame_recorder)
+                ga_applier.start_ga_over_image()
+
+                self.assertGreater(frame_recorder.frames_count_get(), 1)
+                with Image.open(gif_path) as gif:
+                    self.assertEqual(gif.size, (IMAGE_SIZE, IMAGE_SIZE))
+                    self.assertEqual(gif.n_frames, frame_recorder.frames_count_get())
+
+    def test_resulting_images_gif(self):
+        current_dir = os.getcwd()
+        os.chdir(self.directory)
+        self.addCleanup(os.chdir, current_dir)
+        for name, image_array in self.images.items():
+            with self.subTest(image=name):
+                ga_applier = self.ga_applier_create(image_array)
+                ga_applier.start_ga_over_image()
+                ga_applier.image_obj.create_gif_from_images(ga_applier.resulting_images_get(),
+                                                            ga_applier.list_of_rows_get())
+                with Image.open("result.gif") as gif:
+                    self.assertEqual(gif.size, (IMAGE_SIZE, IMAGE_SIZE))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from image_wrapper import ImageWrapper
+
+IMAGE_PATH = "images/lena_salt_pepper_noised.png"
+CROP_SIZE = 32
+RADII = (1, 2, 3)
+
+class NeighborhoodsTest(unittest.TestCase):
+    """
+    The neighborhoods of many pixels at once (neighborhoods_get, from
+    the padded windows or gathered from a memmap) against the original
+    neighborhood_get of each pixel.
+    """
+    def setUp(self):
+        image = ImageWrapper(IMAGE_PATH)
+        image.image_opener()
+        self.pixels = numpy.array(image.get_np_image_format()[:CROP_SIZE, :CROP_SIZE])
+        self.image = ImageWrapper("")
+        self.image.np_image_format_set(self.pixels.copy())
+        self.pixels_y, self.pixels_x = numpy.divmod(numpy.arange(CROP_SIZE*CROP_SIZE), CROP_SIZE)
+
+    def neighborhoods_check(self, image, radius):
+        neighborhoods, neighborhoods_valid = image.neighborhoods_get(self.pixels_y, self.pixels_x, radius)
+        for index, (j, i) in enumerate(zip(self.pixels_y, self.pixels_x)):
+            numpy.testing.assert_array_equal(neighborhoods[index][neighborhoods_valid[index]],
+                                             image.neighborhood_get(j, i, radius))
+        self.assertFalse(neighborhoods[~neighborhoods_valid].any())
+
+    def test_windows_match_neighborhood_get(self):
+        for radius in RADII:
+            with self.subTest(radius=radius):
+                self.neighborhoods_check(self.image, radius)
+
+    def test_memmap_is_gathered_without_padding(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "image.npy")
+            numpy.save(path, self.pixels)
+            image = ImageWrapper("")
+            image.np_image_format_set(numpy.load(path, mmap_mode="r"))
+            for radius in RADII:
+                with self.subTest(radius=radius):
+                    self.neighborhoods_check(image, radius)
+            self.assertIsInstance(image.get_np_image_format(), numpy.memmap)
+            with self.assertRaises(ValueError):
+                image.windows_get()
+            del image
+
+    def test_windows_follow_the_writes(self):
+        image_array = self.image.get_np_image_format()
+        self.image.neighborhoods_get(self.pixels_y, self.pixels_x)
+
+        # The image is still the same array, and the windows show the
+        # pixels written through the ImageWrapper:
+        self.image.new_pixel_set(5, 5, [1, 2, 3])
+        self.image.pixels_set(numpy.array([6, 7]), numpy.array([6, 7]), numpy.array([[4, 5, 6], [7, 8, 9]]))
+        self.assertIs(self.image.get_np_image_format(), image_array)
+        self.neighborhoods_check(self.image, None)
+
+        # ... and the pixels written in the array, after windows_reset:
+        image_array[10:12] = 0
+        self.image.windows_reset()
+        self.neighborhoods_check(self.image, None)
+
+if __name__ == "__main__":
+    unittest.main()
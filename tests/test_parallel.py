@@ -0,0 +1,45 @@
+import contextlib
+import io
+import unittest
+
+from ga_image_applier import GAImageApplier
+from parallel_ga_applier import ParallelGAApplier
+from streamed_ga_applier import StreamedGAApplier
+from tests.test_detection import image_crop_get
+
+IMAGE_PATH = "images/lena_gaussian_noised.png"
+
+class HaloTest(unittest.TestCase):
+    """
+    The tiles and the bands are read with a halo as wide as the radius
+    of the window, so they detect the same noisy pixels as the whole
+    image does, whatever the radius.
+    """
+    def test_radius(self):
+        for radius in (1, 2, 3):
+            with self.subTest(radius=radius):
+                ga_applier = GAImageApplier()
+                ga_applier.image_obj_set(image_crop_get(IMAGE_PATH))
+                ga_applier.neighborhood_radius_set(radius)
+                noise_mask, _ = ga_applier.noise_mask_calculate()
+
+                parallel_applier = ParallelGAApplier(2, tile_size=16, seed=0)
+                parallel_applier.neighborhood_radius_set(radius)
+                parallel_applier.image_obj_set(image_crop_get(IMAGE_PATH))
+                parallel_applier.verbose_set(False)
+                streamed_applier = StreamedGAApplier(band_height=16, seed=0)
+                streamed_image = image_crop_get(IMAGE_PATH)
+                streamed_image.neighborhood_radius_set(radius)
+                streamed_applier.image_obj_set(streamed_image)
+                streamed_applier.verbose_set(False)
+
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output):
+                    parallel_applier.start_ga_over_image()
+                    streamed_applier.start_ga_over_image()
+                self.assertEqual(output.getvalue(), "")
+                self.assertEqual(parallel_applier.noisy_pixels_num_get(), int(noise_mask.sum()))
+                self.assertEqual(streamed_applier.noisy_pixels_num_get(), int(noise_mask.sum()))
+
+if __name__ == "__main__":
+    unittest.main()
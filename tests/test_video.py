@@ -0,0 +1,57 @@
+import unittest
+
+import numpy
+
+from image_wrapper import ImageWrapper
+from video_ga_applier import VideoGAApplier, BLOCK_SIZE
+from ga_image_applier import ENGINES
+
+IMAGE_PATH = "images/lena_salt_pepper_noised.png"
+FRAME_SIZE = 64
+
+class StaticFrameTest(unittest.TestCase):
+    """
+    The frames without changes, or with changes in a few blocks, take
+    the rest of their result from the previous frame.
+    """
+    def setUp(self):
+        image = ImageWrapper(IMAGE_PATH)
+        image.image_opener()
+        self.frame = numpy.array(image.get_np_image_format()[:FRAME_SIZE, :FRAME_SIZE])
+
+    def test_identical_frames(self):
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                video_applier = VideoGAApplier(engine, seed=0)
+                video_applier.verbose_set(False)
+                first_result, _ = video_applier.frame_denoise(self.frame)
+                first_result = first_result.copy()
+                result, statistics = video_applier.frame_denoise(self.frame.copy())
+
+                numpy.testing.assert_array_equal(result, first_result)
+                self.assertEqual(statistics["dirty_pixels"], 0)
+                self.assertEqual(statistics["noisy_pixels"], 0)
+                self.assertEqual(statistics["warm_started_pixels"], 0)
+
+                # The frame after the static one still compares against
+                # the frames before it:
+                result, statistics = video_applier.frame_denoise(self.frame.copy())
+                numpy.testing.assert_array_equal(result, first_result)
+
+    def test_static_blocks_keep_the_previous_result(self):
+        video_applier = VideoGAApplier(seed=0)
+        video_applier.verbose_set(False)
+        first_result, _ = video_applier.frame_denoise(self.frame)
+        first_result = first_result.copy()
+
+        frame = self.frame.copy()
+        frame[2, 2] = 255 - frame[2, 2]
+        result, statistics = video_applier.frame_denoise(frame)
+
+        # Only the changed block, grown by the window, is processed again:
+        self.assertGreater(statistics["dirty_pixels"], 0)
+        self.assertLess(statistics["dirty_pixels"], FRAME_SIZE*FRAME_SIZE)
+        numpy.testing.assert_array_equal(result[2*BLOCK_SIZE:, 2*BLOCK_SIZE:], first_result[2*BLOCK_SIZE:, 2*BLOCK_SIZE:])
+
+if __name__ == "__main__":
+    unittest.main()
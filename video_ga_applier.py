@@ -0,0 +1,288 @@
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageSequence
+import numpy
+
+from image_wrapper import ImageWrapper
+from ga_image_applier import GAImageApplier, BATCHED_ENGINE, ENGINES, MAX_GENERATIONS, TIME_BUDGET
+from parallel_ga_applier import HALO
+from random_source import RandomSource
+
+"""
+The frames are compared in blocks of BLOCK_SIZE x BLOCK_SIZE pixels: a
+block with no changed pixel since the previous frame is static, and its
+detection and repair are taken from the previous frame. BLOCK_SIZE must
+be at least HALO, so the neighborhoods of a block only reach the blocks
+next to it.
+"""
+BLOCK_SIZE = 16
+
+# Frames encoded at the same time, at most, while the next ones are denoised:
+MAX_PENDING_FRAMES = 2
+
+def frames_read(source):
+    """
+    Reads the frames of a sequence, one at a time.
+
+    :param source: the path of a multi-frame image (animated gif,
+    multi-page tiff, ...), a directory of frames, a glob pattern of
+    frames or a list of paths. The frames of a directory or a pattern
+    are taken in the order of their names.
+    :return: an iterator over the frames, as numpy arrays
+    :rtype: generator
+    """
+    if isinstance(source, str) and os.path.isdir(source):
+        paths = sorted(os.path.join(source, name) for name in os.listdir(source))
+    elif isinstance(source, str) and glob.has_magic(source):
+        paths = sorted(glob.glob(source))
+    elif isinstance(source, str):
+        with Image.open(source) as sequence:
+            for frame in ImageSequence.Iterator(sequence):
+                yield numpy.array(frame.convert("RGB") if frame.mode == "P" else frame)
+        return
+    else:
+        paths = list(source)
+
+    for path in paths:
+        with Image.open(path) as frame:
+            yield numpy.array(frame)
+
+def frame_write(frame, path):
+    Image.fromarray(frame).save(path)
+
+class VideoGAApplier:
+    """
+    This class applies the GA over the frames of a video, where
+    consecutive frames are almost equal, so each frame only pays for
+    what changed since the previous one:
+
+    - The frames are compared in blocks (see BLOCK_SIZE). The blocks
+    next to a changed block are dirty too, since their neighborhoods
+    reach it. The static blocks keep the noise mask and the repaired
+    pixels of the previous frame, without detection nor GA.
+    - Only the pixels of the dirty blocks are detected again (see
+    GAImageApplier.noise_mask_update), and the noisy ones are repaired.
+    - A pixel that was noisy in the previous frame too starts its GA
+    with the chromosome found for it in the previous frame (a warm
+    start), which usually is fit again right away.
+    - The next frame is decoded, and the previous ones are encoded, in
+    background threads while the current frame is denoised.
+
+    The first frame, and any frame with a different shape than the
+    previous one, is processed whole.
+
+    :param engine: one of ENGINES
+    :param block_size: size of the blocks the frames are compared in
+    :param seed: seed of the video, each frame gets its own stream
+    spawned from it. None for a different run each time.
+    """
+    def __init__(self, engine=BATCHED_ENGINE, block_size=BLOCK_SIZE, seed=None):
+        if block_size < HALO:
+            raise ValueError("The blocks must be at least " + str(HALO) + " pixels wide")
+
+        self.engine = engine
+        self.block_size = block_size
+        self.seed_sequence = numpy.random.SeedSequence(seed)
+        self.max_generations = MAX_GENERATIONS
+        self.time_budget = TIME_BUDGET # Seconds for each frame
+        self.metrics = None # MetricsCollector, None to not collect metrics
+        self.verbose = True
+
+        # State of the previous frame:
+        self.previous_frame = None # The frame as it was read
+        self.previous_result = None # The denoised frame
+        self.previous_noise_mask = None
+
+    # -- Setters & getters --
+    def max_generations_set(self, max_generations):
+        self.max_generations = max_generations
+    def time_budget_set(self, time_budget):
+        self.time_budget = time_budget
+    def metrics_set(self, metrics):
+        self.metrics = metrics
+    def verbose_set(self, verbose):
+        self.verbose = verbose
+    # -- End of Setters & getters --
+
+    def dirty_mask_get(self, frame):
+        """
+        Finds the blocks that changed since the previous frame, grown by
+        one block in each direction.
+
+        :return: True for each pixel of a dirty block, with shape
+        (height, width)
+        :rtype: numpy array
+        """
+        image_height, image_width = frame.shape[:2]
+        blocks_height = -(-image_height//self.block_size)
+        blocks_width = -(-image_width//self.block_size)
+
+        changed = frame != self.previous_frame
+        if changed.ndim == 3:
+            changed = changed.any(axis=2)
+
+        # Padding the frame to whole blocks, to reduce each block to a value:
+        padded_changed = numpy.zeros((blocks_height*self.block_size, blocks_width*self.block_size), dtype=bool)
+        padded_changed[:image_height, :image_width] = changed
+        changed_blocks = padded_changed.reshape(blocks_height, self.block_size,
+                                                blocks_width, self.block_size).any(axis=(1, 3))
+
+        # Growing the changed blocks by one block:
+        dirty_blocks = numpy.zeros((blocks_height + 2, blocks_width + 2), dtype=bool)
+        for offset_y in range(3):
+            for offset_x in range(3):
+                dirty_blocks[offset_y:offset_y + blocks_height, offset_x:offset_x + blocks_width] |= changed_blocks
+        dirty_blocks = dirty_blocks[1:-1, 1:-1]
+
+        dirty_mask = dirty_blocks.repeat(self.block_size, axis=0).repeat(self.block_size, axis=1)
+        return dirty_mask[:image_height, :image_width]
+
+    def frame_denoise(self, frame):
+        """
+        Denoises the next frame of the video.
+
+        :param frame: numpy array of the frame, not modified
+        :return: the denoised frame, and the statistics of the frame
+        :rtype: tuple (numpy array, dict)
+        """
+        start_time = time.perf_counter()
+
+        image = ImageWrapper("")
+        image.np_image_format_set(frame.copy())
+
+        ga_applier = GAImageApplier()
+        ga_applier.image_obj_set(image)
+        ga_applier.engine_set(self.engine)
+        ga_applier.max_generations_set(self.max_generations)
+        ga_applier.time_budget_set(self.time_budget)
+        ga_applier.keep_resulting_images_set(False)
+        ga_applier.verbose_set(False)
+        ga_applier.random_source_set(RandomSource(self.seed_sequence.spawn(1)[0]))
+        if self.metrics is not None:
+            ga_applier.metrics_set(self.metrics)
+
+        statistics = {"pixels": frame.shape[0]*frame.shape[1]}
+
+        if self.previous_frame is None or self.previous_frame.shape != frame.shape:
+            # Nothing to reuse, the whole frame is processed:
+            noise_mask, _ = ga_applier.noise_mask_calculate()
+            ga_applier.start_ga_over_image()
+            result = image.get_np_image_format()
+
+            statistics["dirty_pixels"] = statistics["pixels"]
+            statistics["noisy_pixels"] = int(noise_mask.sum())
+            statistics["warm_started_pixels"] = 0
+        else:
+            dirty_mask = self.dirty_mask_get(frame)
+            dirty_y, dirty_x = numpy.nonzero(dirty_mask)
+            if len(dirty_y) == 0:
+                # A static frame, it gets the result and the detection
+                # of the previous frame:
+                self.previous_frame = frame
+                statistics["dirty_pixels"] = 0
+                statistics["noisy_pixels"] = 0
+                statistics["warm_started_pixels"] = 0
+                statistics["seconds"] = time.perf_counter() - start_time
+                return self.previous_result, statistics
+
+            # The static blocks keep the detection of the previous frame:
+            ga_applier.noise_mask_set(self.previous_noise_mask.copy())
+            ga_applier.deadline = time.monotonic() + self.time_budget if self.time_budget is not None else None
+            noisy = ga_applier.noise_mask_update(dirty_y, dirty_x)
+            noisy_y = dirty_y[noisy]
+            noisy_x = dirty_x[noisy]
+
+            # The pixels that were noisy in the previous frame start from
+            # the chromosome they got then:
+            seeds_valid = self.previous_noise_mask[noisy_y, noisy_x]
+            seed_chromosomes = self.previous_result[noisy_y, noisy_x].reshape((len(noisy_y), -1))
+            ga_applier.pixels_repair(noisy_y, noisy_x, seed_chromosomes, seeds_valid)
+
+            # ... and the static blocks keep the repaired pixels of the
+            # previous frame:
+            result = image.get_np_image_format()
+            result[~dirty_mask] = self.previous_result[~dirty_mask]
+            noise_mask = ga_applier.noise_mask_get()
+
+            statistics["dirty_pixels"] = len(dirty_y)
+            statistics["noisy_pixels"] = len(noisy_y)
+            statistics["warm_started_pixels"] = int(seeds_valid.sum())
+
+        self.previous_frame = frame
+        self.previous_result = numpy.array(result)
+        self.previous_noise_mask = noise_mask
+
+        statistics["seconds"] = time.perf_counter() - start_time
+        return self.previous_result, statistics
+
+    def video_denoise(self, source, output_dir):
+        """
+        Denoises all the frames of a video, writing each denoised frame
+        to output_dir as frame_000000.png, frame_000001.png, ...
+
+        Decoding, denoising and encoding are pipelined: the next frame
+        is decoded and the previous frames are encoded in background
+        threads (PIL releases the GIL while decoding and compressing),
+        while the current frame is denoised.
+
+        :param source: the frames, see frames_read
+        :param output_dir: directory where the frames are written
+        :return: the statistics of each frame
+        :rtype: list of dicts
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        frames = frames_read(source)
+        all_statistics = list()
+
+        with ThreadPoolExecutor(max_workers=1) as decoder, \
+                ThreadPoolExecutor(max_workers=MAX_PENDING_FRAMES) as encoder:
+            next_frame = decoder.submit(next, frames, None)
+            pending_writes = list()
+            frame_index = 0
+
+            while True:
+                frame = next_frame.result()
+                if frame is None:
+                    break
+                next_frame = decoder.submit(next, frames, None)
+
+                result, statistics = self.frame_denoise(frame)
+
+                # Bounding the frames waiting to be encoded:
+                while len(pending_writes) >= MAX_PENDING_FRAMES:
+                    pending_writes.pop(0).result()
+                pending_writes.append(encoder.submit(
+                    frame_write, result, os.path.join(output_dir, "frame_{:06d}.png".format(frame_index))))
+
+                statistics["frame"] = frame_index
+                all_statistics.append(statistics)
+                if self.verbose:
+                    print("Frame {:6d}: {:8.3f} s  dirty pixels: {:9d}  noisy: {:7d}  warm started: {:7d}".format(
+                        frame_index, statistics["seconds"], statistics["dirty_pixels"],
+                        statistics["noisy_pixels"], statistics["warm_started_pixels"]))
+                frame_index += 1
+
+            for pending_write in pending_writes:
+                pending_write.result()
+
+        return all_statistics
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Denoise the frames of a video")
+    parser.add_argument("source", help="multi-frame image, directory of frames or glob pattern of frames")
+    parser.add_argument("output_dir", help="directory where the denoised frames are written")
+    parser.add_argument("--engine", choices=ENGINES, default=BATCHED_ENGINE)
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max-generations", type=int, default=MAX_GENERATIONS)
+    parser.add_argument("--time-budget", type=float, default=TIME_BUDGET, help="seconds of GA per frame")
+    args = parser.parse_args()
+
+    video_applier = VideoGAApplier(args.engine, args.block_size, args.seed)
+    video_applier.max_generations_set(args.max_generations)
+    video_applier.time_budget_set(args.time_budget)
+    video_applier.video_denoise(args.source, args.output_dir)